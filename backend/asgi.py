@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_asgi_application()
+
+# Build the recommendation engine in the background while the server starts
+from recommender.loader import start_serving  # noqa: E402
+
+start_serving()
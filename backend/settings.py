@@ -43,7 +43,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'recommender.middleware.StaticFilesMiddleware',
+    'recommender.middleware.RequestMetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -133,6 +134,99 @@ SECURE_CONTENT_SECURITY_POLICY = {
     'default-src': ("'self'",),
 }
 
+# Recommendation engine
+RECOMMENDER_DATA_DIR = os.environ.get('RECOMMENDER_DATA_DIR', 'data')
+# Optional directory where the parsed CSV columns are kept as .npy files, so
+# later builds memory-map them instead of parsing the CSVs (unset = no cache).
+# `manage.py cache_recommender_data` fills it ahead of time.
+RECOMMENDER_INGEST_CACHE_DIR = os.environ.get('RECOMMENDER_INGEST_CACHE_DIR') or None
+# Build the engine in a background thread as soon as a serving process
+# starts (backend/wsgi.py, backend/asgi.py or runserver); requests that
+# arrive before it is ready get a popular-products fallback. Scripts, tests
+# and other management commands never build it.
+RECOMMENDER_WARMUP = os.environ.get('RECOMMENDER_WARMUP', 'True') == 'True'
+# Keep only this many similar products per product instead of the dense
+# product x product similarity matrix (unset = dense, fine for small catalogs)
+RECOMMENDER_SIMILARITY_TOP_K = int(os.environ.get('RECOMMENDER_SIMILARITY_TOP_K', 0)) or None
+# Similar-user lookup: 'exact' brute force or approximate 'ivf'; n_probe is
+# the recall/latency knob for 'ivf' (more probed clusters = higher recall)
+RECOMMENDER_USER_INDEX = os.environ.get('RECOMMENDER_USER_INDEX', 'exact')
+RECOMMENDER_USER_INDEX_OPTIONS = (
+    {'n_probe': int(os.environ.get('RECOMMENDER_USER_INDEX_PROBES', 8))}
+    if RECOMMENDER_USER_INDEX == 'ivf' else {}
+)
+# Hybrid score weight: alpha * collaborative + (1 - alpha) * content
+RECOMMENDER_HYBRID_ALPHA = float(os.environ.get('RECOMMENDER_HYBRID_ALPHA', 0.6))
+# Latent factors of the implicit ALS model trained on purchases and ratings
+# (served with ?strategy=factors; 0 skips training it)
+RECOMMENDER_FACTORS = int(os.environ.get('RECOMMENDER_FACTORS', 64))
+# Co-occurrence neighbours kept per product for item-item CF
+# (served with ?strategy=item_based; 0 skips building them)
+RECOMMENDER_ITEM_NEIGHBORS = int(os.environ.get('RECOMMENDER_ITEM_NEIGHBORS', 50))
+# Half-life, in transactions, of a purchase's weight in the trending ranking
+# of /api/recommend/popular/?trending=true (recency is transaction_id order)
+RECOMMENDER_POPULARITY_HALF_LIFE = int(os.environ.get('RECOMMENDER_POPULARITY_HALF_LIFE', 100000))
+# Cold-start users (no ratings or purchases yet) get the top products of their
+# (age bucket, gender, location) segment from users.csv: products kept per
+# segment (0 disables the index) and the active members a segment needs,
+# below which the coarser (age bucket, gender) and (age bucket) ones answer
+RECOMMENDER_SEGMENT_TOP_K = int(os.environ.get('RECOMMENDER_SEGMENT_TOP_K', 100))
+RECOMMENDER_SEGMENT_MIN_USERS = int(os.environ.get('RECOMMENDER_SEGMENT_MIN_USERS', 20))
+# Model builds: processes scoring neighbour-table chunks (-1 = every core) and
+# the memory the concurrent score blocks may use, which sets the chunk size.
+# Web workers that build from CSV keep one job; the build command can use more.
+RECOMMENDER_BUILD_JOBS = int(os.environ.get('RECOMMENDER_BUILD_JOBS', 1))
+RECOMMENDER_BUILD_MEMORY_BUDGET_MB = int(os.environ.get('RECOMMENDER_BUILD_MEMORY_BUDGET_MB', 512))
+
+# Versioned model snapshots written by `manage.py build_recommender_model`.
+# When a snapshot exists, workers memory-map it instead of refitting from CSV.
+RECOMMENDER_ARTIFACT_DIR = os.environ.get('RECOMMENDER_ARTIFACT_DIR', str(BASE_DIR / 'models'))
+# Seconds between checks for a newer snapshot, which is loaded in the
+# background and swapped in without a restart (0 disables hot reload)
+RECOMMENDER_RELOAD_INTERVAL = float(os.environ.get('RECOMMENDER_RELOAD_INTERVAL', 60))
+# Ingested batches kept in memory (while hot reload runs) for replay onto
+# snapshots built before them; the oldest are dropped beyond this many
+RECOMMENDER_INGEST_LOG_MAX_BATCHES = int(os.environ.get('RECOMMENDER_INGEST_LOG_MAX_BATCHES', 10000))
+
+# Serve the API with async views (for ASGI servers such as uvicorn). Scoring
+# runs in a bounded thread pool: beyond MAX_PENDING in-flight calls requests
+# get 503 + Retry-After, and calls slower than TIMEOUT seconds get 504.
+RECOMMENDER_ASYNC_VIEWS = os.environ.get('RECOMMENDER_ASYNC_VIEWS', 'False') == 'True'
+RECOMMENDER_OFFLOAD_THREADS = int(os.environ.get('RECOMMENDER_OFFLOAD_THREADS', 4))
+RECOMMENDER_OFFLOAD_MAX_PENDING = int(os.environ.get('RECOMMENDER_OFFLOAD_MAX_PENDING', 64))
+RECOMMENDER_OFFLOAD_TIMEOUT = float(os.environ.get('RECOMMENDER_OFFLOAD_TIMEOUT', 10))
+
+# Request metrics are exported at /api/metrics/ and every response carries a
+# Server-Timing header with the engine stage timings. With PROFILING on, a
+# request with ?profile=1 is answered with a sampling profile (collapsed
+# stacks, one sample every PROFILE_INTERVAL_MS) instead of its response.
+# With ASYNC_VIEWS only the work run in the offload pool is sampled, not the
+# event-loop thread, which idles or serves other requests meanwhile.
+RECOMMENDER_PROFILING = os.environ.get('RECOMMENDER_PROFILING', 'False') == 'True'
+RECOMMENDER_PROFILE_INTERVAL_MS = float(os.environ.get('RECOMMENDER_PROFILE_INTERVAL_MS', 1))
+
+# Recommendation results cache. LocMemCache is per process and evicts least
+# recently used entries once MAX_ENTRIES is reached; point the backend at
+# FileBasedCache (LOCATION = a directory) to share results across gunicorn
+# workers. Keys include the model version, so a new snapshot never serves
+# stale results. Set RECOMMENDER_CACHE_ALIAS to '' to disable caching.
+RECOMMENDER_CACHE_ALIAS = os.environ.get('RECOMMENDER_CACHE_ALIAS', 'recommendations')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'recommendations': {
+        'BACKEND': os.environ.get('RECOMMENDER_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('RECOMMENDER_CACHE_LOCATION', 'recommendations'),
+        'TIMEOUT': int(os.environ.get('RECOMMENDER_CACHE_TIMEOUT', 3600)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('RECOMMENDER_CACHE_MAX_ENTRIES', 10000)),
+            # Evict a tenth of the entries (least recently used first) when full
+            'CULL_FREQUENCY': 10,
+        },
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
 application = get_wsgi_application()
+
+# Build the recommendation engine in the background while the server starts
+from recommender.loader import start_serving  # noqa: E402
+
+start_serving()
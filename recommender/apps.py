@@ -1,3 +1,6 @@
+import os
+import sys
+
 from django.apps import AppConfig
 
 
@@ -6,6 +9,17 @@ class RecommenderConfig(AppConfig):
     name = 'recommender'
 
     def ready(self):
-        # Initialize the recommendation engine on startup
-        from .engine import get_engine
-        get_engine()
+        # Serving processes start the engine warm-up from backend/wsgi.py and
+        # backend/asgi.py. runserver only loads wsgi.py after its system and
+        # migration checks, so its serving process starts the build here
+        if self._is_runserver_process():
+            from .loader import start_serving
+            start_serving()
+
+    @staticmethod
+    def _is_runserver_process():
+        """True for the runserver process that serves requests"""
+        if os.path.basename(sys.argv[0]) != 'manage.py' or len(sys.argv) < 2 or sys.argv[1] != 'runserver':
+            return False
+        # The autoreloader parent only watches files; the child sets RUN_MAIN
+        return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv
@@ -0,0 +1,169 @@
+"""
+Versioned on-disk model snapshots for the recommendation engine.
+
+A snapshot is a directory ``<root>/<version>/`` holding one ``.npy`` file per
+dense array (sparse CSR matrices are split into data/indices/indptr), pickled
+DataFrames and a ``manifest.json``. Snapshots are written to a temporary
+directory and renamed into place, and the manifest is written last, so a
+version directory with a manifest is always complete. Arrays are loaded with
+``mmap_mode='r'`` so every worker process shares the same page-cache pages.
+"""
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+MANIFEST = 'manifest.json'
+# Bumped whenever the arrays or meta a snapshot must hold change; snapshots
+# in another format are not loaded and have to be rebuilt
+FORMAT_VERSION = 2
+
+
+def new_version():
+    """Sortable, unique-enough version string for a freshly built model"""
+    return datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S-%f')
+
+
+def list_versions(root):
+    """Complete snapshot versions under root, oldest first"""
+    if not root or not os.path.isdir(root):
+        return []
+    return sorted(
+        name for name in os.listdir(root)
+        if not name.startswith('.') and os.path.isfile(os.path.join(root, name, MANIFEST))
+    )
+
+
+def snapshot_format(root, version):
+    """Format number recorded in a snapshot's manifest"""
+    with open(os.path.join(root, version, MANIFEST)) as f:
+        return json.load(f).get('format')
+
+
+def latest_version(root):
+    """Newest complete snapshot version under root in the current format, or None"""
+    for version in reversed(list_versions(root)):
+        if snapshot_format(root, version) == FORMAT_VERSION:
+            return version
+    return None
+
+
+def _write_arrays(directory, arrays):
+    """Save arrays as .npy files (CSR split into parts) and return manifest entries"""
+    entries = {}
+    for name, value in arrays.items():
+        if value is None:
+            continue
+        if sp.issparse(value):
+            value = sp.csr_matrix(value)
+            for part in ('data', 'indices', 'indptr'):
+                np.save(os.path.join(directory, f'{name}.{part}.npy'), getattr(value, part))
+            entries[name] = {'type': 'csr', 'shape': list(value.shape)}
+        else:
+            np.save(os.path.join(directory, f'{name}.npy'), np.asarray(value))
+            entries[name] = {'type': 'ndarray'}
+    return entries
+
+
+def _publish(root, version, tmp_dir, manifest, keep):
+    """Write the manifest last, rename the snapshot into place and prune old versions"""
+    with open(os.path.join(tmp_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    path = os.path.join(root, version)
+    os.rename(tmp_dir, path)
+
+    if keep:
+        for old in list_versions(root)[:-keep]:
+            shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    return path
+
+
+def _new_tmp_dir(root, version):
+    """Fresh temporary directory for a snapshot that is being written"""
+    os.makedirs(root, exist_ok=True)
+    tmp_dir = os.path.join(root, f'.tmp-{version}')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    return tmp_dir
+
+
+def write_snapshot(root, version, arrays, frames, meta, keep=None):
+    """Write a snapshot directory and return its path.
+
+    ``arrays`` maps names to ndarrays or CSR matrices (None values are
+    skipped), ``frames`` maps names to DataFrames and ``meta`` is stored in
+    the manifest. With ``keep`` set, only that many newest versions remain.
+    """
+    tmp_dir = _new_tmp_dir(root, version)
+    entries = _write_arrays(tmp_dir, arrays)
+    for name, frame in frames.items():
+        if frame is not None:
+            frame.to_pickle(os.path.join(tmp_dir, f'{name}.pkl'))
+
+    manifest = {
+        'format': FORMAT_VERSION,
+        'version': version,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'arrays': entries,
+        'frames': sorted(name for name, frame in frames.items() if frame is not None),
+        'meta': meta,
+    }
+    return _publish(root, version, tmp_dir, manifest, keep)
+
+
+def derive_snapshot(root, base_version, version, arrays, meta, keep=None):
+    """Publish a new version that extends an existing snapshot with more arrays.
+
+    The base snapshot's files are hard-linked (copied when the filesystem
+    cannot link), so snapshots stay immutable and deriving one is cheap.
+    ``meta`` entries are merged into the base manifest's meta, so the
+    derived version keeps the base's ``data_version``.
+    """
+    base_dir = os.path.join(root, base_version)
+    with open(os.path.join(base_dir, MANIFEST)) as f:
+        manifest = json.load(f)
+
+    tmp_dir = _new_tmp_dir(root, version)
+    # New arrays go first: saving over a hard link would rewrite the base snapshot
+    manifest['arrays'].update(_write_arrays(tmp_dir, arrays))
+    for name in os.listdir(base_dir):
+        target = os.path.join(tmp_dir, name)
+        if name == MANIFEST or os.path.exists(target):
+            continue
+        try:
+            os.link(os.path.join(base_dir, name), target)
+        except OSError:
+            shutil.copy2(os.path.join(base_dir, name), target)
+
+    manifest['meta'].update(meta)
+    manifest['version'] = version
+    manifest['derived_from'] = base_version
+    manifest['created_at'] = datetime.now(timezone.utc).isoformat()
+    return _publish(root, version, tmp_dir, manifest, keep)
+
+
+def read_snapshot(path, mmap=True):
+    """Load a snapshot directory as (manifest, arrays, frames)"""
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported model snapshot format {manifest.get('format')} in {path}")
+
+    mmap_mode = 'r' if mmap else None
+    arrays = {}
+    for name, entry in manifest['arrays'].items():
+        if entry['type'] == 'csr':
+            data, indices, indptr = (
+                np.load(os.path.join(path, f'{name}.{part}.npy'), mmap_mode=mmap_mode)
+                for part in ('data', 'indices', 'indptr')
+            )
+            arrays[name] = sp.csr_matrix((data, indices, indptr), shape=tuple(entry['shape']), copy=False)
+        else:
+            arrays[name] = np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+
+    frames = {name: pd.read_pickle(os.path.join(path, f'{name}.pkl')) for name in manifest['frames']}
+    return manifest, arrays, frames
@@ -0,0 +1,169 @@
+"""
+Async versions of the API views for ASGI deployments.
+
+They share their logic with views.py, but every call that scores
+recommendations runs in the bounded offload pool, so a slow hybrid request
+no longer ties up a worker. A full pool answers 503 with Retry-After and a
+call that exceeds RECOMMENDER_OFFLOAD_TIMEOUT answers 504. Catalog endpoints
+are served from pre-rendered bytes and run inline.
+"""
+import asyncio
+
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from . import views
+from .filters import parse_filter
+from .loader import current_engine
+from .offload import Overloaded, get_pool
+
+
+def _overloaded_response():
+    """503 answer when the offload pool is full"""
+    response = JsonResponse({
+        'status': 'error',
+        'message': 'Recommendation engine is overloaded'
+    }, status=503)
+    response['Retry-After'] = '1'
+    return response
+
+
+def _timeout_response():
+    return JsonResponse({
+        'status': 'error',
+        'message': 'Recommendation request timed out'
+    }, status=504)
+
+
+@require_http_methods(["GET"])
+async def recommend_similar(request, product_id):
+    """API endpoint for content-based recommendations (filters: see filters.py)"""
+    try:
+        n = int(request.GET.get('n', 5))
+        filters = parse_filter(request.GET)
+        engine = current_engine()
+        recommendations = await get_pool().run(views._similar_recommendations, engine, product_id, n, filters)
+
+        return JsonResponse({
+            'status': 'success',
+            'product_id': product_id,
+            'filters': views._filters_echo(filters),
+            'recommendations': recommendations,
+            'fallback': engine is None
+        })
+    except Overloaded:
+        return _overloaded_response()
+    except asyncio.TimeoutError:
+        return _timeout_response()
+    except Exception as e:
+        return views._error_response(e)
+
+
+@require_http_methods(["GET"])
+async def recommend_for_user(request, user_id):
+    """API endpoint for user recommendations (?strategy=hybrid|collaborative|factors|item_based, filters)"""
+    try:
+        n = int(request.GET.get('n', 5))
+        strategy = views._user_strategy(request.GET.get('strategy', 'hybrid'))
+        filters = parse_filter(request.GET)
+        engine = current_engine()
+        recommendations = await get_pool().run(views._user_recommendations, engine, user_id, n, strategy, filters)
+
+        return JsonResponse({
+            'status': 'success',
+            'user_id': user_id,
+            'strategy': strategy,
+            'filters': views._filters_echo(filters),
+            'recommendations': recommendations,
+            'fallback': engine is None
+        })
+    except Overloaded:
+        return _overloaded_response()
+    except asyncio.TimeoutError:
+        return _timeout_response()
+    except Exception as e:
+        return views._error_response(e)
+
+
+@require_http_methods(["GET"])
+async def recommend_popular(request):
+    """API endpoint for popular products; slicing a precomputed ranking runs inline"""
+    try:
+        n, category, location, trending = views._popular_params(request)
+        engine = current_engine()
+        recommendations = views._popular_recommendations(engine, n, category, location, trending)
+
+        return JsonResponse({
+            'status': 'success',
+            'category': category,
+            'location': location,
+            'trending': trending,
+            'recommendations': recommendations,
+            'fallback': engine is None
+        })
+    except Exception as e:
+        return views._error_response(e)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def recommend_batch(request):
+    """API endpoint for batch recommendations, streamed back as NDJSON.
+
+    Each chunk is scored in the offload pool. Once streaming has started the
+    status can no longer change, so a chunk that is rejected or times out
+    ends the stream early.
+    """
+    try:
+        kind, ids, n, strategy, filters = views._parse_batch(request)
+    except (ValueError, TypeError, KeyError) as e:
+        return views._error_response(f'Invalid batch request: {e}')
+
+    engine = current_engine()
+    if engine is None:
+        return views._warming_up_response()
+    pool = get_pool()
+    if pool.saturated():
+        return _overloaded_response()
+
+    async def stream():
+        for start in range(0, len(ids), views.BATCH_CHUNK_SIZE):
+            chunk = ids[start:start + views.BATCH_CHUNK_SIZE]
+            try:
+                yield await pool.run(views._batch_chunk, engine, kind, chunk, n, strategy, filters)
+            except (Overloaded, asyncio.TimeoutError) as e:
+                print(f"Batch recommendation stream stopped after {start} ids: {e!r}")
+                return
+
+    return StreamingHttpResponse(stream(), content_type='application/x-ndjson')
+
+
+@require_http_methods(["GET"])
+async def products_list(request):
+    """Get all products, or one page of them with ?page=&page_size="""
+    try:
+        return views._products_list_response(request, current_engine())
+    except Exception as e:
+        return views._error_response(e)
+
+
+@require_http_methods(["GET"])
+async def product_detail(request, product_id):
+    """Get product details"""
+    try:
+        return views._product_detail_response(current_engine(), product_id)
+    except Exception as e:
+        return views._error_response(e)
+
+
+@require_http_methods(["GET"])
+async def readiness(request):
+    """Readiness probe: 200 once the engine is built, 503 while warming up"""
+    return views._readiness_response(current_engine())
+
+
+@require_http_methods(["GET"])
+async def metrics_view(request):
+    """Metrics endpoint for Prometheus scrapes"""
+    return views._metrics_response(current_engine())
@@ -0,0 +1,64 @@
+"""
+Recommendation result cache on top of Django's cache framework.
+
+Results only change with the model, so keys carry the model version (and the
+ingest revision for user recommendations, which ingested ratings change).
+The cache alias is configured in settings.CACHES; hit/miss counters are kept
+per process.
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import InvalidCacheBackendError, caches
+
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _cache():
+    """The configured recommendations cache, or None when caching is disabled"""
+    alias = getattr(settings, 'RECOMMENDER_CACHE_ALIAS', None)
+    if not alias:
+        return None
+    try:
+        return caches[alias]
+    except InvalidCacheBackendError:
+        return None
+
+
+def get_or_compute(endpoint, item_id, n_recommendations, version, compute):
+    """Return the cached result for the key, calling compute() on a miss"""
+    cache = _cache()
+    if cache is None:
+        return compute()
+    key = f'recommend:{endpoint}:{item_id}:{n_recommendations}:{version}'
+    value = cache.get(key)
+    if value is not None:
+        _count('hits')
+        return value
+    _count('misses')
+    value = compute()
+    cache.set(key, value)
+    return value
+
+
+def invalidate():
+    """Drop every cached result, e.g. after a new model snapshot is swapped in"""
+    cache = _cache()
+    if cache is not None:
+        cache.clear()
+        _count('invalidations')
+
+
+def cache_stats():
+    """Hit/miss counters of this process plus the hit ratio"""
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+    return stats
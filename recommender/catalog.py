@@ -0,0 +1,96 @@
+"""
+Pre-rendered JSON for the catalog endpoints.
+
+The catalog only changes with a new model snapshot, so every product is
+serialized once per snapshot and list responses are assembled by joining
+those bytes instead of materializing every record on each request.
+Rendering is lazy, so processes that never serve the catalog (for example
+the precompute workers) do not pay for it.
+"""
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+from django.core.serializers.json import DjangoJSONEncoder
+
+# A rendered response body, its gzip encoding and a strong ETag
+RenderedPage = namedtuple('RenderedPage', ['body', 'gzipped', 'etag'])
+
+# Rendered pages kept per snapshot (least recently used are dropped)
+PAGE_CACHE_SIZE = 256
+
+
+def _dumps(value):
+    """Serialize like JsonResponse does"""
+    return json.dumps(value, cls=DjangoJSONEncoder).encode()
+
+
+class CatalogCache:
+    """Serialized product records plus full-list and paginated list responses"""
+
+    def __init__(self, product_store, product_positions):
+        self.product_store = product_store
+        self.product_positions = product_positions
+        self.items = None
+        self.full = None
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _render(self):
+        """Serialize every product once; called lazily under the lock"""
+        records = self.product_store.records(np.arange(self.product_store.n_rows))
+        items = [_dumps(record) for record in records]
+        body = b'{"status": "success", "products": [' + b', '.join(items) + b']}'
+        self.full = self._page(body)
+        self.items = items
+
+    @staticmethod
+    def _page(body):
+        """Wrap a body with its gzip encoding and an ETag derived from the content"""
+        digest = hashlib.blake2b(body, digest_size=12).hexdigest()
+        return RenderedPage(body, gzip.compress(body, compresslevel=6), f'"{digest}"')
+
+    def _ensure_rendered(self):
+        """Render on first use; later calls only check a flag"""
+        if self.items is None:
+            with self._lock:
+                if self.items is None:
+                    self._render()
+
+    def product(self, product_id):
+        """Serialized record of one product, or None when it is not in the catalog"""
+        position = self.product_positions.get(product_id)
+        if position is None:
+            return None
+        self._ensure_rendered()
+        return self.items[position]
+
+    def page(self, page=None, page_size=None):
+        """Rendered list response: the full catalog, or one 1-based page of it"""
+        self._ensure_rendered()
+        if page is None:
+            return self.full
+        if page < 1 or page_size < 1:
+            raise ValueError('page and page_size must be positive')
+
+        key = (page, page_size)
+        with self._lock:
+            rendered = self._pages.get(key)
+            if rendered is not None:
+                self._pages.move_to_end(key)
+                return rendered
+
+        start = (page - 1) * page_size
+        body = (
+            b'{"status": "success", "products": [' + b', '.join(self.items[start:start + page_size])
+            + b'], ' + _dumps({'page': page, 'page_size': page_size, 'total': len(self.items)})[1:]
+        )
+        rendered = self._page(body)
+        with self._lock:
+            self._pages[key] = rendered
+            if len(self._pages) > PAGE_CACHE_SIZE:
+                self._pages.popitem(last=False)
+        return rendered
@@ -1,235 +1,1151 @@
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+from joblib import effective_n_jobs
+from threadpoolctl import threadpool_limits
 import os
+import copy
 import json
+from . import metrics
+from .artifacts import MANIFEST, latest_version, new_version, read_snapshot, write_snapshot
+from .catalog import CatalogCache
+from .factorization import ImplicitALS
+from .ingest import CHUNK_ROWS, read_columns, read_frame
+from .matrices import DeltaMatrix, add_cells, append_positions, set_cells
+from .neighbors import (
+    DEFAULT_MEMORY_BUDGET, NEIGHBOR_INDEXES, NeighborTable, build_neighbor_index, topk_cosine_neighbors, topk_from_block
+)
+from .popularity import DEFAULT_HALF_LIFE, PopularityRankings
+from .segments import SegmentIndex, user_demographics
+from .store import FilterIndex, ProductStore
 
 class RecommendationEngine:
-    def __init__(self, data_dir='data'):
+    def __init__(self, data_dir='data', similarity_top_k=None, similarity_chunk_size=None,
+                 user_index='exact', user_index_options=None, hybrid_alpha=0.6, artifact_dir=None,
+                 build_jobs=1, build_memory_budget=DEFAULT_MEMORY_BUDGET, ingest_cache_dir=None,
+                 n_factors=64, item_neighbors=50, popularity_half_life=DEFAULT_HALF_LIFE,
+                 segment_top_k=100, segment_min_users=20):
         self.data_dir = data_dir
+        # Optional directory for the parsed CSV columns as .npy (see ingest.py)
+        self.ingest_cache_dir = ingest_cache_dir
+        # None keeps the full dense product similarity matrix; an int keeps
+        # only that many neighbours per product (built in bounded chunks)
+        self.similarity_top_k = similarity_top_k
+        self.similarity_chunk_size = similarity_chunk_size
+        # Processes used for neighbour tables (-1 = every core) and the bytes
+        # their score blocks may use; None chunk size derives from the budget
+        self.build_jobs = build_jobs
+        self.build_memory_budget = build_memory_budget
+        # Neighbour index used to find similar users: 'exact' brute force or
+        # the approximate 'ivf' index (tune recall/latency with n_probe)
+        self.user_index_kind = user_index
+        self.user_index_options = user_index_options or {}
+        # Source DataFrame, only kept when building from CSV; serving reads product_store
         self.products = None
+        self.product_store = None
         self.users = None
+        # Transactions and ratings are dicts of compact column arrays
         self.transactions = None
         self.ratings = None
+        self.vectorizer = None
         self.tfidf_matrix = None
         self.user_item_matrix = None
         self.product_similarity = None
-        self.user_similarity = None
-        self.load_data()
-        self.build_models()
+        self.product_neighbors = None
+        self.product_ids = None
+        self.product_positions = None
+        # Pre-rendered catalog JSON, shared by incremental snapshots of one model
+        self.catalog = None
+        # Category, brand, price and stock indexes for filtered recommendations
+        self.filter_index = None
+        self.user_ids = None
+        self.user_positions = None
+        self.user_index = None
+        # Purchase and rating strengths per (user, product): input of the
+        # factor model and the item neighbours, and the history item-based
+        # recommendations score. Ingested batches keep it current
+        self.interactions = None
+        self.interaction_user_ids = None
+        self.interaction_positions = None
+        # Implicit ALS over purchases and ratings (0 factors disables it). Its
+        # user rows cover everyone who bought or rated something; they are
+        # refreshed by full builds only, while ingested batches update the
+        # interactions it masks as already seen
+        self.n_factors = n_factors
+        self.factor_model = None
+        self.factor_user_ids = None
+        self.factor_user_positions = None
+        # Item-item CF: top-k co-occurrence neighbours per product (0 disables)
+        # and the same table as a sparse matrix for scoring
+        self.item_neighbors_k = item_neighbors
+        self.item_neighbors = None
+        self.item_similarity = None
+        # Popularity counters and precomputed rankings (global, per category,
+        # per user location, trending); the fallback slices these
+        self.popularity_half_life = popularity_half_life
+        self.popularity = None
+        # Cold-start index: top products per (age bucket, gender, location)
+        # segment of users.csv (0 disables it); segments with fewer active
+        # members than segment_min_users defer to coarser ones. Refreshed by
+        # full builds only
+        self.segment_top_k = segment_top_k
+        self.segment_min_users = segment_min_users
+        self.segments = None
+        # Neighbourhood size for user-based collaborative filtering
+        self.collaborative_neighbors = 9
+        # Hybrid score = alpha * collaborative + (1 - alpha) * content
+        self.hybrid_alpha = hybrid_alpha
+        # Content candidates taken from each user's favourite product
+        self.hybrid_content_neighbors = 20
+        self.model_version = None
+        # When the data behind model_version started loading, as a version
+        # string: batches ingested earlier are in the model, later ones not
+        self.data_version = None
+        # Number of incremental ingest batches applied on top of model_version
+        self.revision = 0
+        # Offline hybrid results (see precompute.py): one row of product
+        # positions per user row, -1 padded; users whose ratings changed since
+        # are flagged stale and scored live
+        self.precomputed = None
+        self.precomputed_stale = None
+        if artifact_dir:
+            self.load_artifacts(artifact_dir)
+        else:
+            self.load_data()
+            self.build_models()
 
+    @metrics.build_step('load_data')
     def load_data(self):
-        """Load CSV files once at startup"""
+        """Load CSV files once at startup, streamed with compact dtypes"""
         try:
-            self.products = pd.read_csv(os.path.join(self.data_dir, 'products.csv'))
-            self.users = pd.read_csv(os.path.join(self.data_dir, 'users.csv'))
-            self.transactions = pd.read_csv(os.path.join(self.data_dir, 'transactions.csv'))
-            self.ratings = pd.read_csv(os.path.join(self.data_dir, 'ratings.csv'))
+            self.data_version = new_version()
+            cache_dir = self.ingest_cache_dir
+            self.products = read_frame(self.data_dir, 'products', cache_dir=cache_dir)
+            self.users = read_frame(self.data_dir, 'users', cache_dir=cache_dir)
+            self.transactions = read_columns(self.data_dir, 'transactions', cache_dir=cache_dir)
+            self.ratings = read_columns(self.data_dir, 'ratings', cache_dir=cache_dir)
             print("Data loaded successfully")
         except Exception as e:
             print(f"Error loading data: {e}")
             raise
 
+    @metrics.build_step('build_models')
     def build_models(self):
         """Build TF-IDF and collaborative filtering models"""
-        self._build_tfidf_model()
-        self._build_user_item_matrix()
-        self._build_user_similarity()
+        # Sequential steps get one BLAS thread per build job; pool workers pin their own to one
+        with threadpool_limits(effective_n_jobs(self.build_jobs)):
+            self._build_tfidf_model()
+            self._build_product_index()
+            self._build_user_item_matrix()
+            self._build_user_index()
+            self._build_popularity()
+            self._build_interactions()
+            self._build_segments()
+            self._build_factor_model()
+            self._build_item_neighbors()
+        self.model_version = new_version()
 
+    def save_artifacts(self, root, keep=None):
+        """Write the fitted models to a new versioned snapshot under root"""
+        index_params, index_arrays = self.user_index.state() if self.user_index is not None else ({}, {})
+        arrays = {
+            'idf': self.vectorizer.idf_ if self.vectorizer is not None else None,
+            'tfidf_matrix': self.tfidf_matrix,
+            'product_similarity': self.product_similarity,
+            'user_item_matrix': self.user_item_matrix.tocsr() if self.user_item_matrix is not None else None,
+            'user_ids': self.user_ids,
+            'interactions': self.interactions.tocsr() if self.interactions is not None else None,
+            'interaction_user_ids': self.interaction_user_ids,
+        }
+        for name, table in (('product_neighbors', self.product_neighbors), ('item_neighbors', self.item_neighbors)):
+            if table is not None:
+                arrays[f'{name}.indices'] = table.indices
+                arrays[f'{name}.scores'] = table.scores
+        arrays.update({f'user_index.{name}': value for name, value in index_arrays.items()})
+        store_params, store_arrays = self.product_store.state()
+        arrays.update({f'product_store.{name}': value for name, value in store_arrays.items()})
+        popularity_params, popularity_arrays = self.popularity.state()
+        arrays.update({f'popularity.{name}': value for name, value in popularity_arrays.items()})
+        segment_params = None
+        if self.segments is not None:
+            segment_params, segment_arrays = self.segments.state()
+            arrays.update({f'segments.{name}': value for name, value in segment_arrays.items()})
+        factor_params = None
+        if self.factor_model is not None:
+            factor_params, factor_arrays = self.factor_model.state()
+            # The model masks the engine's interactions, saved above
+            factor_arrays.pop('interactions')
+            arrays.update({f'factors.{name}': value for name, value in factor_arrays.items()})
+            arrays['factors.user_ids'] = self.factor_user_ids
+        meta = {
+            'data_version': self.data_version,
+            'product_store': store_params,
+            'factors': factor_params,
+            'popularity': popularity_params,
+            'segments': segment_params,
+            'similarity_top_k': self.similarity_top_k,
+            'user_index': {'kind': self.user_index_kind, 'params': index_params} if self.user_index is not None else None,
+            'vocabulary': {term: int(i) for term, i in self.vectorizer.vocabulary_.items()} if self.vectorizer is not None else None,
+        }
+        frames = {'users': self.users}
+        path = write_snapshot(root, self.model_version, arrays, frames, meta, keep=keep)
+        print(f"Model artifacts saved to {path}")
+        return path
+
+    @metrics.build_step('load_artifacts')
+    def load_artifacts(self, path):
+        """Load a snapshot (or the newest one under a root directory) memory-mapped"""
+        if not os.path.isfile(os.path.join(path, MANIFEST)):
+            version = latest_version(path)
+            if version is None:
+                raise FileNotFoundError(f"No model artifacts found in {path}")
+            path = os.path.join(path, version)
+
+        manifest, arrays, frames = read_snapshot(path)
+        meta = manifest['meta']
+        self.model_version = manifest['version']
+        self.data_version = meta['data_version']
+        prefix = 'product_store.'
+        self.product_store = ProductStore.from_state(
+            meta['product_store'],
+            {name[len(prefix):]: value for name, value in arrays.items() if name.startswith(prefix)}
+        )
+        self.users = frames.get('users')
+        self._build_product_index()
+
+        if meta['vocabulary'] is not None:
+            self.vectorizer = TfidfVectorizer(stop_words='english', vocabulary=meta['vocabulary'])
+            self.vectorizer.idf_ = arrays['idf']
+        self.tfidf_matrix = arrays.get('tfidf_matrix')
+        self.similarity_top_k = meta['similarity_top_k']
+        self.product_similarity = arrays.get('product_similarity')
+        if 'product_neighbors.indices' in arrays:
+            self.product_neighbors = NeighborTable(
+                arrays['product_neighbors.indices'], arrays['product_neighbors.scores']
+            )
+
+        self.user_item_matrix = arrays.get('user_item_matrix')
+        self.user_ids = arrays.get('user_ids')
+        if self.user_ids is not None:
+            self.user_positions = {user_id: row for row, user_id in enumerate(self.user_ids.tolist())}
+        self.interactions = arrays.get('interactions')
+        self.interaction_user_ids = arrays.get('interaction_user_ids')
+        if self.interaction_user_ids is not None:
+            self.interaction_positions = {
+                user_id: row for row, user_id in enumerate(self.interaction_user_ids.tolist())
+            }
+        if meta['user_index'] is not None:
+            self.user_index_kind = meta['user_index']['kind']
+            prefix = 'user_index.'
+            self.user_index = NEIGHBOR_INDEXES[self.user_index_kind].from_state(
+                meta['user_index']['params'],
+                {name[len(prefix):]: value for name, value in arrays.items() if name.startswith(prefix)}
+            )
+        prefix = 'popularity.'
+        self.popularity = PopularityRankings.from_state(
+            meta['popularity'],
+            {name[len(prefix):]: value for name, value in arrays.items() if name.startswith(prefix)}
+        )
+        if meta.get('segments') is not None:
+            prefix = 'segments.'
+            self.segments = SegmentIndex.from_state(
+                meta['segments'],
+                {name[len(prefix):]: value for name, value in arrays.items() if name.startswith(prefix)}
+            )
+        if meta.get('factors') is not None:
+            prefix = 'factors.'
+            factor_arrays = {name[len(prefix):]: value for name, value in arrays.items() if name.startswith(prefix)}
+            self.factor_user_ids = factor_arrays.pop('user_ids')
+            self.factor_user_positions = {user_id: row for row, user_id in enumerate(self.factor_user_ids.tolist())}
+            factor_arrays['interactions'] = self.interactions
+            self.factor_model = ImplicitALS.from_state(meta['factors'], factor_arrays)
+        if 'item_neighbors.indices' in arrays:
+            self.item_neighbors = NeighborTable(arrays['item_neighbors.indices'], arrays['item_neighbors.scores'])
+            self.item_similarity = self._neighbor_matrix(self.item_neighbors)
+        self.precomputed = arrays.get('precomputed_recommendations')
+        if self.precomputed is not None and meta['precomputed'].get('alpha') != self.hybrid_alpha:
+            print(f"Ignoring precomputed recommendations scored with alpha={meta['precomputed'].get('alpha')}")
+            self.precomputed = None
+        print(f"Model artifacts loaded from {path}")
+
+    def prime(self):
+        """Fault memory-mapped arrays into memory and run sample queries.
+
+        Called before a freshly loaded snapshot starts serving, so the first
+        requests against it do not pay for page faults or lazy setup.
+        """
+        arrays = [self.product_similarity, self.product_ids, self.user_ids, self.precomputed]
+        for table in (self.product_neighbors, self.item_neighbors):
+            if table is not None:
+                arrays.extend(table)
+        matrices = [self.tfidf_matrix]
+        for matrix in (self.user_item_matrix, self.interactions):
+            matrices.extend([matrix.base, matrix.delta] if isinstance(matrix, DeltaMatrix) else [matrix])
+        for matrix in matrices:
+            if matrix is not None:
+                arrays.extend([matrix.data, matrix.indices, matrix.indptr])
+        for model in (self.user_index, self.factor_model, self.popularity, self.segments):
+            if model is not None:
+                for value in model.state()[1].values():
+                    if not isinstance(value, DeltaMatrix):
+                        arrays.extend([value.data, value.indices, value.indptr] if sp.issparse(value) else [value])
+        arrays.extend(self.product_store.arrays.values())
+        for array in arrays:
+            if array is not None and array.size:
+                # Reading one element per 4 KiB page is enough to load it
+                flat = array.reshape(-1)
+                flat[::max(1, 4096 // array.itemsize)].sum()
+
+        # Render the catalog JSON now rather than on the first catalog request
+        self.catalog.page()
+        self.filter_index.prepare()
+        if len(self.product_ids):
+            self.get_content_based_recommendations(self.product_ids[0])
+        if self.user_ids is not None and len(self.user_ids):
+            self.get_hybrid_recommendations(self.user_ids[0])
+
+    @metrics.build_step('product_index')
+    def _build_product_index(self):
+        """Map product_id to its catalog row position"""
+        if self.product_store is None:
+            self.product_store = ProductStore.from_frame(self.products)
+        self.product_ids = self.product_store.column('product_id')
+        self.product_positions = {}
+        for position, product_id in enumerate(self.product_ids.tolist()):
+            # First row wins, matching the previous boolean-mask lookup
+            self.product_positions.setdefault(product_id, position)
+        self.catalog = CatalogCache(self.product_store, self.product_positions)
+        self.filter_index = FilterIndex(self.product_store)
+
+    @metrics.build_step('tfidf')
     def _build_tfidf_model(self):
         """Build TF-IDF model for content-based filtering"""
         try:
             # Combine product attributes
+            # Categorical columns cannot take '' as a fill value, so go through object
             self.products['combined_features'] = (
-                self.products.get('product_name', '').fillna('').astype(str) + ' ' +
-                self.products.get('category', '').fillna('').astype(str) + ' ' +
-                self.products.get('brand', '').fillna('').astype(str)
+                self.products.get('product_name', '').astype(object).fillna('').astype(str) + ' ' +
+                self.products.get('category', '').astype(object).fillna('').astype(str) + ' ' +
+                self.products.get('brand', '').astype(object).fillna('').astype(str)
             )
             
-            vectorizer = TfidfVectorizer(max_features=100, stop_words='english')
-            self.tfidf_matrix = vectorizer.fit_transform(self.products['combined_features'])
-            self.product_similarity = cosine_similarity(self.tfidf_matrix)
+            self.vectorizer = TfidfVectorizer(max_features=100, stop_words='english')
+            self.tfidf_matrix = self.vectorizer.fit_transform(self.products['combined_features'])
+            if self.similarity_top_k:
+                self.product_neighbors = topk_cosine_neighbors(
+                    self.tfidf_matrix,
+                    self.similarity_top_k,
+                    chunk_size=self.similarity_chunk_size,
+                    n_jobs=self.build_jobs,
+                    memory_budget=self.build_memory_budget
+                )
+            else:
+                self.product_similarity = cosine_similarity(self.tfidf_matrix)
             print("TF-IDF model built successfully")
         except Exception as e:
             print(f"Error building TF-IDF model: {e}")
 
+    def _catalog_columns(self, product_ids):
+        """Catalog row of each product id (-1 if unknown), mapped chunk by chunk into int32"""
+        index = pd.Index(self.product_ids)
+        columns = np.empty(len(product_ids), dtype=np.int32)
+        for start in range(0, len(product_ids), CHUNK_ROWS):
+            columns[start:start + CHUNK_ROWS] = index.get_indexer(np.asarray(product_ids[start:start + CHUNK_ROWS]))
+        return columns
+
+    @metrics.build_step('user_item_matrix')
     def _build_user_item_matrix(self):
-        """Build user-item rating matrix for collaborative filtering"""
-        try:
-            if self.ratings is not None and len(self.ratings) > 0:
-                self.user_item_matrix = self.ratings.pivot_table(
-                    index='user_id',
-                    columns='product_id',
-                    values='rating',
-                    fill_value=0
+        """Build the sparse user-item rating matrix for collaborative filtering.
+
+        Rows follow the sorted user ids in self.user_ids and columns follow the
+        catalog rows of self.products. Repeated (user, product) ratings are
+        averaged like pivot_table did; ratings for products missing from the
+        catalog are dropped since they can never be recommended.
+        """
+        try:
+            if self.ratings is not None and len(self.ratings['user_id']) > 0:
+                columns = self._catalog_columns(self.ratings['product_id'])
+                in_catalog = columns >= 0
+                self.user_ids, rows = np.unique(
+                    np.asarray(self.ratings['user_id'])[in_catalog], return_inverse=True
                 )
+                columns = columns[in_catalog]
+                values = np.asarray(self.ratings['rating'])[in_catalog].astype(np.float32)
+                shape = (len(self.user_ids), len(self.product_ids))
+
+                # COO -> CSR sums duplicates; divide by their count to average
+                sums = sp.csr_matrix((values, (rows, columns)), shape=shape, dtype=np.float32)
+                sums.sort_indices()
+                if sums.nnz < len(values):
+                    counts = sp.csr_matrix((np.ones_like(values), (rows, columns)), shape=shape, dtype=np.float32)
+                    counts.sort_indices()
+                    sums.data /= counts.data
+                self.user_item_matrix = sums
+                self.user_positions = {user_id: row for row, user_id in enumerate(self.user_ids.tolist())}
                 print("User-item matrix built successfully")
             else:
                 print("No ratings data available")
         except Exception as e:
             print(f"Error building user-item matrix: {e}")
 
-    def _build_user_similarity(self):
-        """Build user similarity matrix using cosine similarity"""
+    @metrics.build_step('user_index')
+    def _build_user_index(self):
+        """Build the user neighbour index used by collaborative filtering"""
         try:
             if self.user_item_matrix is not None and self.user_item_matrix.shape[0] > 0:
-                self.user_similarity = cosine_similarity(self.user_item_matrix)
-                print("User similarity matrix built successfully")
+                self.user_index = build_neighbor_index(
+                    self.user_index_kind, self.user_item_matrix, **self.user_index_options
+                )
+                print("User neighbour index built successfully")
+        except Exception as e:
+            print(f"Error building user neighbour index: {e}")
+
+    def _category_codes(self):
+        """(category code per catalog row, category names) from the product store"""
+        store = self.product_store
+        if dict(store.columns).get('category') != 'categorical':
+            return np.full(store.n_rows, -1, dtype=np.int32), []
+        return store.arrays['category.codes'], store.categories['category'][:-1]
+
+    @metrics.build_step('popularity')
+    def _build_popularity(self):
+        """Count ratings and purchased quantity per catalog product and rank them"""
+        n_products = len(self.product_ids)
+        rating_counts = np.zeros(n_products, dtype=np.int64)
+        purchase_counts = np.zeros(n_products, dtype=np.int64)
+        purchases = None
+        user_locations = None
+        location_names = []
+        try:
+            if self.user_item_matrix is not None:
+                rating_counts = np.bincount(self.user_item_matrix.indices, minlength=n_products)
+            if self.transactions is not None and len(self.transactions['product_id']) > 0:
+                columns = self._catalog_columns(self.transactions['product_id'])
+                in_catalog = columns >= 0
+                # Without ids, file order stands in for recency
+                transaction_ids = self.transactions.get('transaction_id', np.arange(1, len(columns) + 1))
+                purchases = {
+                    'column': columns[in_catalog],
+                    'quantity': np.asarray(self.transactions['quantity'])[in_catalog],
+                    'transaction_id': np.asarray(transaction_ids)[in_catalog],
+                    'user_id': np.asarray(self.transactions['user_id'])[in_catalog],
+                }
+                purchase_counts = np.bincount(
+                    purchases['column'], weights=purchases['quantity'], minlength=n_products
+                ).astype(np.int64)
+            if self.users is not None and 'location' in self.users:
+                codes, uniques = pd.factorize(self.users['location'].astype(object))
+                user_locations = (self.users['user_id'].to_numpy(), codes)
+                location_names = [str(name) for name in uniques]
+        except Exception as e:
+            print(f"Error building popularity counters: {e}")
+            purchases = user_locations = None
+        
+        category_codes, category_names = self._category_codes()
+        self.popularity = PopularityRankings(
+            self.popularity_half_life, category_names=category_names, location_names=location_names
+        ).fit(
+            self.product_store.column('rating'), category_codes, rating_counts, purchase_counts,
+            purchases=purchases, user_locations=user_locations
+        )
+        print("Popularity rankings built successfully")
+
+    @metrics.build_step('interactions')
+    def _build_interactions(self):
+        """Users x products interaction strengths from purchases and ratings.
+
+        Strength is the purchased quantity plus rating / 5, so a five-star
+        rating weighs as much as buying one unit. Rows cover everyone who
+        bought or rated something (self.interaction_user_ids).
+        """
+        try:
+            users, columns, strengths = [], [], []
+            for table, column, scale in ((self.transactions, 'quantity', 1.0), (self.ratings, 'rating', 0.2)):
+                if table is not None and len(table['product_id']) > 0:
+                    table_columns = self._catalog_columns(table['product_id'])
+                    in_catalog = table_columns >= 0
+                    users.append(np.asarray(table['user_id'])[in_catalog])
+                    columns.append(table_columns[in_catalog])
+                    strengths.append(np.asarray(table[column])[in_catalog].astype(np.float32) * scale)
+            if not users:
+                return
+
+            self.interaction_user_ids, rows = np.unique(np.concatenate(users), return_inverse=True)
+            self.interaction_positions = {
+                user_id: row for row, user_id in enumerate(self.interaction_user_ids.tolist())
+            }
+            # COO -> CSR sums repeated purchases and ratings of a product
+            self.interactions = sp.csr_matrix(
+                (np.concatenate(strengths), (rows, np.concatenate(columns))),
+                shape=(len(self.interaction_user_ids), len(self.product_ids)), dtype=np.float32
+            )
+        except Exception as e:
+            print(f"Error building interaction matrix: {e}")
+
+    @metrics.build_step('segments')
+    def _build_segments(self):
+        """Rank each demographic segment's products by how many of its members bought or rated them"""
+        try:
+            if self.segment_top_k and self.users is not None and self.interactions is not None:
+                user_ids, codes, gender_names, location_names = user_demographics(self.users)
+                self.segments = SegmentIndex(
+                    self.segment_top_k, self.segment_min_users, gender_names, location_names
+                ).fit(user_ids, codes, self.interactions, self.interaction_user_ids, self.popularity.rank)
+                print("Segment index built successfully")
         except Exception as e:
-            print(f"Error building user similarity: {e}")
+            print(f"Error building segment index: {e}")
 
-    def get_content_based_recommendations(self, product_id, n_recommendations=5):
+    @metrics.build_step('factor_model')
+    def _build_factor_model(self):
+        """Fit implicit ALS to the purchase and rating interactions"""
+        try:
+            if self.n_factors and self.interactions is not None:
+                self.factor_model = ImplicitALS(self.n_factors, n_jobs=self.build_jobs).fit(self.interactions)
+                # Share one (index-sorted) matrix, so ingested interactions reach the model's seen mask
+                self.interactions = self.factor_model.interactions
+                self.factor_user_ids = self.interaction_user_ids
+                self.factor_user_positions = {
+                    user_id: row for row, user_id in enumerate(self.factor_user_ids.tolist())
+                }
+                print("Factor model built successfully")
+        except Exception as e:
+            print(f"Error building factor model: {e}")
+
+    @metrics.build_step('item_neighbors')
+    def _build_item_neighbors(self):
+        """Top-k co-occurrence neighbours per product: cosine between products' buyer/rater columns"""
+        try:
+            if self.item_neighbors_k and self.interactions is not None:
+                self.item_neighbors = topk_cosine_neighbors(
+                    normalize(self.interactions.T.tocsr()),
+                    self.item_neighbors_k,
+                    n_jobs=self.build_jobs,
+                    memory_budget=self.build_memory_budget
+                )
+                self.item_similarity = self._neighbor_matrix(self.item_neighbors)
+                print("Item neighbours built successfully")
+        except Exception as e:
+            print(f"Error building item neighbours: {e}")
+
+    def _neighbor_matrix(self, table):
+        """Sparse products x products matrix of a neighbour table's positive scores"""
+        keep = (table.indices >= 0) & (table.scores > 0)
+        rows = np.repeat(np.arange(len(table.indices)), keep.sum(axis=1))
+        return sp.csr_matrix(
+            (table.scores[keep], (rows, table.indices[keep])),
+            shape=(len(self.product_ids), len(self.product_ids)), dtype=np.float32
+        )
+
+    @staticmethod
+    def _batch_frame(batch, columns):
+        """Coerce an ingest batch (DataFrame, list of dicts, ...) to a DataFrame"""
+        frame = batch if isinstance(batch, pd.DataFrame) else pd.DataFrame(list(batch), columns=columns)
+        missing = [column for column in columns if column not in frame.columns]
+        if missing:
+            raise ValueError(f"Ingest batch is missing columns: {', '.join(missing)}")
+        return frame
+
+    def ingest_ratings(self, batch):
+        """Return a new engine snapshot with a batch of ratings applied.
+
+        A rating for an existing (user, product) pair replaces the old one and
+        unseen users are appended as new matrix rows. Only the affected
+        users' rows (in the rating matrix's and neighbour index's overlays,
+        see matrices.DeltaMatrix) and the popularity counters are updated;
+        self is left untouched so requests already running against it keep a
+        consistent view. Ratings for products that are not in the catalog are
+        ignored until the next full build.
+        """
+        batch = self._batch_frame(batch, ['user_id', 'product_id', 'rating'])
+        columns = pd.Index(self.product_ids).get_indexer(batch['product_id'].to_numpy())
+        batch = batch[columns >= 0].assign(column=columns[columns >= 0])
+        # The latest rating wins for a (user, product) pair repeated in the batch
+        batch = batch.drop_duplicates(['user_id', 'column'], keep='last')
+        if batch.empty:
+            return self
+
+        updated = copy.copy(self)
+        user_ids = batch['user_id'].to_numpy()
+        known_users = self.user_positions or {}
+        new_users = pd.unique(user_ids[[user_id not in known_users for user_id in user_ids.tolist()]])
+        if len(new_users):
+            existing = self.user_ids if self.user_ids is not None else np.empty(0, dtype=new_users.dtype)
+            updated.user_ids = np.concatenate([existing, new_users])
+            updated.user_positions = append_positions(known_users, new_users.tolist(), len(existing))
+
+        rows = np.array([updated.user_positions[user_id] for user_id in user_ids.tolist()], dtype=np.int64)
+        columns = batch['column'].to_numpy()
+        ratings = batch['rating'].to_numpy(dtype=np.float32)
+        matrix = self.user_item_matrix
+        if matrix is None:
+            matrix = sp.csr_matrix((0, len(self.product_ids)), dtype=np.float32)
+        previous = DeltaMatrix.wrap(matrix).cells(rows, columns)
+        newly_rated = ~(previous > 0)
+        updated.user_item_matrix = set_cells(matrix, rows, columns, ratings)
+        # A rating weighs rating / 5 in the interactions; replace the old one's share
+        self._add_interactions(updated, user_ids, columns, (ratings - previous) * 0.2)
+
+        updated.popularity = self.popularity.add_ratings(columns[newly_rated])
+
+        affected = np.unique(rows)
+        if self.user_index is None:
+            updated.user_index = build_neighbor_index(
+                self.user_index_kind, updated.user_item_matrix.tocsr(), **self.user_index_options
+            )
+        else:
+            updated.user_index = self.user_index.update(updated.user_item_matrix, affected)
+        if self.precomputed is not None:
+            stale = affected[affected < len(self.precomputed)]
+            if self.precomputed_stale is None:
+                updated.precomputed_stale = np.zeros(len(self.precomputed), dtype=bool)
+            else:
+                updated.precomputed_stale = self.precomputed_stale.copy()
+            updated.precomputed_stale[stale] = True
+        updated.revision = self.revision + 1
+        print(f"Ingested {len(batch)} ratings for {len(affected)} users (revision {updated.revision})")
+        return updated
+
+    def ingest_transactions(self, batch):
+        """Return a new engine snapshot with a batch of purchases added to the interactions and counters.
+
+        Batches without a transaction_id column count as the newest purchases.
+        """
+        batch = self._batch_frame(batch, ['user_id', 'product_id', 'quantity'])
+        columns = pd.Index(self.product_ids).get_indexer(batch['product_id'].to_numpy())
+        in_catalog = columns >= 0
+        if not in_catalog.any():
+            return self
+
+        updated = copy.copy(self)
+        self._add_interactions(
+            updated, batch['user_id'].to_numpy()[in_catalog], columns[in_catalog],
+            batch['quantity'].to_numpy(dtype=np.float32)[in_catalog]
+        )
+        updated.popularity = self.popularity.add_purchases(
+            columns[in_catalog],
+            batch['quantity'].to_numpy(dtype=np.int64)[in_catalog],
+            batch['transaction_id'].to_numpy()[in_catalog] if 'transaction_id' in batch else None,
+            batch['user_id'].to_numpy()[in_catalog]
+        )
+        updated.revision = self.revision + 1
+        print(f"Ingested {int(in_catalog.sum())} transactions (revision {updated.revision})")
+        return updated
+
+    def _add_interactions(self, updated, user_ids, columns, strengths):
+        """Add strengths to updated's interaction cells, appending rows for unseen users"""
+        known_users = self.interaction_positions or {}
+        new_users = pd.unique(user_ids[[user_id not in known_users for user_id in user_ids.tolist()]])
+        if len(new_users):
+            existing = self.interaction_user_ids
+            if existing is None:
+                existing = np.empty(0, dtype=new_users.dtype)
+            updated.interaction_user_ids = np.concatenate([existing, new_users])
+            updated.interaction_positions = append_positions(known_users, new_users.tolist(), len(existing))
+        rows = np.array([updated.interaction_positions[user_id] for user_id in user_ids.tolist()], dtype=np.int64)
+        matrix = self.interactions
+        if matrix is None:
+            matrix = sp.csr_matrix((0, len(self.product_ids)), dtype=np.float32)
+        updated.interactions = add_cells(matrix, rows, columns, strengths)
+        if self.factor_model is not None:
+            updated.factor_model = copy.copy(self.factor_model)
+            updated.factor_model.interactions = updated.interactions
+
+    def _selection(self, filters):
+        """Rows allowed by a filters.ProductFilter, or None without filters"""
+        if filters is None:
+            return None
+        with metrics.stage('filter'):
+            return self.filter_index.select(filters)
+
+    @metrics.stage('content_lookup')
+    def _rank_similar_products(self, product_ids, n_recommendations, selection=None):
+        """Return ranked row positions of the most similar products per query.
+
+        Queries are excluded by product_id rather than by position, so a
+        product never recommends itself even when ties reorder the row.
+        Unknown product ids map to None. With a selection, only allowed
+        products are ranked; queries whose neighbour list runs out are scored
+        exactly against the allowed products.
+        """
+        positions = [self.product_positions.get(pid) for pid in product_ids]
+        known = [i for i, pos in enumerate(positions) if pos is not None]
+        ranked = [None] * len(product_ids)
+        if not known or n_recommendations <= 0:
+            for i in known:
+                ranked[i] = np.empty(0, dtype=np.int32)
+            return ranked
+
+        rows = np.array([positions[i] for i in known])
+        query_ids = np.array([product_ids[i] for i in known])
+
+        if self.product_neighbors is not None:
+            indices = self.product_neighbors.indices[rows]
+            keep = self.product_ids[indices] != query_ids[:, None]
+            if selection is not None:
+                keep &= selection.mask[indices]
+            # A full table already ranks every product
+            exhaustive = indices.shape[1] >= len(self.product_ids) - 1
+            for j, i in enumerate(known):
+                ranked[i] = indices[j][keep[j]][:n_recommendations]
+                if (selection is not None and len(ranked[i]) < n_recommendations and not exhaustive
+                        and self.tfidf_matrix is not None):
+                    ranked[i] = self._rank_similar_within(rows[j], query_ids[j], selection.rows, n_recommendations)
+            return ranked
+
+        block = np.array(self.product_similarity[rows], dtype=np.float64)
+        block[self.product_ids[None, :] == query_ids[:, None]] = -np.inf
+        if selection is not None:
+            block[:, ~selection.mask] = -np.inf
+        indices, scores = topk_from_block(block, n_recommendations)
+        for j, i in enumerate(known):
+            ranked[i] = indices[j][np.isfinite(scores[j])]
+        return ranked
+
+    def _rank_similar_within(self, row, product_id, candidates, n_recommendations):
+        """Most similar of the candidate rows to one product, scored on the TF-IDF rows"""
+        candidates = candidates[self.product_ids[candidates] != product_id]
+        scores = (self.tfidf_matrix[candidates] @ self.tfidf_matrix[row].T).toarray().reshape(1, -1)
+        indices, _ = topk_from_block(scores, n_recommendations)
+        return candidates[indices[0]]
+
+    @metrics.stage('materialize')
+    def _product_records(self, positions):
+        """Materialize API records for product row positions, in order"""
+        return self.product_store.records(positions)
+
+    def get_content_based_recommendations(self, product_id, n_recommendations=5, filters=None):
         """Content-based filtering using TF-IDF similarity"""
         try:
-            product_idx = self.products[self.products['product_id'] == product_id].index
-            if len(product_idx) == 0:
+            ranked = self._rank_similar_products([product_id], n_recommendations, self._selection(filters))[0]
+            if ranked is None:
                 return []
-            
-            product_idx = product_idx[0]
-            sim_scores = list(enumerate(self.product_similarity[product_idx]))
-            sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-            sim_scores = sim_scores[1:n_recommendations + 1]
-            
-            product_indices = [i[0] for i in sim_scores]
-            recommendations = self.products.iloc[product_indices].copy()
-            recommendations = recommendations.rename(columns={
-                'product_id': 'id',
-                'product_name': 'name'
-            })
-            
-            return recommendations.to_dict('records')
+            return self._product_records(ranked)
         except Exception as e:
             print(f"Error in content-based recommendations: {e}")
+            metrics.increment('errors_total', strategy='content')
             return []
 
-    def get_collaborative_recommendations(self, user_id, n_recommendations=5):
+    def get_content_based_recommendations_batch(self, product_ids, n_recommendations=5, filters=None):
+        """Content-based recommendations for many products in one ranking pass"""
+        try:
+            product_ids = list(product_ids)
+            ranked = self._rank_similar_products(product_ids, n_recommendations, self._selection(filters))
+            lengths = [0 if r is None else len(r) for r in ranked]
+            positions = np.concatenate([r for r in ranked if r is not None] or [np.empty(0, dtype=np.int32)])
+            records = self._product_records(positions)
+
+            results = {}
+            offset = 0
+            for product_id, length in zip(product_ids, lengths):
+                results[product_id] = records[offset:offset + length]
+                offset += length
+            return results
+        except Exception as e:
+            print(f"Error in batch content-based recommendations: {e}")
+            metrics.increment('errors_total', strategy='content')
+            return {product_id: [] for product_id in product_ids}
+
+    @metrics.stage('collaborative_score')
+    def _score_collaborative(self, user_rows, neighbors, weighted=False):
+        """Predict ratings for a batch of users from their neighbours' rows in one pass.
+
+        ``neighbors`` is a NeighborTable aligned with ``user_rows`` (index -1
+        marks a missing neighbour). Returns (query, columns, predicted_rating,
+        rated_by) over the items each user has not rated, grouped by query in
+        order and ranked within a query by predicted rating then rated_by,
+        both descending, then by column. The plain mode averages the
+        neighbours' ratings; the weighted mode weights each rating by the
+        neighbour's similarity. Only the cells the neighbours rated are touched.
+        """
+        matrix = self.user_item_matrix
+        n_items = matrix.shape[1]
+        found = neighbors.indices >= 0
+        query = np.repeat(np.arange(len(user_rows)), found.sum(axis=1))
+        neighbor_rows = neighbors.indices[found]
+        neighbor_sims = neighbors.scores[found].astype(np.float64)
+
+        # Gather every neighbour's stored ratings in one row gather
+        gathered = matrix[neighbor_rows]
+        lengths = np.diff(gathered.indptr)
+        values = gathered.data.astype(np.float64)
+        rated = values > 0
+        keys = np.repeat(query, lengths)[rated] * n_items + gathered.indices[rated]
+        keys, inverse = np.unique(keys, return_inverse=True)
+        values = values[rated]
+        rated_by = np.bincount(inverse, minlength=len(keys))
+
+        if weighted:
+            weights = np.repeat(neighbor_sims, lengths)[rated]
+            numerator = np.bincount(inverse, weights=weights * values, minlength=len(keys))
+            denominator = np.bincount(inverse, weights=np.abs(weights), minlength=len(keys))
+        else:
+            numerator = np.bincount(inverse, weights=values, minlength=len(keys))
+            denominator = rated_by
+
+        own = matrix[user_rows]
+        own_rated = own.data > 0
+        own_keys = np.repeat(np.arange(len(user_rows)), np.diff(own.indptr))[own_rated] * n_items + own.indices[own_rated]
+        unrated = ~np.isin(keys, own_keys)
+        keys = keys[unrated]
+        predicted = numerator[unrated] / np.maximum(denominator[unrated], 1e-8)
+        counts = rated_by[unrated]
+        query, columns = np.divmod(keys, n_items)
+        # lexsort is stable and keys are sorted, so equal scores keep column order
+        order = np.lexsort((-counts, -predicted, query))
+        return query[order], columns[order], predicted[order], counts[order]
+
+    def get_collaborative_recommendations(self, user_id, n_recommendations=5, weighted=False, filters=None):
         """User-based collaborative filtering"""
+        return self.get_collaborative_recommendations_batch([user_id], n_recommendations, weighted, filters)[user_id]
+
+    def get_collaborative_recommendations_batch(self, user_ids, n_recommendations=5, weighted=False, filters=None):
+        """User-based collaborative filtering for many users in one scoring pass.
+
+        Unknown users, and users whose neighbours rated nothing new, get the
+        cold-start fallback (their demographic segment, else popular products).
+        ``filters`` (a filters.ProductFilter) drops disallowed candidates
+        before each user's top n is taken, here and in every other strategy.
+        """
+        user_ids = list(user_ids)
         try:
-            if self.user_item_matrix is None or user_id not in self.user_item_matrix.index:
-                # If user not in matrix, return popular products
-                return self._get_popular_products(n_recommendations)
-            
-            user_idx = self.user_item_matrix.index.get_loc(user_id)
-            user_similarities = self.user_similarity[user_idx]
-            
-            # Get top similar users (excluding self)
-            similar_users_idx = user_similarities.argsort()[::-1][1:10]
-            
-            if len(similar_users_idx) == 0:
-                return self._get_popular_products(n_recommendations)
-            
-            similar_users = self.user_item_matrix.index[similar_users_idx]
-            similar_users_ratings = self.user_item_matrix.loc[similar_users]
-            
-            user_ratings = self.user_item_matrix.loc[user_id]
-            unrated_products = user_ratings[user_ratings == 0].index
-            
-            recommendations = []
-            for product_id in unrated_products:
-                # Get ratings from similar users for this product
-                product_ratings = similar_users_ratings[product_id]
-                rated_count = (product_ratings > 0).sum()
+            selection = self._selection(filters)
+            positions = self.user_positions if self.user_item_matrix is not None else {}
+            known = [i for i, user_id in enumerate(user_ids) if user_id in positions]
+            ranked = {}
+            if known:
+                user_rows = np.array([positions[user_ids[i]] for i in known])
                 
-                if rated_count > 0:
-                    avg_rating = product_ratings[product_ratings > 0].mean()
-                    recommendations.append({
-                        'product_id': product_id,
-                        'predicted_rating': float(avg_rating),
-                        'rated_by': int(rated_count)
-                    })
-            
-            # Sort by predicted rating and number of ratings
-            recommendations = sorted(
-                recommendations, 
-                key=lambda x: (x['predicted_rating'], x['rated_by']), 
-                reverse=True
-            )
-            recommendations = recommendations[:n_recommendations]
-            
-            if not recommendations:
-                return self._get_popular_products(n_recommendations)
-            
-            # Merge with product details
-            product_ids = [r['product_id'] for r in recommendations]
-            product_details = self.products[self.products['product_id'].isin(product_ids)].copy()
-            product_details = product_details.rename(columns={
-                'product_id': 'id',
-                'product_name': 'name'
-            })
+                # Get top similar users (excluding self)
+                with metrics.stage('user_neighbors'):
+                    similar_users = self.user_index.query(
+                        self.user_item_matrix[user_rows], self.collaborative_neighbors, exclude=user_rows
+                    )
+                query, columns, _, _ = self._score_collaborative(user_rows, similar_users, weighted=weighted)
+                if selection is not None:
+                    allowed = selection.mask[columns]
+                    query, columns = query[allowed], columns[allowed]
+                
+                # Keep the first n_recommendations of each user's ranked group
+                group_starts = np.searchsorted(query, np.arange(len(known)))
+                top = np.arange(len(query)) - group_starts[query] < n_recommendations
+                query, columns = query[top], columns[top]
+                records = self._product_records(columns)
+                bounds = np.searchsorted(query, np.arange(len(known) + 1))
+                for j, i in enumerate(known):
+                    if bounds[j + 1] > bounds[j]:
+                        ranked[user_ids[i]] = records[bounds[j]:bounds[j + 1]]
             
-            return product_details.to_dict('records')
+            cold = [user_id for user_id in user_ids if user_id not in ranked]
+            ranked.update(self._fallback_recommendations(cold, n_recommendations, 'collaborative', selection))
+            return {user_id: ranked[user_id] for user_id in user_ids}
         except Exception as e:
             print(f"Error in collaborative recommendations: {e}")
-            return self._get_popular_products(n_recommendations)
+            metrics.increment('errors_total', strategy='collaborative')
+            popular = self._get_popular_products(n_recommendations)
+            return {user_id: popular for user_id in user_ids}
     
+    def get_factor_recommendations(self, user_id, n_recommendations=5, filters=None):
+        """Implicit ALS recommendations: products with the highest factor dot product"""
+        return self.get_factor_recommendations_batch([user_id], n_recommendations, filters)[user_id]
+
+    def get_factor_recommendations_batch(self, user_ids, n_recommendations=5, filters=None):
+        """Implicit ALS recommendations for many users in one scoring pass.
+
+        Products the user already bought or rated are skipped; users the model
+        has not seen get the cold-start fallback. With filters, only the
+        allowed products are scored.
+        """
+        user_ids = list(user_ids)
+        try:
+            selection = self._selection(filters)
+            positions = self.factor_user_positions if self.factor_model is not None else {}
+            known = [user_id for user_id in user_ids if user_id in positions]
+            ranked = {}
+            if known and n_recommendations > 0:
+                with metrics.stage('factor_score'):
+                    indices, _ = self.factor_model.recommend(
+                        [positions[user_id] for user_id in known], n_recommendations,
+                        items=None if selection is None else selection.rows
+                    )
+                lengths = (indices >= 0).sum(axis=1)
+                records = self._product_records(indices[indices >= 0])
+                offsets = np.concatenate(([0], np.cumsum(lengths))).tolist()
+                for j, user_id in enumerate(known):
+                    if lengths[j]:
+                        ranked[user_id] = records[offsets[j]:offsets[j + 1]]
+            
+            cold = [user_id for user_id in user_ids if user_id not in ranked]
+            ranked.update(self._fallback_recommendations(cold, n_recommendations, 'factors', selection))
+            return {user_id: ranked[user_id] for user_id in user_ids}
+        except Exception as e:
+            print(f"Error in factor recommendations: {e}")
+            metrics.increment('errors_total', strategy='factors')
+            popular = self._get_popular_products(n_recommendations)
+            return {user_id: popular for user_id in user_ids}
+
+    def get_item_based_recommendations(self, user_id, n_recommendations=5, filters=None):
+        """Item-item collaborative filtering from precomputed co-occurrence neighbours"""
+        return self.get_item_based_recommendations_batch([user_id], n_recommendations, filters)[user_id]
+
+    def get_item_based_recommendations_batch(self, user_ids, n_recommendations=5, filters=None):
+        """Item-item collaborative filtering for many users in one scoring pass.
+
+        A product scores the sum over the products the user bought or rated
+        of interaction strength (quantity + rating / 5, the input the
+        neighbours were built from) x similarity, so a request only touches
+        the neighbour lists of the user's own products and its cost does not
+        grow with the user count. Bought and rated products are skipped;
+        unknown users and users whose products have no neighbours get the
+        cold-start fallback.
+        """
+        user_ids = list(user_ids)
+        try:
+            selection = self._selection(filters)
+            positions = self.interaction_positions if self.item_similarity is not None else None
+            positions = positions or {}
+            known = [user_id for user_id in user_ids if user_id in positions]
+            ranked = {}
+            if known and n_recommendations > 0:
+                with metrics.stage('item_score'):
+                    history = self.interactions[[positions[user_id] for user_id in known]]
+                    scores = (history @ self.item_similarity).tocoo()
+                    n_products = len(self.product_ids)
+                    rated = np.repeat(np.arange(len(known)), np.diff(history.indptr)) * n_products + history.indices
+                    unrated = ~np.isin(scores.row.astype(np.int64) * n_products + scores.col, rated)
+                    if selection is not None:
+                        unrated &= selection.mask[scores.col]
+                    query, columns, score = scores.row[unrated], scores.col[unrated], scores.data[unrated]
+
+                    # Keep the first n_recommendations of each user's ranked group
+                    order = np.lexsort((columns, -score, query))
+                    query, columns = query[order], columns[order]
+                    group_starts = np.searchsorted(query, np.arange(len(known)))
+                    top = np.arange(len(query)) - group_starts[query] < n_recommendations
+                    query, columns = query[top], columns[top]
+                records = self._product_records(columns)
+                bounds = np.searchsorted(query, np.arange(len(known) + 1))
+                for j, user_id in enumerate(known):
+                    if bounds[j + 1] > bounds[j]:
+                        ranked[user_id] = records[bounds[j]:bounds[j + 1]]
+
+            cold = [user_id for user_id in user_ids if user_id not in ranked]
+            ranked.update(self._fallback_recommendations(cold, n_recommendations, 'item_based', selection))
+            return {user_id: ranked[user_id] for user_id in user_ids}
+        except Exception as e:
+            print(f"Error in item-based recommendations: {e}")
+            metrics.increment('errors_total', strategy='item_based')
+            popular = self._get_popular_products(n_recommendations)
+            return {user_id: popular for user_id in user_ids}
+
+    @metrics.stage('popular')
+    def _popular_positions(self, n_recommendations=5):
+        """Row positions of the top-rated products, ties broken by purchases then ratings count"""
+        return self.popularity.top(n_recommendations)
+
     def _get_popular_products(self, n_recommendations=5):
-        """Get top-rated products as fallback"""
+        """Get top-rated products as fallback, ties broken by purchases then ratings count"""
         try:
-            popular = self.products.nlargest(n_recommendations, 'rating').copy()
-            popular = popular.rename(columns={
-                'product_id': 'id',
-                'product_name': 'name'
-            })
-            return popular.to_dict('records')
+            return self._product_records(self._popular_positions(n_recommendations))
         except Exception as e:
             print(f"Error getting popular products: {e}")
             return []
 
-    def get_hybrid_recommendations(self, user_id, n_recommendations=5):
+    def get_popular_recommendations(self, n_recommendations=5, category=None, location=None, trending=False):
+        """Most popular products overall, in a category, among buyers in a location, or trending"""
+        return self._product_records(self.popularity.top(n_recommendations, category, location, trending))
+
+    def _cold_start_positions(self, user_ids, n_recommendations, strategy, selection=None):
+        """(segment per user, ranked positions per segment) for users a strategy could not score.
+
+        A user's segment is the most specific demographic segment of theirs in
+        the segment index; users without one (no users.csv row, no index)
+        share segment -1, the global popular products. A selection restricts
+        both to the allowed products.
+        """
+        n_recommendations = max(0, n_recommendations)
+        with metrics.stage('cold_start'):
+            if self.segments is not None:
+                matches = self.segments.lookup(user_ids)
+            else:
+                matches = [(-1, None)] * len(user_ids)
+            mask = None
+            order = self.popularity.order
+            if selection is not None and user_ids:
+                # Enough of the filtered global order to complete any segment's list
+                mask = selection.mask
+                extra = self.segments.top_k if self.segments is not None else 0
+                order = self.popularity.top_within(selection.rows, mask, n_recommendations + extra)
+            segments = {}
+            rankings = {}
+            for user_id, (segment, level) in zip(user_ids, matches):
+                if segment not in rankings:
+                    if segment >= 0:
+                        rankings[segment] = self.segments.top(segment, n_recommendations, order, mask)
+                    elif mask is not None:
+                        rankings[segment] = order[:n_recommendations]
+                    else:
+                        rankings[segment] = self._popular_positions(n_recommendations)
+                segments[user_id] = segment
+                metrics.increment('fallbacks_total', strategy=strategy)
+                metrics.increment('cold_start_total', level=level or 'global')
+        return segments, rankings
+
+    def _fallback_positions(self, user_ids, n_recommendations, strategy, selection=None):
+        """Cold-start row positions per user: their segment's top products, else the popular ones"""
+        segments, rankings = self._cold_start_positions(user_ids, n_recommendations, strategy, selection)
+        return {user_id: rankings[segment] for user_id, segment in segments.items()}
+
+    def _fallback_recommendations(self, user_ids, n_recommendations, strategy, selection=None):
+        """Cold-start records per user, materialized once per segment"""
+        segments, rankings = self._cold_start_positions(user_ids, n_recommendations, strategy, selection)
+        records = {segment: self._product_records(positions) for segment, positions in rankings.items()}
+        return {user_id: records[segment] for user_id, segment in segments.items()}
+
+    @staticmethod
+    def _min_max_by_group(values, starts, group):
+        """Min-max normalise values within contiguous groups, like the demo's (x - min) / (max - min)"""
+        low = np.minimum.reduceat(values, starts)[group]
+        high = np.maximum.reduceat(values, starts)[group]
+        return (values - low) / (high - low + 1e-8)
+
+    def _score_hybrid(self, user_rows, alpha, selection=None):
+        """Blend collaborative and content scores for a batch of users in one pass.
+
+        Candidates are the items the user's neighbours rated plus the
+        content neighbours of the user's favourite (top-rated) product,
+        minus anything already rated. Both signals are min-max normalised per
+        user, as in recommendation_demo.hybrid_recommend_for_user, and mixed
+        as alpha * collaborative + (1 - alpha) * content, where content is
+        the TF-IDF cosine to the favourite product. A selection drops
+        disallowed candidates of both kinds before scoring. Returns (query,
+        columns, score) grouped by query in order and ranked by score, then
+        column.
+        """
+        matrix = self.user_item_matrix
+        n_items = matrix.shape[1]
+        n_users = len(user_rows)
+        with metrics.stage('user_neighbors'):
+            similar_users = self.user_index.query(matrix[user_rows], self.collaborative_neighbors, exclude=user_rows)
+        cf_query, cf_columns, predicted, _ = self._score_collaborative(user_rows, similar_users)
+        if selection is not None:
+            allowed = selection.mask[cf_columns]
+            cf_query, cf_columns, predicted = cf_query[allowed], cf_columns[allowed], predicted[allowed]
+        
+        # Favourite product: highest rating, lowest column on ties
+        own = matrix[user_rows]
+        own_query = np.repeat(np.arange(n_users), np.diff(own.indptr))
+        order = np.lexsort((own.indices, -own.data, own_query))
+        has_favourite = np.diff(own.indptr) > 0
+        favourites = np.full(n_users, -1, dtype=np.int64)
+        favourites[has_favourite] = own.indices[order][own.indptr[:-1][has_favourite]]
+        
+        # Content candidates from the favourite's neighbours
+        ranked = self._rank_similar_products(
+            self.product_ids[favourites[has_favourite]].tolist(), self.hybrid_content_neighbors, selection
+        )
+        content_query = np.repeat(np.flatnonzero(has_favourite), [0 if r is None else len(r) for r in ranked])
+        content_columns = np.concatenate([r for r in ranked if r is not None] or [np.empty(0, dtype=np.int64)])
+        
+        cf_keys = cf_query * n_items + cf_columns
+        keys = np.union1d(cf_keys, content_query * n_items + content_columns.astype(np.int64))
+        keys = keys[~np.isin(keys, own_query * n_items + own.indices)]
+        if len(keys) == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, np.empty(0)
+        query, columns = np.divmod(keys, n_items)
+        _, starts, group = np.unique(query, return_index=True, return_inverse=True)
+        
+        # CF candidates are unrated by construction, so every one is in keys
+        cf_score = np.zeros(len(keys))
+        cf_score[np.searchsorted(keys, cf_keys)] = predicted
+        
+        content_score = np.zeros(len(keys))
+        if self.tfidf_matrix is not None:
+            with metrics.stage('content_score'):
+                with_favourite = favourites[query] >= 0
+                pairs = self.tfidf_matrix[favourites[query][with_favourite]].multiply(
+                    self.tfidf_matrix[columns[with_favourite]]
+                )
+                content_score[with_favourite] = np.asarray(pairs.sum(axis=1)).ravel()
+        
+        with metrics.stage('hybrid_rank'):
+            score = (
+                alpha * self._min_max_by_group(cf_score, starts, group)
+                + (1 - alpha) * self._min_max_by_group(content_score, starts, group)
+            )
+            order = np.lexsort((columns, -score, query))
+        return query[order], columns[order], score[order]
+
+    def rank_hybrid_recommendations(self, user_ids, n_recommendations=5, alpha=None, filters=None):
+        """Ranked catalog row positions of hybrid recommendations for each user.
+
+        Unknown users and users without any candidate get the cold-start
+        fallback. ``alpha`` weighs collaborative against content scores and
+        defaults to self.hybrid_alpha; ``filters`` restricts every list to
+        the products it allows.
+        """
+        alpha = self.hybrid_alpha if alpha is None else alpha
+        user_ids = list(user_ids)
+        selection = self._selection(filters)
+        positions = self.user_positions if self.user_item_matrix is not None else {}
+        known = [i for i, user_id in enumerate(user_ids) if user_id in positions]
+        ranked = {}
+        if known and n_recommendations > 0:
+            user_rows = np.array([positions[user_ids[i]] for i in known])
+            query, columns, _ = self._score_hybrid(user_rows, alpha, selection)
+            bounds = np.searchsorted(query, np.arange(len(known) + 1))
+            for j, i in enumerate(known):
+                if bounds[j + 1] > bounds[j]:
+                    ranked[user_ids[i]] = columns[bounds[j]:min(bounds[j + 1], bounds[j] + n_recommendations)]
+        
+        cold = [user_id for user_id in user_ids if user_id not in ranked]
+        ranked.update(self._fallback_positions(cold, n_recommendations, 'hybrid', selection))
+        return {user_id: ranked[user_id] for user_id in user_ids}
+
+    def get_precomputed_recommendations(self, user_id, n_recommendations=5):
+        """Hybrid recommendations from the precomputed table, or None when not available.
+
+        None means the caller should score live: there is no table, the user
+        is new or has ingested ratings since, or more results were requested
+        than were precomputed. Hybrid results are prefix-stable in
+        n_recommendations, so a row truncated to n matches a live call.
+        """
+        if self.precomputed is None or n_recommendations > self.precomputed.shape[1]:
+            return None
+        row = self.user_positions.get(user_id) if self.user_positions is not None else None
+        if row is None or row >= len(self.precomputed):
+            return None
+        if self.precomputed_stale is not None and self.precomputed_stale[row]:
+            return None
+        positions = self.precomputed[row]
+        return self._product_records(positions[positions >= 0][:n_recommendations])
+
+    def get_hybrid_recommendations(self, user_id, n_recommendations=5, alpha=None, filters=None):
         """Hybrid model combining content-based and collaborative filtering"""
+        return self.get_hybrid_recommendations_batch([user_id], n_recommendations, alpha, filters)[user_id]
+
+    def get_hybrid_recommendations_batch(self, user_ids, n_recommendations=5, alpha=None, filters=None):
+        """Hybrid recommendations for many users, scored in one pass and materialized once"""
+        user_ids = list(user_ids)
         try:
-            # Get user's rated products to understand preferences
-            user_preferences = self._get_user_preferences(user_id)
+            ranked = self.rank_hybrid_recommendations(user_ids, n_recommendations, alpha, filters)
+            lengths = [len(ranked[user_id]) for user_id in user_ids]
+            positions = np.concatenate([ranked[user_id] for user_id in user_ids] or [np.empty(0, dtype=np.int64)])
+            records = self._product_records(positions)
             
-            # Get collaborative recommendations
-            collab_recs = self.get_collaborative_recommendations(user_id, n_recommendations * 3)
-            
-            if not collab_recs:
-                return []
-            
-            # For each collaborative recommendation, get similar products
-            hybrid_recs = {}
-            for product in collab_recs:
-                product_id = product.get('id') or product.get('product_id')
-                
-                # Add the collaborative recommendation itself
-                if product_id not in hybrid_recs:
-                    hybrid_recs[product_id] = product
-                
-                # Get similar products based on content
-                similar = self.get_content_based_recommendations(product_id, 1)
-                for sim_product in similar:
-                    sim_id = sim_product.get('id') or sim_product.get('product_id')
-                    if sim_id not in hybrid_recs and sim_id not in user_preferences:
-                        hybrid_recs[sim_id] = sim_product
-            
-            # Return top N, excluding already-rated products
-            result = [p for pid, p in hybrid_recs.items() if pid not in user_preferences][:n_recommendations]
-            return result
+            results = {}
+            offset = 0
+            for user_id, length in zip(user_ids, lengths):
+                results[user_id] = records[offset:offset + length]
+                offset += length
+            return results
         except Exception as e:
             print(f"Error in hybrid recommendations: {e}")
-            return []
-    
-    def _get_user_preferences(self, user_id):
-        """Get products already rated by user"""
-        try:
-            if self.user_item_matrix is None or user_id not in self.user_item_matrix.index:
-                return set()
-            
-            user_ratings = self.user_item_matrix.loc[user_id]
-            rated_products = set(user_ratings[user_ratings > 0].index)
-            return rated_products
-        except Exception as e:
-            print(f"Error getting user preferences: {e}")
-            return set()
-
-# Global engine instance
-_engine = None
-
-def get_engine():
-    """Get or create the recommendation engine"""
-    global _engine
-    if _engine is None:
-        _engine = RecommendationEngine()
-    return _engine
+            metrics.increment('errors_total', strategy='hybrid')
+            return {user_id: [] for user_id in user_ids}
+
+# The global engine instance lives in loader.py so that importing it stays cheap
+from .loader import get_engine  # noqa: E402,F401
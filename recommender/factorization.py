@@ -0,0 +1,162 @@
+"""
+Implicit-feedback matrix factorization: alternating least squares with
+conjugate-gradient solves.
+
+Follows Hu, Koren & Volinsky: a user prefers a product (p = 1) when they
+bought or rated it, with confidence c = 1 + alpha * r where r is the
+interaction strength; unobserved pairs have p = 0 and c = 1. Each half-step
+keeps one side's factors fixed and approximately solves every row's weighted
+ridge regression with a few CG steps warm-started from the previous factors
+(Takacs et al.), so no per-row f x f system is ever formed. The CG updates
+are vectorized over blocks of rows: products with the sparse interactions
+are SciPy sparse-dense products and blocks run in a joblib thread pool.
+Recommendations are a top-k dot product over float32 factor matrices.
+"""
+import numpy as np
+import scipy.sparse as sp
+from joblib import Parallel, delayed
+
+from .neighbors import topk_from_block
+
+# Interactions handled per CG block; bounds the gathered (nnz x factors) array
+BLOCK_NNZ = 2 ** 18
+
+
+def _row_blocks(indptr, block_nnz):
+    """Split rows into contiguous blocks of about block_nnz stored entries each"""
+    n_rows = len(indptr) - 1
+    targets = np.arange(block_nnz, indptr[-1], block_nnz)
+    bounds = np.unique(np.concatenate(([0], np.searchsorted(indptr, targets), [n_rows])))
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def _cg_block(factors, fixed, gram, strength, start, stop, alpha, cg_steps):
+    """Refine factors[start:stop] in place with cg_steps conjugate-gradient steps.
+
+    Row u solves (gram + sum_i alpha * r_ui * y_i y_i^T) x_u = sum_i (1 + alpha * r_ui) y_i,
+    where gram = Y^T Y + regularization * I and y_i are rows of ``fixed``.
+    """
+    block = strength[start:stop]
+    rows = np.repeat(np.arange(stop - start), np.diff(block.indptr))
+    gathered = fixed[block.indices]
+    weights = alpha * block.data
+
+    def product(vectors):
+        """A_u v_u for every row of the block"""
+        dots = np.einsum('ij,ij->i', gathered, vectors[rows]) * weights
+        return vectors @ gram + sp.csr_matrix((dots, block.indices, block.indptr), shape=block.shape) @ fixed
+
+    x = factors[start:stop]
+    target = sp.csr_matrix((1 + weights, block.indices, block.indptr), shape=block.shape) @ fixed
+    residual = target - product(x)
+    direction = residual.copy()
+    norm = np.einsum('ij,ij->i', residual, residual)
+    for _ in range(cg_steps):
+        applied = product(direction)
+        curvature = np.einsum('ij,ij->i', direction, applied)
+        step = np.divide(norm, curvature, out=np.zeros_like(norm), where=curvature > 1e-20)
+        x += step[:, None] * direction
+        residual -= step[:, None] * applied
+        new_norm = np.einsum('ij,ij->i', residual, residual)
+        ratio = np.divide(new_norm, norm, out=np.zeros_like(norm), where=norm > 1e-20)
+        direction = residual + ratio[:, None] * direction
+        norm = new_norm
+    factors[start:stop] = x
+
+
+class ImplicitALS:
+    """User and item factors fitted to a users x items interaction-strength matrix"""
+
+    kind = 'als'
+
+    def __init__(self, n_factors=64, regularization=0.01, alpha=10.0, iterations=15, cg_steps=3,
+                 n_jobs=1, block_nnz=BLOCK_NNZ, seed=0):
+        self.n_factors = n_factors
+        self.regularization = regularization
+        self.alpha = alpha
+        self.iterations = iterations
+        self.cg_steps = cg_steps
+        self.n_jobs = n_jobs
+        self.block_nnz = block_nnz
+        self.seed = seed
+        self.user_factors = None
+        self.item_factors = None
+        # Interaction strengths, kept so served results skip seen products
+        self.interactions = None
+
+    def fit(self, interactions):
+        """Alternate user and item half-steps over a CSR matrix of strengths"""
+        self.interactions = sp.csr_matrix(interactions, dtype=np.float32)
+        self.interactions.sort_indices()
+        transposed = self.interactions.T.tocsr()
+        rng = np.random.default_rng(self.seed)
+        n_users, n_items = self.interactions.shape
+        self.user_factors = (rng.standard_normal((n_users, self.n_factors)) * 0.01).astype(np.float32)
+        self.item_factors = (rng.standard_normal((n_items, self.n_factors)) * 0.01).astype(np.float32)
+
+        with Parallel(n_jobs=self.n_jobs, prefer='threads') as parallel:
+            for _ in range(self.iterations):
+                self._half_step(parallel, self.user_factors, self.item_factors, self.interactions)
+                self._half_step(parallel, self.item_factors, self.user_factors, transposed)
+        return self
+
+    def _half_step(self, parallel, factors, fixed, strength):
+        """Update every row of factors with the other side held fixed"""
+        gram = fixed.T @ fixed + self.regularization * np.eye(self.n_factors, dtype=np.float32)
+        parallel(
+            delayed(_cg_block)(factors, fixed, gram, strength, start, stop, self.alpha, self.cg_steps)
+            for start, stop in _row_blocks(strength.indptr, self.block_nnz)
+        )
+
+    def state(self):
+        """(params, arrays) needed to serve the model without refitting"""
+        params = {
+            'n_factors': self.n_factors, 'regularization': self.regularization, 'alpha': self.alpha,
+            'iterations': self.iterations, 'cg_steps': self.cg_steps,
+        }
+        arrays = {
+            'user_factors': self.user_factors,
+            'item_factors': self.item_factors,
+            'interactions': self.interactions,
+        }
+        return params, arrays
+
+    @classmethod
+    def from_state(cls, params, arrays):
+        """Rebuild a fitted model from ``state()`` output, e.g. memory-mapped arrays"""
+        model = cls(**params)
+        for name, value in arrays.items():
+            setattr(model, name, value)
+        return model
+
+    def recommend(self, rows, k, block_size=2 ** 22, items=None):
+        """Top-k unseen items per user row by factor dot product, padded with -1 / -inf.
+
+        ``items`` optionally restricts the candidates to these sorted item
+        rows (a product filter); only they are scored.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        item_factors = self.item_factors if items is None else self.item_factors[items]
+        n_items = item_factors.shape[0]
+        k = min(k, n_items)
+        indices = np.full((len(rows), k), -1, dtype=np.int32)
+        scores = np.full((len(rows), k), -np.inf, dtype=np.float32)
+        chunk_size = max(1, block_size // max(1, n_items))
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            block = self.user_factors[chunk] @ item_factors.T
+            seen = self.interactions[chunk]
+            seen_rows = np.repeat(np.arange(len(chunk)), np.diff(seen.indptr))
+            seen_columns = seen.indices
+            if items is not None:
+                found = np.minimum(np.searchsorted(items, seen_columns), max(0, n_items - 1))
+                candidate = items[found] == seen_columns if n_items else np.zeros(len(seen_columns), dtype=bool)
+                seen_rows, seen_columns = seen_rows[candidate], found[candidate]
+            block[seen_rows, seen_columns] = -np.inf
+            top, top_scores = topk_from_block(block, k)
+            if items is not None and n_items:
+                top = items[top]
+            top[np.isneginf(top_scores)] = -1
+            indices[start:start + len(chunk)] = top
+            scores[start:start + len(chunk)] = top_scores
+        return indices, scores
@@ -0,0 +1,86 @@
+"""
+Product filters of the recommendation endpoints.
+
+``?category=``, ``?brand=`` (repeated or comma-separated), ``?min_price=``,
+``?max_price=`` and ``?in_stock=true`` restrict every strategy to matching
+products. The engine resolves a filter once per snapshot into a row bitmap
+(store.FilterIndex) and applies it to the candidates before the top-k cut,
+so a request still gets n results when most products are filtered out.
+
+This module only uses the standard library, so views can parse filters and
+the warming-up fallback can apply them without importing the engine.
+"""
+import hashlib
+from collections import namedtuple
+
+# Query parameters read by parse_filter
+FILTER_PARAMS = ('category', 'brand', 'min_price', 'max_price', 'in_stock')
+
+
+class ProductFilter(namedtuple('ProductFilter', ['categories', 'brands', 'min_price', 'max_price', 'in_stock'],
+                               defaults=(None, None, None, None, False))):
+    """Allowed categories and brands (None = any), an inclusive price range and a stock requirement"""
+
+    __slots__ = ()
+
+    def key(self):
+        """Short digest identifying the filter in cache keys"""
+        return hashlib.blake2b(repr(tuple(self)).encode(), digest_size=8).hexdigest()
+
+    def as_dict(self):
+        """The constraints that are set, as echoed in API responses"""
+        return {
+            name: list(value) if isinstance(value, tuple) else value
+            for name, value in self._asdict().items() if value not in (None, False)
+        }
+
+    def matches(self, record):
+        """Whether an API product record passes the filter"""
+        if self.categories is not None and record.get('category') not in self.categories:
+            return False
+        if self.brands is not None and record.get('brand') not in self.brands:
+            return False
+        if self.min_price is not None or self.max_price is not None:
+            price = record.get('price')
+            if not isinstance(price, (int, float)) or price != price:
+                return False
+            if self.min_price is not None and price < self.min_price:
+                return False
+            if self.max_price is not None and price > self.max_price:
+                return False
+        if self.in_stock and not (isinstance(record.get('stock'), (int, float)) and record['stock'] > 0):
+            return False
+        return True
+
+
+def _names(params, name):
+    """Sorted distinct values of a repeated or comma-separated parameter, None when absent"""
+    values = params.getlist(name) if hasattr(params, 'getlist') else params.get(name)
+    if values is None:
+        return None
+    if isinstance(values, str):
+        values = [values]
+    names = {part.strip() for value in values for part in str(value).split(',')} - {''}
+    return tuple(sorted(names)) if names else None
+
+
+def _price(params, name):
+    value = params.get(name)
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be a number')
+
+
+def parse_filter(params):
+    """ProductFilter from query parameters or a JSON object, None when it sets no constraint"""
+    in_stock = params.get('in_stock', False)
+    if isinstance(in_stock, str):
+        in_stock = in_stock.lower() in ('1', 'true')
+    product_filter = ProductFilter(
+        _names(params, 'category'), _names(params, 'brand'),
+        _price(params, 'min_price'), _price(params, 'max_price'), bool(in_stock)
+    )
+    return product_filter if product_filter != ProductFilter() else None
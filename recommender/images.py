@@ -0,0 +1,41 @@
+"""
+Product image URLs for API responses
+"""
+
+
+def get_product_image(product_id=None, product_name=None):
+    """Get product image URL based on product name mapping"""
+    # Mapping of product names to image files
+    product_image_map = {
+        'Wireless Earbuds': '/static/images/product_1.png',
+        'Bluetooth Speaker': '/static/images/product_2.png',
+        'Smart Watch': '/static/images/product_3.png',
+        'Fitness Band': '/static/images/product_4.png',
+        'Laptop Backpack': '/static/images/product_5.png',
+        "Men's Running Shoes": '/static/images/product_6.png',
+        "Women's Casual Shoes": '/static/images/product_7.png',
+        'Cotton T-Shirt': '/static/images/product_8.png',
+        'Jeans': '/static/images/product_9.png',
+        'DSLR Camera': '/static/images/product_10.png',
+        'USB-C Cable': '/static/images/product_11.png',
+        'Portable Hard Disk': '/static/images/product_12.png',
+        'Oven Toaster Grill': '/static/images/product_13.png',
+        'Mixer Grinder': '/static/images/product_14.png',
+        'Induction Stove': '/static/images/product_15.png',
+        'Pressure Cooker': '/static/images/product_16.png',
+        'Office Chair': '/static/images/product_17.png',
+        'Study Table': '/static/images/product_18.png',
+        'Bed Mattress': '/static/images/product_19.png',
+        'Table Lamp': '/static/images/product_20.png',
+    }
+    
+    # Try to get image by product name
+    if product_name and product_name in product_image_map:
+        return product_image_map[product_name]
+    
+    # Fallback to generated images by product_id
+    if product_id:
+        return f'/static/images/product_{product_id}.jpg'
+    
+    # Default fallback
+    return '/static/images/product_1.jpg'
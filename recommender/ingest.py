@@ -0,0 +1,146 @@
+"""
+Compact, streaming ingestion of the source CSV files.
+
+Every file is read in chunks with explicit dtypes (int32 ids, float32
+ratings, categorical low-cardinality strings) instead of pandas'
+int64/float64/object inference, and chunks are appended to per-column
+arrays. Ratings and transactions stay as dicts of those arrays (about 12
+bytes per rating); only the small products and users tables become
+DataFrames.
+
+With a cache directory, the parsed columns are also written as ``.npy`` files
+and later startups memory-map them instead of parsing the CSV again. A cached
+table is reused only while its source file keeps the same size and mtime.
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Rows parsed per chunk; bounds the parser's temporary objects
+CHUNK_ROWS = 1000000
+
+# Explicit dtypes per source file. Columns not listed (e.g. product price and
+# rating, whose JSON rendering must not change) keep pandas' inference.
+DTYPES = {
+    'products': {
+        'product_id': 'int32',
+        'category': 'category',
+        'brand': 'category',
+        'stock': 'int32',
+    },
+    'users': {
+        'user_id': 'int32',
+        'age': 'float32',
+        'gender': 'category',
+        'location': 'category',
+    },
+    'transactions': {
+        'transaction_id': 'int64',
+        'user_id': 'int32',
+        'product_id': 'int32',
+        'quantity': 'int16',
+    },
+    'ratings': {
+        'user_id': 'int32',
+        'product_id': 'int32',
+        # float32, not int8: ratings such as 4.5 must keep parsing
+        'rating': 'float32',
+    },
+}
+
+CACHE_MANIFEST = 'manifest.json'
+
+
+def _concat(pieces):
+    """Join per-chunk column pieces, merging categoricals' categories"""
+    if isinstance(pieces[0], pd.Categorical):
+        return union_categoricals(pieces)
+    return np.concatenate(pieces)
+
+
+def _parse_csv(path, name, chunk_rows):
+    """Stream a CSV file into a dict of column arrays (Categorical for category columns)"""
+    pieces = {}
+    for chunk in pd.read_csv(path, dtype=DTYPES.get(name), chunksize=chunk_rows):
+        for column, values in chunk.items():
+            values = values.array if isinstance(values.dtype, pd.CategoricalDtype) else values.to_numpy()
+            pieces.setdefault(column, []).append(values)
+    return {column: _concat(values) for column, values in pieces.items()}
+
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _write_cache(directory, columns, stamp):
+    """Save columns as .npy files; strings as integer codes plus their distinct values"""
+    tmp_dir = f'{directory}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    entries = {}
+    for column, values in columns.items():
+        if isinstance(values, pd.Categorical) or values.dtype == object:
+            categorical = isinstance(values, pd.Categorical)
+            codes, uniques = (values.codes, values.categories) if categorical else pd.factorize(values)
+            np.save(os.path.join(tmp_dir, f'{column}.codes.npy'), codes)
+            np.save(os.path.join(tmp_dir, f'{column}.values.npy'), np.asarray(uniques, dtype=str))
+            entries[column] = 'categorical' if categorical else 'strings'
+        else:
+            np.save(os.path.join(tmp_dir, f'{column}.npy'), values)
+            entries[column] = 'ndarray'
+    with open(os.path.join(tmp_dir, CACHE_MANIFEST), 'w') as f:
+        json.dump({'source': stamp, 'dtypes': DTYPES, 'columns': entries}, f)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.rename(tmp_dir, directory)
+
+
+def _read_cache(directory, stamp):
+    """Columns from a cache directory, or None when it is missing or stale"""
+    try:
+        with open(os.path.join(directory, CACHE_MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest['source'] != stamp or manifest['dtypes'] != DTYPES:
+        return None
+
+    columns = {}
+    for column, kind in manifest['columns'].items():
+        if kind == 'ndarray':
+            columns[column] = np.load(os.path.join(directory, f'{column}.npy'), mmap_mode='r')
+            continue
+        codes = np.load(os.path.join(directory, f'{column}.codes.npy'))
+        uniques = np.load(os.path.join(directory, f'{column}.values.npy')).astype(object)
+        if kind == 'categorical':
+            columns[column] = pd.Categorical.from_codes(codes, categories=uniques)
+        else:
+            # Code -1 marks a missing value
+            columns[column] = np.append(uniques, np.nan)[codes]
+    return columns
+
+
+def read_columns(data_dir, name, cache_dir=None, chunk_rows=CHUNK_ROWS):
+    """Columns of ``<data_dir>/<name>.csv`` as arrays, via the .npy cache when given"""
+    path = os.path.join(data_dir, f'{name}.csv')
+    if not cache_dir:
+        return _parse_csv(path, name, chunk_rows)
+
+    stamp = _source_stamp(path)
+    directory = os.path.join(cache_dir, name)
+    columns = _read_cache(directory, stamp)
+    if columns is None:
+        columns = _parse_csv(path, name, chunk_rows)
+        os.makedirs(cache_dir, exist_ok=True)
+        _write_cache(directory, columns, stamp)
+        print(f"Cached {name}.csv columns in {directory}")
+    return columns
+
+
+def read_frame(data_dir, name, cache_dir=None, chunk_rows=CHUNK_ROWS):
+    """Like read_columns, but as a DataFrame (for the small products and users tables)"""
+    return pd.DataFrame(read_columns(data_dir, name, cache_dir=cache_dir, chunk_rows=chunk_rows))
@@ -0,0 +1,303 @@
+"""
+Process-wide recommendation engine lifecycle.
+
+This module deliberately imports nothing heavy: pandas, scikit-learn and the
+engine itself are only imported when the engine is actually built, so
+``manage.py migrate``, ``collectstatic`` and URL checks stay fast. The engine
+is built in a background thread; until it is ready, callers that must not
+block get ``None`` and can serve the lightweight popular-products fallback.
+"""
+import csv
+import heapq
+import os
+import threading
+import time
+
+from .images import get_product_image
+
+_engine = None
+_lock = threading.Lock()
+# Separate from _lock, which is held for the whole build
+_warmup_lock = threading.Lock()
+# Serialises engine swaps so concurrent updates never fork from the same snapshot
+_swap_lock = threading.Lock()
+_warmup_thread = None
+_warmup_error = None
+_fallback_catalog = None
+_watcher_thread = None
+# Snapshot version that failed to load, so it is not retried every poll
+_failed_version = None
+# Batches ingested into the live engine while the snapshot watcher runs, as
+# (version-style timestamp, engine method, batch); replayed onto newer
+# snapshots whose data was read before them
+_ingest_log = []
+# Only the best-rated products are kept for the warm-up fallback
+FALLBACK_SIZE = 1000
+
+
+def _settings_value(name, default=None):
+    """Read a Django setting, tolerating use outside a configured project"""
+    try:
+        from django.conf import settings
+        return getattr(settings, name, default) if settings.configured else default
+    except ImportError:
+        return default
+
+
+def _engine_options():
+    """Engine constructor options from Django settings"""
+    return {
+        'data_dir': _settings_value('RECOMMENDER_DATA_DIR', 'data'),
+        'similarity_top_k': _settings_value('RECOMMENDER_SIMILARITY_TOP_K'),
+        'user_index': _settings_value('RECOMMENDER_USER_INDEX', 'exact'),
+        'user_index_options': _settings_value('RECOMMENDER_USER_INDEX_OPTIONS'),
+        'hybrid_alpha': _settings_value('RECOMMENDER_HYBRID_ALPHA', 0.6),
+        'build_jobs': _settings_value('RECOMMENDER_BUILD_JOBS', 1),
+        'build_memory_budget': _settings_value('RECOMMENDER_BUILD_MEMORY_BUDGET_MB', 512) * 2 ** 20,
+        'ingest_cache_dir': _settings_value('RECOMMENDER_INGEST_CACHE_DIR'),
+        'n_factors': _settings_value('RECOMMENDER_FACTORS', 64),
+        'item_neighbors': _settings_value('RECOMMENDER_ITEM_NEIGHBORS', 50),
+        'popularity_half_life': _settings_value('RECOMMENDER_POPULARITY_HALF_LIFE', 100000),
+        'segment_top_k': _settings_value('RECOMMENDER_SEGMENT_TOP_K', 100),
+        'segment_min_users': _settings_value('RECOMMENDER_SEGMENT_MIN_USERS', 20),
+    }
+
+
+def _artifact_dir():
+    """Configured model artifact root, if it holds at least one snapshot in the current format"""
+    from .artifacts import latest_version, list_versions
+    root = _settings_value('RECOMMENDER_ARTIFACT_DIR')
+    if root and latest_version(root):
+        return root
+    if list_versions(root):
+        print(f"Ignoring model snapshots in {root} written in an older format; building from the CSV files")
+    return None
+
+
+def _build_engine():
+    """Build the engine from the newest snapshot, or from the CSVs if there is none"""
+    from .engine import RecommendationEngine
+    return RecommendationEngine(artifact_dir=_artifact_dir(), **_engine_options())
+
+
+def get_engine():
+    """Get or create the recommendation engine, blocking until it is built.
+
+    Like reload_latest_snapshot, the engine is primed before it is published,
+    so current_engine() and /api/ready/ only see it once it can serve.
+    """
+    global _engine
+    if _engine is None:
+        with _lock:
+            if _engine is None:
+                engine = _build_engine()
+                engine.prime()
+                _engine = engine
+    return _engine
+
+
+def swap_engine(engine):
+    """Publish a new engine snapshot; requests already running keep the old one.
+
+    Cached results are dropped when the model version changes; ingest
+    revisions are part of the cache key instead, so they need no clearing.
+    """
+    global _engine
+    previous = _engine
+    _engine = engine
+    if previous is not None and previous.model_version != engine.model_version:
+        from .cache import invalidate
+        invalidate()
+
+
+def _ingest(method, batch):
+    """Apply a batch with an engine ingest method, swap the result in and log the batch"""
+    from .artifacts import new_version
+    with _swap_lock:
+        previous = get_engine()
+        engine = getattr(previous, method)(batch)
+        if engine is not previous:
+            swap_engine(engine)
+            if _watcher_thread is not None and _watcher_thread.is_alive():
+                _log_ingest(new_version(), method, batch)
+    return engine
+
+
+def _log_ingest(version, method, batch):
+    """Keep an ingested batch for replay, dropping the oldest beyond the configured limit"""
+    _ingest_log.append((version, method, batch))
+    excess = len(_ingest_log) - _settings_value('RECOMMENDER_INGEST_LOG_MAX_BATCHES', 10000)
+    if excess > 0:
+        del _ingest_log[:excess]
+        print(f"Ingest log full: dropped {excess} batches, which a snapshot built before them will miss")
+
+
+def ingest_ratings(batch):
+    """Apply a batch of ratings to the live engine and swap the result in"""
+    return _ingest('ingest_ratings', batch)
+
+
+def ingest_transactions(batch):
+    """Apply a batch of transactions to the live engine and swap the result in"""
+    return _ingest('ingest_transactions', batch)
+
+
+def reload_latest_snapshot():
+    """Load the newest on-disk snapshot if it differs from the live engine.
+
+    The new engine is built and primed off the request path, then swapped in
+    atomically; requests already running finish on the previous snapshot.
+    Returns the new engine, or None when nothing changed.
+
+    Batches ingested after the new snapshot's data was read (its
+    data_version, taken when loading started) are replayed onto it before
+    the swap. Older ones are in its data and are dropped from the log.
+    """
+    global _failed_version
+    from .artifacts import latest_version
+    from .engine import RecommendationEngine
+
+    root = _settings_value('RECOMMENDER_ARTIFACT_DIR')
+    version = latest_version(root)
+    engine = _engine
+    if version is None or engine is None or version == engine.model_version or version == _failed_version:
+        return None
+    try:
+        options = {k: v for k, v in _engine_options().items() if k != 'data_dir'}
+        new_engine = RecommendationEngine(artifact_dir=os.path.join(root, version), **options)
+        new_engine.prime()
+    except Exception as e:
+        _failed_version = version
+        print(f"Error loading model snapshot {version}: {e}")
+        return None
+    with _swap_lock:
+        if _engine is None or _engine.model_version != engine.model_version:
+            # Another reload swapped in a snapshot meanwhile; the next poll reconsiders
+            print(f"Not swapping to snapshot {version}: the live model changed while it loaded")
+            return None
+        pending = [entry for entry in _ingest_log if entry[0] > new_engine.data_version]
+        for _, method, batch in pending:
+            new_engine = getattr(new_engine, method)(batch)
+        dropped = len(_ingest_log) - len(pending)
+        _ingest_log[:] = pending
+        swap_engine(new_engine)
+    print(
+        f"Swapped recommendation engine to snapshot {version}: replayed {len(pending)} ingested batches, "
+        f"dropped {dropped} already in its data"
+    )
+    return new_engine
+
+
+def _watch_snapshots(interval):
+    """Watcher thread body: poll the artifact root for new snapshot versions"""
+    while True:
+        time.sleep(interval)
+        try:
+            reload_latest_snapshot()
+        except Exception as e:
+            print(f"Error checking for model snapshots: {e}")
+
+
+def start_snapshot_watcher(interval=None):
+    """Start polling RECOMMENDER_ARTIFACT_DIR for new snapshots (idempotent)"""
+    global _watcher_thread
+    interval = interval if interval is not None else _settings_value('RECOMMENDER_RELOAD_INTERVAL', 0)
+    if not interval:
+        return
+    with _warmup_lock:
+        if _watcher_thread is not None and _watcher_thread.is_alive():
+            return
+        _watcher_thread = threading.Thread(
+            target=_watch_snapshots, args=(interval,), name='recommender-snapshot-watcher', daemon=True
+        )
+        _watcher_thread.start()
+
+
+def _warm_up():
+    """Background thread body: build and prime the engine and record any failure"""
+    global _warmup_error
+    try:
+        get_engine()
+        _warmup_error = None
+    except Exception as e:
+        _warmup_error = e
+        print(f"Error warming up recommendation engine: {e}")
+
+
+def start_warmup():
+    """Start building the engine in a background thread (idempotent)"""
+    global _warmup_thread
+    with _warmup_lock:
+        if _engine is not None or (_warmup_thread is not None and _warmup_thread.is_alive()):
+            return
+        _warmup_thread = threading.Thread(target=_warm_up, name='recommender-warmup', daemon=True)
+        _warmup_thread.start()
+
+
+def start_serving():
+    """Start the warm-up and the snapshot watcher unless RECOMMENDER_WARMUP is off.
+
+    Called by the serving entry points (backend/wsgi.py, backend/asgi.py and
+    runserver), so scripts, tests, workers and other management commands
+    never start a build.
+    """
+    if _settings_value('RECOMMENDER_WARMUP', True):
+        start_warmup()
+        start_snapshot_watcher()
+
+
+def current_engine():
+    """Return the engine if it is ready, otherwise start warming up and return None"""
+    if _engine is None:
+        start_warmup()
+    return _engine
+
+
+def engine_status():
+    """One of 'ready', 'warming_up', 'error' or 'cold' (warm-up not started)"""
+    if _engine is not None:
+        return 'ready'
+    if _warmup_thread is not None and _warmup_thread.is_alive():
+        return 'warming_up'
+    if _warmup_error is not None:
+        return 'error'
+    return 'cold'
+
+
+def _parse_value(value):
+    """Convert a CSV cell to int or float when it looks numeric"""
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except (TypeError, ValueError):
+            pass
+    return value
+
+
+def _load_fallback_catalog():
+    """Top-rated products, read with the csv module to avoid importing pandas"""
+    global _fallback_catalog
+    if _fallback_catalog is None:
+        data_dir = _settings_value('RECOMMENDER_DATA_DIR', 'data')
+        with open(os.path.join(data_dir, 'products.csv'), newline='') as f:
+            # nlargest keeps file order for equal ratings, like DataFrame.nlargest
+            rows = heapq.nlargest(FALLBACK_SIZE, csv.DictReader(f), key=lambda row: float(row.get('rating') or 0))
+        products = [{key: _parse_value(value) for key, value in row.items()} for row in rows]
+        for product in products:
+            product['id'] = product.pop('product_id', None)
+            product['name'] = product.pop('product_name', None)
+            product['image'] = get_product_image(product_name=product['name'])
+        _fallback_catalog = products
+    return _fallback_catalog
+
+
+def popular_fallback(n_recommendations=5, filters=None):
+    """Top-rated products served while the engine is still warming up, optionally filtered"""
+    try:
+        products = _load_fallback_catalog()
+        if filters is not None:
+            products = [product for product in products if filters.matches(product)]
+        return [dict(product) for product in products[:n_recommendations]]
+    except Exception as e:
+        print(f"Error loading fallback catalog: {e}")
+        return []
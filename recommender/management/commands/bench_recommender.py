@@ -0,0 +1,639 @@
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Modules that must stay out of the Django import path (see recommender/loader.py)
+HEAVY_MODULES = ('pandas', 'numpy', 'scipy', 'sklearn')
+# gunicorn command lines for the serving suite
+SERVERS = {
+    'wsgi': ['backend.wsgi'],
+    'asgi': ['backend.asgi:application', '-k', 'uvicorn_worker.UvicornWorker'],
+}
+
+
+def _peak_rss_mb():
+    """Peak resident set size of the current process in MB (Linux reports KB)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _current_rss_mb():
+    """Current resident set size of this process in MB"""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def _similarity_worker(n_products, top_k, chunk_size, queue):
+    """Build the content model for one catalog size in a fresh process"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.metrics.pairwise import cosine_similarity
+    from recommender.neighbors import topk_cosine_neighbors
+    from recommender.synthetic import make_products
+
+    products = make_products(n_products)
+    features = products['product_name'] + ' ' + products['category'] + ' ' + products['brand']
+    tfidf_matrix = TfidfVectorizer(max_features=100, stop_words='english').fit_transform(features)
+    baseline_rss = _peak_rss_mb()
+
+    start = time.perf_counter()
+    if top_k:
+        topk_cosine_neighbors(tfidf_matrix, top_k, chunk_size=chunk_size)
+    else:
+        cosine_similarity(tfidf_matrix)
+    elapsed = time.perf_counter() - start
+    queue.put((elapsed, _peak_rss_mb(), _peak_rss_mb() - baseline_rss))
+
+
+def _build_worker(n_products, top_k, jobs, memory_budget, chunks_per_job, queue):
+    """Neighbour table build time per job count, checked against the single-process table
+
+    The budget alone gives small catalogs a single chunk, which leaves every
+    job but one idle, so the chunk is also capped to give each job
+    ``chunks_per_job`` chunks.
+    """
+    import numpy as np
+    from joblib.externals.loky import get_reusable_executor
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from recommender.neighbors import chunk_size_for_budget, topk_cosine_neighbors
+    from recommender.synthetic import make_products
+
+    products = make_products(n_products)
+    features = products['product_name'] + ' ' + products['category'] + ' ' + products['brand']
+    tfidf_matrix = TfidfVectorizer(max_features=100, stop_words='english').fit_transform(features)
+
+    results = []
+    reference = None
+    for n_jobs in jobs:
+        chunk = chunk_size_for_budget(n_products, memory_budget, n_jobs)
+        chunk = max(1, min(chunk, -(-n_products // (n_jobs * chunks_per_job))))
+        # Start the pool workers (and their imports) outside the timed build
+        topk_cosine_neighbors(tfidf_matrix[:2 * n_jobs], 1, chunk_size=1, n_jobs=n_jobs)
+        start = time.perf_counter()
+        table = topk_cosine_neighbors(tfidf_matrix, top_k, chunk_size=chunk, n_jobs=n_jobs)
+        elapsed = time.perf_counter() - start
+        if reference is None:
+            reference = table
+        same = np.array_equal(table.indices, reference.indices)
+        results.append((n_jobs, chunk, -(-n_products // chunk), elapsed, same))
+    # Idle pool workers would keep this process from exiting
+    get_reusable_executor().shutdown(wait=True)
+    queue.put(results)
+
+
+def _factors_worker(n_users, n_items, factor_counts, iterations, n_queries, queue):
+    """Implicit ALS training time, hold-out hit rate and top-10 serving latency"""
+    import numpy as np
+    import scipy.sparse as sp
+    from recommender.factorization import ImplicitALS
+    from recommender.synthetic import make_rating_matrix
+
+    # Hold out one interaction per user; hit@10 asks whether it is recommended
+    matrix = make_rating_matrix(n_users, n_items).tocoo()
+    rng = np.random.default_rng(1)
+    order = rng.permutation(matrix.nnz)
+    users, items = matrix.row[order], matrix.col[order]
+    _, held_out = np.unique(users, return_index=True)
+    train = np.ones(len(users), dtype=bool)
+    train[held_out] = False
+    interactions = sp.csr_matrix((matrix.data[order][train], (users[train], items[train])), shape=matrix.shape)
+    evaluated = rng.choice(held_out, min(len(held_out), 10000), replace=False)
+    popular = np.argsort(-np.bincount(interactions.indices, minlength=n_items), kind='stable')[:10]
+    results = [('popular', '-', None, np.isin(items[evaluated], popular).mean(), None, None, None)]
+
+    queries = rng.choice(n_users, n_queries)
+    for n_factors in factor_counts:
+        start = time.perf_counter()
+        model = ImplicitALS(n_factors, iterations=iterations).fit(interactions)
+        train_s = time.perf_counter() - start
+        top, _ = model.recommend(users[evaluated], 10)
+        hit_rate = (top == items[evaluated][:, None]).any(axis=1).mean()
+
+        latencies = []
+        for row in queries:
+            start = time.perf_counter()
+            model.recommend([row], 10)
+            latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        model.recommend(queries, 10)
+        batch_rate = n_queries / (time.perf_counter() - start)
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+        results.append(('als', n_factors, train_s, hit_rate, p50, p99, batch_rate))
+    queue.put(results)
+
+
+def _item_cf_worker(n_users, n_items, n_queries, queue):
+    """Per-request latency of user-based versus item-based CF for one user count"""
+    import tempfile
+    import numpy as np
+    import pandas as pd
+    from recommender.engine import RecommendationEngine
+    from recommender.synthetic import make_products, make_rating_matrix
+
+    matrix = make_rating_matrix(n_users, n_items).tocoo()
+    with tempfile.TemporaryDirectory() as data_dir:
+        make_products(n_items).to_csv(os.path.join(data_dir, 'products.csv'), index=False)
+        pd.DataFrame({'user_id': [1], 'age': [30], 'gender': ['Female'], 'location': ['Delhi']}).to_csv(
+            os.path.join(data_dir, 'users.csv'), index=False
+        )
+        pd.DataFrame({'transaction_id': [1], 'user_id': [1], 'product_id': [1], 'quantity': [1]}).to_csv(
+            os.path.join(data_dir, 'transactions.csv'), index=False
+        )
+        pd.DataFrame({
+            'user_id': matrix.row + 1, 'product_id': matrix.col + 1, 'rating': matrix.data.astype(int)
+        }).to_csv(os.path.join(data_dir, 'ratings.csv'), index=False)
+        start = time.perf_counter()
+        engine = RecommendationEngine(data_dir=data_dir, similarity_top_k=20, n_factors=0)
+        build_s = time.perf_counter() - start
+
+    users = np.random.default_rng(1).choice(engine.user_ids, n_queries).tolist()
+    results = []
+    for mode, recommend in (('user', engine.get_collaborative_recommendations),
+                            ('item', engine.get_item_based_recommendations)):
+        latencies = []
+        for user_id in users:
+            start = time.perf_counter()
+            recommend(user_id, 10)
+            latencies.append(time.perf_counter() - start)
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+        results.append((mode, build_s, p50, p99))
+    queue.put(results)
+
+
+def _latency_ms(call, arguments):
+    """p50/p95/p99 and mean latency in ms of call(argument) over arguments, after one warm-up call"""
+    import numpy as np
+
+    call(arguments[0])
+    latencies = []
+    for argument in arguments:
+        start = time.perf_counter()
+        call(argument)
+        latencies.append(time.perf_counter() - start)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    return {'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99, 'mean_ms': np.mean(latencies) * 1000}
+
+
+def _engine_worker(data_dir, engine_options, n_queries, n_recommendations, queue):
+    """Full engine build from CSV, snapshot load and per-call latency of every endpoint.
+
+    Latencies are measured on the engine loaded back from its snapshot, as
+    served in production; serving_rss_mb is that engine's resident size.
+    """
+    import tempfile
+    import numpy as np
+    from recommender.engine import RecommendationEngine
+
+    start = time.perf_counter()
+    built = RecommendationEngine(data_dir=data_dir, **engine_options)
+    build_s = time.perf_counter() - start
+    build_rss = _peak_rss_mb()
+
+    with tempfile.TemporaryDirectory() as root:
+        path = built.save_artifacts(root)
+        del built
+        start = time.perf_counter()
+        engine = RecommendationEngine(artifact_dir=path, **engine_options)
+        engine.prime()
+        load_s = time.perf_counter() - start
+
+        rng = np.random.default_rng(1)
+        products = rng.choice(np.asarray(engine.product_ids), n_queries).tolist()
+        users = rng.choice(np.asarray(engine.user_ids), n_queries).tolist()
+        n_pages = max(1, -(-len(engine.product_ids) // 50))
+        pages = rng.integers(1, n_pages + 1, size=n_queries).tolist()
+        calls = {
+            'content': (products, lambda p: engine.get_content_based_recommendations(p, n_recommendations)),
+            'collaborative': (users, lambda u: engine.get_collaborative_recommendations(u, n_recommendations)),
+            'hybrid': (users, lambda u: engine.get_hybrid_recommendations(u, n_recommendations)),
+            'item_based': (users, lambda u: engine.get_item_based_recommendations(u, n_recommendations)),
+            'popular': (users, lambda u: engine.get_popular_recommendations(n_recommendations)),
+            'catalog_product': (products, engine.catalog.product),
+            'catalog_page': (pages, lambda page: engine.catalog.page(page, 50)),
+        }
+        if engine.factor_model is not None:
+            calls['factors'] = (users, lambda u: engine.get_factor_recommendations(u, n_recommendations))
+        latencies = {name: _latency_ms(call, arguments) for name, (arguments, call) in calls.items()}
+        queue.put({
+            'products': len(engine.product_ids), 'users': len(engine.user_ids),
+            'build_s': build_s, 'peak_rss_mb': build_rss, 'load_s': load_s,
+            'serving_rss_mb': _current_rss_mb(),
+            'latency': latencies,
+        })
+
+
+def _neighbors_worker(n_users, n_items, k, n_queries, probes, queue):
+    """Recall@k and QPS of the IVF user index against exact brute force"""
+    import numpy as np
+    from recommender.neighbors import ClusteredNeighborIndex, ExactNeighborIndex
+    from recommender.synthetic import make_rating_matrix
+
+    matrix = make_rating_matrix(n_users, n_items)
+    queries = np.random.default_rng(1).choice(n_users, n_queries, replace=False)
+    rows = [matrix[q] for q in queries]
+    results = []
+
+    start = time.perf_counter()
+    exact = ExactNeighborIndex(matrix)
+    results.append(('exact', '-', time.perf_counter() - start, None, None))
+    start = time.perf_counter()
+    truth = [exact.query(row, k, exclude=[q]).indices[0] for q, row in zip(queries, rows)]
+    results[0] = results[0][:3] + (1.0, n_queries / (time.perf_counter() - start))
+
+    start = time.perf_counter()
+    ivf = ClusteredNeighborIndex(matrix)
+    build = time.perf_counter() - start
+    for n_probe in probes:
+        start = time.perf_counter()
+        found = [ivf.query(row, k, exclude=[q], n_probe=n_probe).indices[0] for q, row in zip(queries, rows)]
+        qps = n_queries / (time.perf_counter() - start)
+        recall = np.mean([
+            len(np.intersect1d(f[f >= 0], t[t >= 0])) / max(1, (t >= 0).sum())
+            for f, t in zip(found, truth)
+        ])
+        results.append((f'ivf/{ivf.n_lists}', n_probe, build, recall, qps))
+    queue.put(results)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark recommendation engine builds and serving on synthetic data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--suite', choices=['similarity', 'build', 'factors', 'item_cf', 'neighbors', 'imports',
+                                                'serving', 'engine'],
+                            default='similarity')
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000])
+        parser.add_argument('--top-k', type=int, default=50)
+        parser.add_argument('--chunk-size', type=int, default=1024)
+        parser.add_argument('--jobs', type=int, nargs='+', default=[1, 2, 4],
+                            help='Process counts compared by the build suite')
+        parser.add_argument('--memory-budget-mb', type=int, default=512)
+        parser.add_argument('--chunks-per-job', type=int, default=4,
+                            help='Minimum chunks per process in the build suite')
+        parser.add_argument('--users', type=int, default=1000000)
+        parser.add_argument('--items', type=int, default=100000)
+        parser.add_argument('--neighbors', type=int, default=9)
+        parser.add_argument('--factors', type=int, nargs='+', default=[32, 64])
+        parser.add_argument('--user-counts', type=int, nargs='+', default=[50000, 200000],
+                            help='User counts compared by the item_cf suite')
+        parser.add_argument('--iterations', type=int, default=15)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--probes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+        parser.add_argument('--max-import-ms', type=float, default=None,
+                            help='Fail the imports suite when Django startup imports take longer')
+        parser.add_argument('--servers', nargs='+', choices=sorted(SERVERS), default=['wsgi', 'asgi'])
+        parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes per server')
+        parser.add_argument('--concurrency', type=int, default=32, help='Concurrent client connections')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--endpoint', choices=['user', 'similar', 'product'], default='user',
+                            help='API endpoint replayed by the serving suite')
+        parser.add_argument('--data-dir', default=None,
+                            help='CSV directory built by the engine suite (default: generate --items x --users)')
+        parser.add_argument('--json-output', default=None, help='Save the results to this JSON file')
+        parser.add_argument('--compare', default=None,
+                            help='Compare the results with a JSON file saved by an earlier run')
+        parser.add_argument('--tolerance', type=float, default=0.1,
+                            help='Relative slowdown flagged as a regression by --compare')
+
+    def handle(self, *args, **options):
+        self.results = []
+        if options['suite'] == 'similarity':
+            self._bench_similarity(options)
+        elif options['suite'] == 'build':
+            self._bench_build(options)
+        elif options['suite'] == 'factors':
+            self._bench_factors(options)
+        elif options['suite'] == 'item_cf':
+            self._bench_item_cf(options)
+        elif options['suite'] == 'neighbors':
+            self._bench_neighbors(options)
+        elif options['suite'] == 'imports':
+            self._bench_imports(options)
+        elif options['suite'] == 'serving':
+            self._bench_serving(options)
+        elif options['suite'] == 'engine':
+            self._bench_engine(options)
+
+        report = {
+            'suite': options['suite'],
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'environment': self._environment(),
+            'options': {name: value for name, value in options.items()
+                        if name not in ('verbosity', 'settings', 'pythonpath', 'traceback', 'no_color',
+                                        'force_color', 'skip_checks', 'stdout', 'stderr')},
+            'results': self.results,
+        }
+        if options['compare']:
+            self._compare(report, options['compare'], options['tolerance'])
+        if options['json_output']:
+            with open(options['json_output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Results saved to {options['json_output']}")
+
+    def _record(self, params, metrics):
+        """Keep one result row for --json-output / --compare; params identify the row"""
+        self.results.append({'params': params, 'metrics': metrics})
+
+    @staticmethod
+    def _environment():
+        """Machine and code version a run was measured on"""
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                    cwd=settings.BASE_DIR).stdout.strip() or None
+        except OSError:
+            commit = None
+        return {
+            'commit': commit,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+        }
+
+    def _compare(self, report, path, tolerance):
+        """Print every metric next to its value in an earlier run, flagging regressions.
+
+        Metrics ending in _s, _ms or _mb are times and sizes, where higher is
+        worse; the others (rates, recall) regress when they drop.
+        """
+        with open(path) as f:
+            baseline = json.load(f)
+        if baseline['suite'] != report['suite']:
+            raise CommandError(f"{path} holds results of the {baseline['suite']} suite, not {report['suite']}")
+        previous = {json.dumps(row['params'], sort_keys=True): row['metrics'] for row in baseline['results']}
+
+        regressions = 0
+        self.stdout.write(f"Compared with {path} (commit {baseline['environment'].get('commit')})")
+        self.stdout.write(f"{'result':<40} {'metric':<24} {'before':>10} {'after':>10} {'change':>8}")
+        for row in self.results:
+            key = json.dumps(row['params'], sort_keys=True)
+            label = ' '.join(f'{value}' for value in row['params'].values())
+            for metric, value in row['metrics'].items():
+                before = previous.get(key, {}).get(metric)
+                if isinstance(value, bool) or not isinstance(value, (int, float)) or not before:
+                    continue
+                change = value / before - 1
+                worse = change if metric.endswith(('_s', '_ms', '_mb')) else -change
+                flag = ' REGRESSION' if worse > tolerance else ''
+                regressions += bool(flag)
+                self.stdout.write(
+                    f"{label:<40} {metric:<24} {before:>10.3f} {value:>10.3f} {change:>+8.1%}{flag}"
+                )
+        self.stdout.write(f"{regressions} regression(s) beyond {tolerance:.0%}")
+
+    def _run_isolated(self, target, *args):
+        """Run a benchmark in a child process so peak RSS is not shared between runs"""
+        ctx = multiprocessing.get_context('spawn')
+        queue = ctx.Queue()
+        process = ctx.Process(target=target, args=(*args, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        return result
+
+    def _bench_similarity(self, options):
+        """Dense cosine_similarity versus chunked top-k neighbour tables"""
+        self.stdout.write(f"{'products':>10} {'mode':>10} {'build_s':>10} {'peak_rss_mb':>12} {'build_rss_mb':>13}")
+        for n_products in options['sizes']:
+            for mode, top_k in (('dense', None), (f"top{options['top_k']}", options['top_k'])):
+                elapsed, peak, delta = self._run_isolated(
+                    _similarity_worker, n_products, top_k, options['chunk_size']
+                )
+                self.stdout.write(f"{n_products:>10} {mode:>10} {elapsed:>10.3f} {peak:>12.1f} {delta:>13.1f}")
+                self._record({'products': n_products, 'mode': mode},
+                             {'build_s': elapsed, 'peak_rss_mb': peak, 'build_rss_mb': delta})
+
+    def _bench_build(self, options):
+        """Parallel top-k neighbour table build: wall-clock time and speedup per job count"""
+        self.stdout.write(
+            f"{'products':>10} {'jobs':>5} {'chunk':>7} {'chunks':>7} {'build_s':>9} {'speedup':>8} {'same':>5}"
+        )
+        for n_products in options['sizes']:
+            results = self._run_isolated(
+                _build_worker, n_products, options['top_k'], options['jobs'], options['memory_budget_mb'] * 2 ** 20,
+                options['chunks_per_job']
+            )
+            base = results[0][3]
+            for n_jobs, chunk, n_chunks, elapsed, same in results:
+                self.stdout.write(
+                    f"{n_products:>10} {n_jobs:>5} {chunk:>7} {n_chunks:>7} {elapsed:>9.2f} {base / elapsed:>8.2f} "
+                    f"{str(same):>5}"
+                )
+                if n_jobs != 1 and n_chunks == 1:
+                    self.stdout.write(self.style.WARNING(f'  only one chunk ran; {n_jobs} jobs were not compared'))
+                self._record({'products': n_products, 'jobs': n_jobs},
+                             {'build_s': elapsed, 'speedup': base / elapsed, 'same': same})
+
+    def _bench_factors(self, options):
+        """Implicit ALS: training time, hit@10 on held-out interactions and serving latency"""
+        results = self._run_isolated(
+            _factors_worker, options['users'], options['items'], options['factors'],
+            options['iterations'], options['queries']
+        )
+        self.stdout.write(
+            f"{'model':>8} {'factors':>8} {'train_s':>8} {'hit@10':>7} {'p50_ms':>7} {'p99_ms':>7} {'batch_users/s':>14}"
+        )
+        for model, n_factors, train_s, hit_rate, p50, p99, batch_rate in results:
+            if train_s is None:
+                self.stdout.write(f"{model:>8} {n_factors:>8} {'-':>8} {hit_rate:>7.3f}")
+                self._record({'model': model, 'factors': n_factors}, {'hit_at_10': hit_rate})
+                continue
+            self.stdout.write(
+                f"{model:>8} {n_factors:>8} {train_s:>8.1f} {hit_rate:>7.3f} {p50:>7.2f} {p99:>7.2f} {batch_rate:>14.0f}"
+            )
+            self._record({'model': model, 'factors': n_factors}, {
+                'train_s': train_s, 'hit_at_10': hit_rate, 'p50_ms': p50, 'p99_ms': p99, 'batch_users_per_s': batch_rate
+            })
+
+    def _bench_item_cf(self, options):
+        """User-based versus item-based CF request latency as the user count grows"""
+        self.stdout.write(f"{'users':>9} {'cf':>5} {'build_s':>8} {'p50_ms':>7} {'p99_ms':>7}")
+        for n_users in options['user_counts']:
+            results = self._run_isolated(_item_cf_worker, n_users, options['items'], options['queries'])
+            for mode, build_s, p50, p99 in results:
+                self.stdout.write(f"{n_users:>9} {mode:>5} {build_s:>8.1f} {p50:>7.2f} {p99:>7.2f}")
+                self._record({'users': n_users, 'cf': mode}, {'build_s': build_s, 'p50_ms': p50, 'p99_ms': p99})
+
+    def _bench_neighbors(self, options):
+        """Recall@k versus queries/sec for the user neighbour indexes"""
+        results = self._run_isolated(
+            _neighbors_worker, options['users'], options['items'], options['neighbors'],
+            options['queries'], options['probes']
+        )
+        self.stdout.write(f"{'index':>12} {'n_probe':>8} {'build_s':>9} {'recall@k':>9} {'qps':>9}")
+        for index, n_probe, build, recall, qps in results:
+            self.stdout.write(f"{index:>12} {n_probe!s:>8} {build:>9.2f} {recall:>9.3f} {qps:>9.1f}")
+            self._record({'index': index, 'n_probe': n_probe}, {'build_s': build, 'recall_at_k': recall, 'qps': qps})
+
+    def _bench_engine(self, options):
+        """Engine build time, peak RSS and per-call latency percentiles on a full dataset.
+
+        Builds from --data-dir, or from a synthetic dataset of --items products
+        and --users users. Engine options come from the settings, except that
+        the content model keeps --top-k neighbours and no ingest cache is used.
+        """
+        import tempfile
+        from recommender.loader import _engine_options
+        from recommender.synthetic import write_dataset
+
+        engine_options = _engine_options()
+        engine_options.update(similarity_top_k=options['top_k'], ingest_cache_dir=None)
+        del engine_options['data_dir']
+
+        with tempfile.TemporaryDirectory() as generated:
+            data_dir = options['data_dir']
+            if data_dir is None:
+                data_dir = generated
+                start = time.perf_counter()
+                write_dataset(data_dir, options['items'], options['users'])
+                self.stdout.write(
+                    f"Generated {options['items']} products x {options['users']} users "
+                    f"in {time.perf_counter() - start:.1f}s"
+                )
+            result = self._run_isolated(_engine_worker, data_dir, engine_options, options['queries'], 10)
+
+        self.stdout.write(
+            f"products={result['products']} users={result['users']} build_s={result['build_s']:.1f} "
+            f"peak_rss_mb={result['peak_rss_mb']:.0f} load_s={result['load_s']:.2f} "
+            f"serving_rss_mb={result['serving_rss_mb']:.0f}"
+        )
+        self._record(
+            {'products': result['products'], 'users': result['users'], 'call': 'build'},
+            {name: result[name] for name in ('build_s', 'peak_rss_mb', 'load_s', 'serving_rss_mb')}
+        )
+        self.stdout.write(f"{'call':>16} {'p50_ms':>8} {'p95_ms':>8} {'p99_ms':>8} {'mean_ms':>8}")
+        for call, latency in result['latency'].items():
+            self.stdout.write(
+                f"{call:>16} {latency['p50_ms']:>8.3f} {latency['p95_ms']:>8.3f} "
+                f"{latency['p99_ms']:>8.3f} {latency['mean_ms']:>8.3f}"
+            )
+            self._record({'products': result['products'], 'users': result['users'], 'call': call}, latency)
+
+    def _bench_imports(self, options):
+        """python -X importtime of Django startup plus URLconf/view imports"""
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE, RECOMMENDER_WARMUP='False')
+        code = 'import django; django.setup(); import ' + settings.ROOT_URLCONF
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            env=env, capture_output=True, text=True, check=True
+        )
+
+        timings = []
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            self_us, cumulative_us, module = line[len('import time:'):].split('|')
+            timings.append((module.strip(), int(self_us), int(cumulative_us)))
+
+        total_ms = sum(self_us for _, self_us, _ in timings) / 1000
+        self.stdout.write(f"{'module':<50} {'cumulative_ms':>14}")
+        for module, _, cumulative_us in sorted(timings, key=lambda t: -t[2])[:15]:
+            self.stdout.write(f"{module:<50} {cumulative_us / 1000:>14.1f}")
+        self.stdout.write(f"Total import time: {total_ms:.1f} ms over {len(timings)} modules")
+        self._record({'modules': 'startup'}, {'import_ms': total_ms})
+
+        heavy = sorted({m for m, _, _ in timings if m.split('.')[0] in HEAVY_MODULES and '.' not in m})
+        if heavy:
+            raise CommandError(f"Django startup imports heavy modules: {', '.join(heavy)}")
+        if options['max_import_ms'] is not None and total_ms > options['max_import_ms']:
+            raise CommandError(f"Import time {total_ms:.1f} ms exceeds {options['max_import_ms']} ms")
+
+    def _bench_serving(self, options):
+        """Throughput and latency percentiles of sync WSGI versus async ASGI workers.
+
+        Each server runs under gunicorn against the newest model snapshot with
+        the result cache disabled, so every request is scored; requests hit
+        the chosen endpoint for random known user or product ids.
+        """
+        import numpy as np
+        from recommender.artifacts import latest_version
+
+        root = settings.RECOMMENDER_ARTIFACT_DIR
+        version = latest_version(root)
+        if version is None:
+            raise CommandError(f"No model snapshot found in {root}; run build_recommender_model first")
+        if options['endpoint'] == 'user':
+            ids = np.load(os.path.join(root, version, 'user_ids.npy'))
+        else:
+            ids = np.load(os.path.join(root, version, 'product_store.product_id.values.npy'))
+        template = {
+            'user': '/api/recommend/user/{}/?n=10',
+            'similar': '/api/recommend/similar/{}/?n=10',
+            'product': '/api/product/{}/',
+        }[options['endpoint']]
+        rng = np.random.default_rng(0)
+        paths = [template.format(item_id) for item_id in rng.choice(ids, options['requests']).tolist()]
+
+        self.stdout.write(f"{'server':>7} {'ok':>6} {'errors':>7} {'req/s':>8} {'p50_ms':>8} {'p99_ms':>8}")
+        for server in options['servers']:
+            ok, errors, elapsed, latencies = self._load_test(server, paths, options)
+            p50, p99 = np.percentile(latencies, [50, 99]) * 1000 if latencies else (float('nan'), float('nan'))
+            self.stdout.write(f"{server:>7} {ok:>6} {errors:>7} {ok / elapsed:>8.1f} {p50:>8.1f} {p99:>8.1f}")
+            self._record({'server': server, 'endpoint': options['endpoint']},
+                         {'req_per_s': ok / elapsed, 'p50_ms': p50, 'p99_ms': p99})
+
+    def _load_test(self, server, paths, options):
+        """Start one gunicorn server, wait until it is ready and replay paths concurrently"""
+        port = options['port']
+        env = dict(
+            os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE, DEBUG='True',
+            RECOMMENDER_CACHE_ALIAS='', RECOMMENDER_ASYNC_VIEWS=str(server == 'asgi'),
+        )
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', *SERVERS[server], '-w', str(options['workers']),
+             '-b', f'127.0.0.1:{port}', '--log-level', 'warning'],
+            env=env, stdout=subprocess.DEVNULL
+        )
+        try:
+            self._wait_ready(port)
+
+            def fetch(path):
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                start = time.perf_counter()
+                try:
+                    connection.request('GET', path)
+                    response = connection.getresponse()
+                    response.read()
+                    return response.status, time.perf_counter() - start
+                except OSError:
+                    return None, time.perf_counter() - start
+                finally:
+                    connection.close()
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(options['concurrency']) as clients:
+                results = list(clients.map(fetch, paths))
+            elapsed = time.perf_counter() - start
+        finally:
+            process.terminate()
+            process.wait()
+
+        latencies = [latency for status, latency in results if status == 200]
+        return len(latencies), len(results) - len(latencies), elapsed, latencies
+
+    def _wait_ready(self, port, timeout=300):
+        """Poll /api/ready/ until every worker answers 200"""
+        deadline = time.monotonic() + timeout
+        ready = 0
+        while ready < 20:
+            if time.monotonic() > deadline:
+                raise CommandError(f"Server on port {port} did not become ready in {timeout}s")
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+                connection.request('GET', '/api/ready/')
+                response = connection.getresponse()
+                body = json.loads(response.read() or b'{}')
+                connection.close()
+                ready = ready + 1 if response.status == 200 and body.get('status') == 'ready' else 0
+            except (OSError, ValueError):
+                ready = 0
+            time.sleep(0.1 if ready else 0.5)
@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recommender.engine import RecommendationEngine
+from recommender.loader import _engine_options
+
+
+class Command(BaseCommand):
+    help = 'Fit the recommendation models and write a versioned, memory-mappable snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--data-dir', default=settings.RECOMMENDER_DATA_DIR,
+                            help='Directory with the source CSV files (default: RECOMMENDER_DATA_DIR)')
+        parser.add_argument('--output', default=settings.RECOMMENDER_ARTIFACT_DIR,
+                            help='Snapshot root directory (default: RECOMMENDER_ARTIFACT_DIR)')
+        parser.add_argument('--keep', type=int, default=3, help='Number of snapshot versions to keep')
+        parser.add_argument('--jobs', type=int, default=-1,
+                            help='Processes for the neighbour tables (default: every core)')
+        parser.add_argument('--memory-budget-mb', type=int, default=settings.RECOMMENDER_BUILD_MEMORY_BUDGET_MB,
+                            help='Memory for concurrent similarity blocks; sets the chunk size')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        engine = RecommendationEngine(**{
+            **_engine_options(),
+            'data_dir': options['data_dir'],
+            'build_jobs': options['jobs'],
+            'build_memory_budget': options['memory_budget_mb'] * 2 ** 20,
+        })
+        path = engine.save_artifacts(options['output'], keep=options['keep'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Built model {engine.model_version} in {time.perf_counter() - start:.2f}s -> {path}"
+        ))
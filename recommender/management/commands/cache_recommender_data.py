@@ -0,0 +1,27 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from recommender.ingest import DTYPES, read_columns
+
+
+class Command(BaseCommand):
+    help = 'Convert the source CSV files into the .npy column cache used by model builds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--data-dir', default=settings.RECOMMENDER_DATA_DIR,
+                            help='Directory with the source CSV files (default: RECOMMENDER_DATA_DIR)')
+        parser.add_argument('--cache-dir', default=settings.RECOMMENDER_INGEST_CACHE_DIR,
+                            help='Column cache directory (default: RECOMMENDER_INGEST_CACHE_DIR)')
+
+    def handle(self, *args, **options):
+        if not options['cache_dir']:
+            raise CommandError('No cache directory: pass --cache-dir or set RECOMMENDER_INGEST_CACHE_DIR')
+
+        for name in DTYPES:
+            start = time.perf_counter()
+            columns = read_columns(options['data_dir'], name, cache_dir=options['cache_dir'])
+            n_rows = len(next(iter(columns.values()))) if columns else 0
+            self.stdout.write(f"{name:>13}: {n_rows} rows in {time.perf_counter() - start:.2f}s")
+        self.stdout.write(self.style.SUCCESS(f"Column cache ready in {options['cache_dir']}"))
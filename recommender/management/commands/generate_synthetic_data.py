@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Write synthetic products, users, ratings and transactions CSV files at a chosen scale'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Directory for the CSV files (usable as RECOMMENDER_DATA_DIR)')
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--users', type=int, default=1000000)
+        parser.add_argument('--ratings-per-user', type=int, default=20)
+        parser.add_argument('--transactions-per-user', type=int, default=5)
+        parser.add_argument('--tastes', type=int, default=200,
+                            help='Taste groups; users mostly rate and buy within their group')
+        parser.add_argument('--zipf-a', type=float, default=1.2,
+                            help='Zipf exponent of product popularity within a taste group')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        from recommender.synthetic import write_dataset
+
+        start = time.perf_counter()
+        written = write_dataset(
+            options['output'], options['products'], options['users'],
+            ratings_per_user=options['ratings_per_user'],
+            transactions_per_user=options['transactions_per_user'],
+            n_tastes=options['tastes'], zipf_a=options['zipf_a'], seed=options['seed'],
+        )
+        for name, (rows, elapsed) in written.items():
+            self.stdout.write(f"{name:>13}: {rows} rows in {elapsed:.2f}s")
+        self.stdout.write(self.style.SUCCESS(
+            f"Synthetic dataset written to {options['output']} in {time.perf_counter() - start:.1f}s"
+        ))
@@ -0,0 +1,48 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from recommender.artifacts import latest_version
+from recommender.precompute import precompute_hybrid, publish_precomputed
+
+
+class Command(BaseCommand):
+    help = 'Score hybrid recommendations for every user of a snapshot and publish them as a new snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--artifact-dir', default=settings.RECOMMENDER_ARTIFACT_DIR,
+                            help='Snapshot root directory (default: RECOMMENDER_ARTIFACT_DIR)')
+        parser.add_argument('--snapshot', default=None, help='Snapshot version to score (default: newest)')
+        parser.add_argument('-n', '--n-recommendations', type=int, default=20,
+                            help='Recommendations stored per user; larger requests are scored live')
+        parser.add_argument('--workers', type=int, nargs='+', default=[os.cpu_count() or 1],
+                            help='Worker process counts; several values benchmark each one')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Users scored per task')
+        parser.add_argument('--keep', type=int, default=3, help='Number of snapshot versions to keep')
+        parser.add_argument('--dry-run', action='store_true', help='Report throughput without publishing')
+
+    def handle(self, *args, **options):
+        root = options['artifact_dir']
+        version = options['snapshot'] or latest_version(root)
+        path = os.path.join(root, version) if version else None
+        if path is None or not os.path.isdir(path):
+            raise CommandError(f"No model snapshot found in {root}; run build_recommender_model first")
+
+        table = None
+        self.stdout.write(f"{'workers':>8} {'users':>10} {'seconds':>9} {'users/s':>10}")
+        for workers in options['workers']:
+            start = time.perf_counter()
+            table = precompute_hybrid(
+                path, options['n_recommendations'], workers, options['chunk_size'], settings.RECOMMENDER_HYBRID_ALPHA
+            )
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"{workers:>8} {len(table):>10} {elapsed:>9.2f} {len(table) / elapsed:>10.1f}")
+
+        if options['dry_run']:
+            return
+        new_path = publish_precomputed(
+            root, version, table, alpha=settings.RECOMMENDER_HYBRID_ALPHA, keep=options['keep']
+        )
+        self.stdout.write(self.style.SUCCESS(f"Published precomputed recommendations for {version} -> {new_path}"))
@@ -0,0 +1,169 @@
+"""
+Copy-on-write helpers for updating CSR matrices with small batches.
+
+Every helper returns a new matrix and never writes into its input, so
+matrices that are memory-mapped from a snapshot or still being read by
+in-flight requests stay untouched.
+
+Ingest batches go through DeltaMatrix: the CSR base is never rewritten, and
+the rows a batch touches are copied into a small overlay instead. A batch
+costs time proportional to the overlay, not to the whole matrix. Once the
+overlay holds MERGE_FRACTION of the base's entries, the next batch merges it
+into a new base. The user id -> row maps follow the same pattern (see
+append_positions).
+"""
+from collections import ChainMap
+
+import numpy as np
+import scipy.sparse as sp
+
+# Overlay entries (or rows, for position maps), as a share of the base, that trigger a merge
+MERGE_FRACTION = 0.02
+# Overlays below this many entries never merge, so small matrices do not merge on every batch
+MERGE_MIN_NNZ = 100000
+
+
+def _ranges(starts, lengths):
+    """Concatenated aranges start:start + length, without a Python loop"""
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + offsets
+
+
+def _cells(matrix, rows, columns):
+    """Values of (row, column) cells of a CSR matrix, 0 where not stored"""
+    return np.asarray(matrix[rows, columns], dtype=matrix.dtype).ravel()
+
+
+class DeltaMatrix:
+    """A CSR base matrix plus an overlay of replaced or appended rows.
+
+    ``rows`` (sorted) are the overlaid row ids and ``delta`` holds their
+    current contents, one delta row per id. Row gathers (``matrix[rows]``)
+    read each row from wherever it currently lives, so scoring code can use a
+    DeltaMatrix wherever it used a CSR matrix.
+    """
+
+    def __init__(self, base, rows=None, delta=None, n_rows=None):
+        self.base = base
+        self.rows = np.empty(0, dtype=np.int64) if rows is None else rows
+        self.delta = sp.csr_matrix((0, base.shape[1]), dtype=base.dtype) if delta is None else delta
+        self.shape = (base.shape[0] if n_rows is None else n_rows, base.shape[1])
+        self.dtype = base.dtype
+
+    @classmethod
+    def wrap(cls, matrix):
+        """A DeltaMatrix view of a CSR matrix (returned unchanged if it already is one)"""
+        if isinstance(matrix, cls):
+            return matrix
+        return cls(matrix if sp.isspmatrix_csr(matrix) else sp.csr_matrix(matrix))
+
+    @property
+    def nnz(self):
+        """Stored entries of the rows as currently visible"""
+        overlaid = self.rows[self.rows < self.base.shape[0]]
+        return self.base.nnz - int(np.diff(self.base.indptr)[overlaid].sum()) + self.delta.nnz
+
+    def _slots(self, rows):
+        """Overlay slot of each row id, -1 for rows that live in the base"""
+        if not len(self.rows):
+            return np.full(len(rows), -1)
+        slots = np.minimum(np.searchsorted(self.rows, rows), len(self.rows) - 1)
+        return np.where(self.rows[slots] == rows, slots, -1)
+
+    def __getitem__(self, rows):
+        """CSR matrix of the given rows, in order; rows past the base without an overlay are empty"""
+        rows = np.asarray(rows, dtype=np.int64).ravel()
+        slots = self._slots(rows)
+        in_delta = slots >= 0
+        in_base = ~in_delta & (rows < self.base.shape[0])
+        if in_base.all():
+            return self.base[rows]
+
+        lengths = np.zeros(len(rows), dtype=np.int64)
+        starts = np.zeros(len(rows), dtype=np.int64)
+        base_rows, delta_slots = rows[in_base], slots[in_delta]
+        lengths[in_base] = self.base.indptr[base_rows + 1] - self.base.indptr[base_rows]
+        starts[in_base] = self.base.indptr[base_rows]
+        lengths[in_delta] = self.delta.indptr[delta_slots + 1] - self.delta.indptr[delta_slots]
+        starts[in_delta] = self.delta.indptr[delta_slots]
+        indptr = np.concatenate(([0], np.cumsum(lengths)))
+        data = np.empty(indptr[-1], dtype=self.dtype)
+        indices = np.empty(indptr[-1], dtype=self.base.indices.dtype)
+        for mask, source in ((in_base, self.base), (in_delta, self.delta)):
+            destination = _ranges(indptr[:-1][mask], lengths[mask])
+            positions = _ranges(starts[mask], lengths[mask])
+            data[destination] = source.data[positions]
+            indices[destination] = source.indices[positions]
+        return sp.csr_matrix((data, indices, indptr), shape=(len(rows), self.shape[1]))
+
+    def cells(self, rows, columns):
+        """Values of (row, column) cells, 0 where nothing is stored"""
+        rows = np.asarray(rows, dtype=np.int64)
+        touched, local = np.unique(rows, return_inverse=True)
+        return _cells(self[touched], local, columns)
+
+    def set_rows(self, rows, new_rows):
+        """Return a copy with each of ``rows`` (unique) replaced by the matching row of new_rows"""
+        rows = np.asarray(rows, dtype=np.int64)
+        kept = np.flatnonzero(~np.isin(self.rows, rows))
+        all_rows = np.concatenate([self.rows[kept], rows])
+        order = np.argsort(all_rows, kind='stable')
+        delta = sp.vstack([self.delta[kept], sp.csr_matrix(new_rows, dtype=self.dtype)], format='csr')[order]
+        delta.eliminate_zeros()
+        delta.sort_indices()
+        n_rows = max(self.shape[0], int(rows.max()) + 1 if len(rows) else 0)
+        updated = DeltaMatrix(self.base, all_rows[order], delta, n_rows)
+        if delta.nnz > max(MERGE_MIN_NNZ, MERGE_FRACTION * self.base.nnz):
+            return DeltaMatrix(updated.tocsr())
+        return updated
+
+    def set_cells(self, rows, columns, values, add=False):
+        """Return a copy with cells overwritten (or incremented with add=True).
+
+        With add=False, (row, column) pairs must be unique; with add=True,
+        repeated pairs add up.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        touched, local = np.unique(rows, return_inverse=True)
+        current = self[touched]
+        values = np.asarray(values, dtype=self.dtype)
+        if not add:
+            values = values - _cells(current, local, columns)
+        change = sp.csr_matrix((values, (local, columns)), shape=current.shape, dtype=self.dtype)
+        return self.set_rows(touched, current + change)
+
+    def tocsr(self):
+        """The matrix as one CSR matrix (the base itself when nothing is overlaid)"""
+        if not len(self.rows) and self.shape[0] == self.base.shape[0]:
+            return self.base
+        merged = self[np.arange(self.shape[0])]
+        merged.eliminate_zeros()
+        return merged
+
+
+def set_cells(matrix, rows, columns, values):
+    """Return matrix with the given cells overwritten; (row, column) pairs must be unique"""
+    return DeltaMatrix.wrap(matrix).set_cells(rows, columns, values)
+
+
+def add_cells(matrix, rows, columns, values):
+    """Return matrix with values added to the given cells; repeated cells add up"""
+    return DeltaMatrix.wrap(matrix).set_cells(rows, columns, values, add=True)
+
+
+def append_positions(positions, new_ids, start):
+    """Return a copy of an id -> row map with new_ids mapped to start, start + 1, ...
+
+    New ids go to a small overlay map in front of the shared base map, which
+    is only copied (and merged) once the overlay holds MERGE_FRACTION of it.
+    """
+    if isinstance(positions, ChainMap):
+        overlay, base = dict(positions.maps[0]), positions.maps[1]
+    else:
+        overlay, base = {}, positions
+    overlay.update({item_id: start + i for i, item_id in enumerate(new_ids)})
+    if len(overlay) > max(1000, MERGE_FRACTION * len(base)):
+        merged = dict(base)
+        merged.update(overlay)
+        return merged
+    return ChainMap(overlay, base)
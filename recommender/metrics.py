@@ -0,0 +1,260 @@
+"""
+Process-local metrics for the recommendation engine, exported in the
+Prometheus text format by /api/metrics/.
+
+Engine hot paths wrap their stages (candidate generation, content lookups,
+ranking, record materialization) in ``stage(name)``. Each stage feeds a
+latency histogram and, while a request is being served, that request's
+timings, which RequestMetricsMiddleware sends as a ``Server-Timing`` header.
+Model builds record the duration of every step as a gauge.
+
+Like the result cache counters, values live in the process that recorded
+them: with several gunicorn workers, each scrape reports the worker that
+answered it, labelled with its pid.
+
+This module only uses the standard library, so the engine can record metrics
+outside Django (builds, benchmarks) and importing it stays cheap.
+"""
+import bisect
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Exported metrics: name (without the recommender_ prefix) -> (type, help)
+METRICS = {
+    'requests_total': ('counter', 'API requests by endpoint and status code'),
+    'request_seconds': ('histogram', 'API request latency by endpoint'),
+    'stage_seconds': ('histogram', 'Latency of engine hot-path stages'),
+    'fallbacks_total': ('counter', 'Recommendation lists answered with the cold-start fallback'),
+    'cold_start_total': ('counter', 'Cold-start lists by the demographic segment level that answered them'),
+    'errors_total': ('counter', 'Engine calls that failed and returned a fallback'),
+    'build_step_seconds': ('gauge', 'Duration of each step of the last model build or snapshot load'),
+}
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+# (name, labels) -> [per-bucket counts (last is +Inf), sum, count]
+_histograms = {}
+
+# Stage durations of the request being served, keyed by stage name
+_request_timings = contextvars.ContextVar('recommender_request_timings', default=None)
+_request_profiler = contextvars.ContextVar('recommender_request_profiler', default=None)
+
+
+def _key(name, labels):
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def increment(name, amount=1, **labels):
+    """Add amount to a counter"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+
+def observe(name, seconds, **labels):
+    """Record one duration in a histogram"""
+    key = _key(name, labels)
+    bucket = bisect.bisect_left(BUCKETS, seconds)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        histogram[0][bucket] += 1
+        histogram[1] += seconds
+        histogram[2] += 1
+
+
+@contextmanager
+def stage(name):
+    """Time an engine stage into stage_seconds and the current request's timings"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe('stage_seconds', elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+@contextmanager
+def build_step(name):
+    """Time one model build (or snapshot load) step into the build_step_seconds gauge"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        set_gauge('build_step_seconds', time.perf_counter() - start, step=name)
+
+
+@contextmanager
+def request_timings():
+    """Collect stage timings for the request served in this context; yields the timings dict"""
+    timings = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def server_timing(timings, total):
+    """Server-Timing header value: one entry per stage plus the total, in milliseconds"""
+    entries = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in timings.items()]
+    entries.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(entries)
+
+
+class SamplingProfiler:
+    """Samples the stacks of the threads serving one request at a fixed interval.
+
+    Threads join through ``traced``/``profiled_thread``; the result is in the
+    collapsed-stack format read by flamegraph.pl and speedscope. The sampler
+    needs the GIL, which a busy thread only gives up every switch interval
+    (5 ms by default), so requests of a few milliseconds get few samples.
+    """
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.threads = set()
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='recommender-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident in list(self.threads):
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.stacks[self._collapse(frame)] += 1
+            self.samples += 1
+
+    @staticmethod
+    def _collapse(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def collapsed(self):
+        """One 'frame;frame;... count' line per distinct stack, most sampled first"""
+        header = f'# {self.samples} samples every {self.interval * 1000:g} ms\n'
+        return header + ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+@contextmanager
+def profile_request(interval=0.001, include_current=True):
+    """Sample the threads serving the request in this context; yields the profiler.
+
+    With include_current=False only threads that join through ``traced`` are
+    sampled: an async request's event-loop thread mostly idles in the loop,
+    or runs other requests, while its work runs in the offload pool.
+    """
+    profiler = SamplingProfiler(interval)
+    token = _request_profiler.set(profiler)
+    profiler.start()
+    try:
+        with profiled_thread() if include_current else nullcontext():
+            yield profiler
+    finally:
+        profiler.stop()
+        _request_profiler.reset(token)
+
+
+@contextmanager
+def profiled_thread():
+    """Include the current thread in the current request's profile, if it is being profiled"""
+    profiler = _request_profiler.get()
+    if profiler is None:
+        yield
+        return
+    ident = threading.get_ident()
+    profiler.threads.add(ident)
+    try:
+        yield
+    finally:
+        profiler.threads.discard(ident)
+
+
+def traced(func, *args):
+    """Call func(*args) on behalf of the current request, e.g. from a pool thread"""
+    with profiled_thread():
+        return func(*args)
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = (
+        (label, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for label, value in pairs
+    )
+    return '{' + ','.join(f'{label}="{value}"' for label, value in escaped) + '}'
+
+
+def render(collected=()):
+    """Every metric in the Prometheus text exposition format.
+
+    ``collected`` adds (name, type, help, labels dict, value) samples read at
+    scrape time, such as the result cache counters.
+    """
+    pid = (('pid', os.getpid()),)
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {key: (list(buckets), total, count) for key, (buckets, total, count) in _histograms.items()}
+
+    families = {}
+    for (name, labels), value in list(counters.items()) + list(gauges.items()):
+        families.setdefault(name, []).append(f'recommender_{name}{_labels(labels + pid)} {value}')
+    for (name, labels), (buckets, total, count) in histograms.items():
+        lines = families.setdefault(name, [])
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS + ('+Inf',), buckets):
+            cumulative += bucket_count
+            lines.append(f'recommender_{name}_bucket{_labels(labels + pid, le=bound)} {cumulative}')
+        lines.append(f'recommender_{name}_sum{_labels(labels + pid)} {total}')
+        lines.append(f'recommender_{name}_count{_labels(labels + pid)} {count}')
+
+    types = dict(METRICS)
+    for name, kind, help_text, labels, value in collected:
+        types[name] = (kind, help_text)
+        families.setdefault(name, []).append(f'recommender_{name}{_labels(tuple(labels.items()) + pid)} {value}')
+
+    output = []
+    for name, lines in families.items():
+        kind, help_text = types.get(name, ('untyped', name))
+        output.append(f'# HELP recommender_{name} {help_text}')
+        output.append(f'# TYPE recommender_{name} {kind}')
+        output.extend(lines)
+    return '\n'.join(output) + '\n'
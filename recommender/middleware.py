@@ -0,0 +1,108 @@
+"""
+Middleware that can run natively under ASGI.
+
+Django adapts a sync-only middleware by running it, and everything inside it,
+through a single shared thread, which would serialize every async view behind
+it. WhiteNoise's middleware is sync-only, so this subclass adds an async path:
+the static file lookup is a dict access and only actual file responses are
+built in a thread. The request metrics middleware is sync and async capable
+for the same reason.
+"""
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import metrics
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoiseMiddleware that is both sync and async capable"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
+
+
+class RequestMetricsMiddleware:
+    """Request counts and latency per endpoint plus a Server-Timing header.
+
+    The header lists the engine stages timed while the view ran (see
+    metrics.py); a streamed response's header only covers the work done
+    before streaming starts. With RECOMMENDER_PROFILING on, ?profile=1
+    answers with the request's sampling profile instead of its response.
+    Async requests only sample the work they run in the offload pool.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.profiling = getattr(settings, 'RECOMMENDER_PROFILING', False)
+        self.profile_interval = getattr(settings, 'RECOMMENDER_PROFILE_INTERVAL_MS', 1) / 1000
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def _profiled(self, request):
+        return self.profiling and request.GET.get('profile') == '1'
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        with metrics.request_timings() as timings:
+            if not self._profiled(request):
+                response = self.get_response(request)
+                return self._finish(request, response, timings, start)
+            with metrics.profile_request(self.profile_interval) as profiler:
+                response = self.get_response(request)
+        return self._profile_response(self._finish(request, response, timings, start), profiler)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        with metrics.request_timings() as timings:
+            if not self._profiled(request):
+                response = await self.get_response(request)
+                return self._finish(request, response, timings, start)
+            with metrics.profile_request(self.profile_interval, include_current=False) as profiler:
+                response = await self.get_response(request)
+        return self._profile_response(self._finish(request, response, timings, start), profiler)
+
+    @staticmethod
+    def _finish(request, response, timings, start):
+        total = time.perf_counter() - start
+        match = request.resolver_match
+        endpoint = match.url_name if match is not None and match.url_name else 'unmatched'
+        metrics.increment('requests_total', endpoint=endpoint, status=response.status_code)
+        metrics.observe('request_seconds', total, endpoint=endpoint)
+        response['Server-Timing'] = metrics.server_timing(timings, total)
+        return response
+
+    @staticmethod
+    def _profile_response(response, profiler):
+        """The collapsed-stack profile, keeping the original status and timings as headers"""
+        profile = HttpResponse(profiler.collapsed(), content_type='text/plain; charset=utf-8')
+        profile['Server-Timing'] = response['Server-Timing']
+        profile['X-Profiled-Status'] = str(response.status_code)
+        return profile
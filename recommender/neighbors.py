@@ -0,0 +1,361 @@
+import copy
+import numpy as np
+import scipy.sparse as sp
+from joblib import Parallel, delayed, effective_n_jobs
+from sklearn.preprocessing import normalize
+from threadpoolctl import threadpool_limits
+from typing import NamedTuple
+from .matrices import DeltaMatrix
+
+# Bytes held per entry of a dense score block while its top-k is selected:
+# the float32 scores, their negated copy and argpartition's int64 output
+BLOCK_BYTES_PER_ENTRY = 16
+# Default memory budget for the score blocks of one neighbour table build
+DEFAULT_MEMORY_BUDGET = 512 * 2 ** 20
+
+
+class NeighborTable(NamedTuple):
+    """Top-k neighbours per row: parallel (indices, scores) arrays sorted by score"""
+    indices: np.ndarray
+    scores: np.ndarray
+
+
+def _dense_block(block):
+    """Return a dense ndarray view of a similarity block"""
+    if sp.issparse(block):
+        return block.toarray()
+    return np.asarray(block)
+
+
+def topk_from_block(block, k, exclude=None):
+    """Select the k highest-scoring columns per row of a dense block.
+
+    ``exclude`` is an optional array of column positions (one per row) that
+    must never be returned, e.g. the query row itself.
+    """
+    n_rows, n_cols = block.shape
+    k = min(k, n_cols - (1 if exclude is not None else 0))
+    if k <= 0:
+        return (np.empty((n_rows, 0), dtype=np.int32),
+                np.empty((n_rows, 0), dtype=np.float32))
+
+    if exclude is not None:
+        block[np.arange(n_rows), exclude] = -np.inf
+
+    if k < n_cols:
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        # argpartition picks arbitrarily among scores tied with the k-th
+        # largest; re-select those rows so ties go to the lowest column,
+        # as a stable descending sort would
+        threshold = np.take_along_axis(block, top, axis=1).min(axis=1, keepdims=True)
+        tied_rows = np.flatnonzero((block >= threshold).sum(axis=1) > k)
+        if len(tied_rows):
+            tied = block[tied_rows]
+            above = tied > threshold[tied_rows]
+            at = tied == threshold[tied_rows]
+            needed = k - above.sum(axis=1, keepdims=True)
+            selected = above | (at & (np.cumsum(at, axis=1) <= needed))
+            top[tied_rows] = np.nonzero(selected)[1].reshape(len(tied_rows), k)
+    else:
+        top = np.tile(np.arange(n_cols), (n_rows, 1))
+    top_scores = np.take_along_axis(block, top, axis=1)
+    # Small sort of the k survivors only; ties keep the lower column first
+    order = np.lexsort((top, -top_scores), axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+    return top.astype(np.int32), top_scores.astype(np.float32)
+
+
+def chunk_size_for_budget(n_cols, memory_budget, n_jobs=1):
+    """Rows per chunk so that n_jobs score blocks of n_cols columns fit in memory_budget bytes"""
+    return max(1, int(memory_budget // (BLOCK_BYTES_PER_ENTRY * max(1, n_cols) * max(1, n_jobs))))
+
+
+def _topk_chunk(matrix, matrix_t, start, stop, k, exclude_self):
+    """Top-k table rows for matrix[start:stop]; one task of topk_cosine_neighbors"""
+    block = _dense_block(matrix[start:stop] @ matrix_t).astype(np.float32, copy=False)
+    exclude = np.arange(start, stop) if exclude_self else None
+    return start, topk_from_block(block, k, exclude=exclude)
+
+
+def _topk_chunk_single_thread(*args):
+    """_topk_chunk in a pool worker: one BLAS thread per process avoids oversubscription"""
+    with threadpool_limits(1):
+        return _topk_chunk(*args)
+
+
+def topk_cosine_neighbors(matrix, k, chunk_size=None, exclude_self=True, n_jobs=1,
+                          memory_budget=DEFAULT_MEMORY_BUDGET):
+    """Build a top-k cosine neighbour table in row chunks.
+
+    ``matrix`` rows must already be L2-normalised (TF-IDF output is), so the
+    dot product is the cosine similarity. Only a ``chunk_size x n_rows``
+    block per job is materialised at a time; by default the chunk size is
+    derived from ``memory_budget`` (bytes, shared by all jobs). With
+    ``n_jobs`` other than 1 the chunks are scored in a joblib process pool
+    (-1 uses every core); large arrays reach the workers memory-mapped.
+    """
+    n_rows = matrix.shape[0]
+    k = max(0, min(k, n_rows - (1 if exclude_self else 0)))
+    indices = np.zeros((n_rows, k), dtype=np.int32)
+    scores = np.zeros((n_rows, k), dtype=np.float32)
+    if k == 0:
+        return NeighborTable(indices, scores)
+
+    n_jobs = effective_n_jobs(n_jobs)
+    if chunk_size is None:
+        chunk_size = chunk_size_for_budget(n_rows, memory_budget, n_jobs)
+    if sp.issparse(matrix) and matrix.shape[1] > chunk_size:
+        matrix_t = matrix.T.tocsr()
+    else:
+        # A dense transpose costs no more memory than one block; use BLAS
+        matrix_t = np.asarray(matrix.T.todense() if sp.issparse(matrix) else matrix.T, dtype=np.float32)
+
+    bounds = [(start, min(start + chunk_size, n_rows)) for start in range(0, n_rows, chunk_size)]
+    if n_jobs == 1 or len(bounds) == 1:
+        results = (_topk_chunk(matrix, matrix_t, start, stop, k, exclude_self) for start, stop in bounds)
+    else:
+        results = Parallel(n_jobs=n_jobs, return_as='generator_unordered')(
+            delayed(_topk_chunk_single_thread)(matrix, matrix_t, start, stop, k, exclude_self)
+            for start, stop in bounds
+        )
+    for start, (block_idx, block_scores) in results:
+        indices[start:start + len(block_idx)] = block_idx
+        scores[start:start + len(block_idx)] = block_scores
+    return NeighborTable(indices, scores)
+
+
+def _pad_table(results, k):
+    """Stack per-query (indices, scores) into a NeighborTable padded with -1 / -inf"""
+    indices = np.full((len(results), k), -1, dtype=np.int32)
+    scores = np.full((len(results), k), -np.inf, dtype=np.float32)
+    for row, (idx, sc) in enumerate(results):
+        indices[row, :len(idx)] = idx
+        scores[row, :len(sc)] = sc
+    return NeighborTable(indices, scores)
+
+
+def _update_rows(matrix, source, rows):
+    """DeltaMatrix of normalised rows with ``rows`` refreshed from source, which may have grown"""
+    return DeltaMatrix.wrap(matrix).set_rows(rows, normalize(sp.csr_matrix(source[rows], dtype=np.float32)))
+
+
+class ExactNeighborIndex:
+    """Brute-force cosine neighbours; the recall baseline for approximate indexes.
+
+    After ingest updates, ``matrix`` is a DeltaMatrix: queries score the base
+    rows through ``matrix_t`` (the base's transpose, rebuilt only when the
+    overlay is merged) and the overlaid rows directly.
+    """
+
+    kind = 'exact'
+
+    def __init__(self, matrix):
+        self.matrix = normalize(sp.csr_matrix(matrix, dtype=np.float32))
+        self.matrix_t = self.matrix.T.tocsr()
+
+    def state(self):
+        """(params, arrays) needed to rebuild the index without refitting"""
+        if isinstance(self.matrix, DeltaMatrix):
+            matrix = self.matrix.tocsr()
+            return {}, {'matrix': matrix, 'matrix_t': matrix.T.tocsr()}
+        return {}, {'matrix': self.matrix, 'matrix_t': self.matrix_t}
+
+    @classmethod
+    def from_state(cls, params, arrays):
+        """Rebuild an index from ``state()`` output, e.g. memory-mapped arrays"""
+        index = cls.__new__(cls)
+        index.matrix = arrays['matrix']
+        index.matrix_t = arrays['matrix_t']
+        return index
+
+    def update(self, matrix, rows):
+        """Return a copy of the index with ``rows`` refreshed from matrix, which may have grown"""
+        index = copy.copy(self)
+        index.matrix = _update_rows(self.matrix, matrix, rows)
+        if index.matrix.base is not DeltaMatrix.wrap(self.matrix).base:
+            # The overlay was merged into a new base
+            index.matrix_t = index.matrix.base.T.tocsr()
+        return index
+
+    def query(self, rows, k, exclude=None, block_size=2 ** 24):
+        """Top-k neighbours for each query row; ``exclude`` holds one row id per query.
+
+        Queries are scored in chunks so a dense score block never holds more
+        than ``block_size`` entries.
+        """
+        rows = normalize(sp.csr_matrix(rows, dtype=np.float32))
+        n_rows = self.matrix.shape[0]
+        overlay = self.matrix if isinstance(self.matrix, DeltaMatrix) and len(self.matrix.rows) else None
+        chunk_size = max(1, block_size // max(1, n_rows))
+        results = []
+        for start in range(0, rows.shape[0], chunk_size):
+            stop = start + chunk_size
+            block = _dense_block(rows[start:stop] @ self.matrix_t)
+            if overlay is not None:
+                # Overlaid rows replace (or extend) the base's columns
+                if block.shape[1] < n_rows:
+                    block = np.hstack([block, np.zeros((block.shape[0], n_rows - block.shape[1]), dtype=block.dtype)])
+                block[:, overlay.rows] = _dense_block(rows[start:stop] @ overlay.delta.T)
+            chunk_exclude = None if exclude is None else np.asarray(exclude)[start:stop]
+            indices, scores = topk_from_block(block, k, exclude=chunk_exclude)
+            results.extend(zip(indices, scores))
+        return _pad_table(results, k)
+
+
+class ClusteredNeighborIndex:
+    """Approximate cosine neighbours from an inverted-file (IVF) index.
+
+    Rows are random-projected to ``dim`` dense dimensions and grouped into
+    ``n_lists`` clusters with spherical k-means. A query scans only the
+    ``n_probe`` closest clusters and re-ranks those candidates with the exact
+    sparse cosine, so ``n_probe`` trades recall for latency (probing every
+    list is exact).
+    """
+
+    kind = 'ivf'
+
+    def __init__(self, matrix, n_lists=None, n_probe=8, dim=64, n_iter=10, seed=0):
+        self.matrix = normalize(sp.csr_matrix(matrix, dtype=np.float32))
+        n_rows = self.matrix.shape[0]
+        self.n_lists = max(1, min(n_lists or int(np.sqrt(n_rows)), n_rows))
+        self.n_probe = n_probe
+        rng = np.random.default_rng(seed)
+        self.projection = (rng.standard_normal((self.matrix.shape[1], dim)) / np.sqrt(dim)).astype(np.float32)
+
+        projected = self._project(self.matrix)
+        self.centroids = self._train_centroids(projected, n_iter, rng)
+        assignments = self._assign(projected)
+        self.list_members = np.argsort(assignments, kind='stable').astype(np.int32)
+        self.list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=self.n_lists))))
+
+        # Rows re-assigned by ingest updates since the lists were built (sorted)
+        # and their lists; they are skipped in list_members
+        self.moved_rows = np.empty(0, dtype=np.int64)
+        self.moved_lists = np.empty(0, dtype=np.int64)
+
+    def _lists(self):
+        """(list_members, list_offsets) with the moved rows folded in"""
+        if not len(self.moved_rows):
+            return self.list_members, self.list_offsets
+        assignments = np.full(self.matrix.shape[0], self.n_lists, dtype=np.int64)
+        assignments[self.list_members] = np.repeat(np.arange(self.n_lists), np.diff(self.list_offsets))
+        assignments[self.moved_rows] = self.moved_lists
+        members = np.argsort(assignments, kind='stable')[:np.count_nonzero(assignments < self.n_lists)]
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=self.n_lists + 1)[:-1])))
+        return members.astype(np.int32), offsets
+
+    def state(self):
+        """(params, arrays) needed to rebuild the index without refitting"""
+        params = {'n_lists': self.n_lists, 'n_probe': self.n_probe}
+        list_members, list_offsets = self._lists()
+        arrays = {
+            'matrix': self.matrix.tocsr() if isinstance(self.matrix, DeltaMatrix) else self.matrix,
+            'projection': self.projection,
+            'centroids': self.centroids,
+            'list_members': list_members,
+            'list_offsets': list_offsets,
+        }
+        return params, arrays
+
+    @classmethod
+    def from_state(cls, params, arrays):
+        """Rebuild an index from ``state()`` output, e.g. memory-mapped arrays"""
+        index = cls.__new__(cls)
+        index.n_lists = params['n_lists']
+        index.n_probe = params['n_probe']
+        index.moved_rows = np.empty(0, dtype=np.int64)
+        index.moved_lists = np.empty(0, dtype=np.int64)
+        for name, value in arrays.items():
+            setattr(index, name, value)
+        return index
+
+    def update(self, matrix, rows):
+        """Return a copy of the index with ``rows`` refreshed and re-assigned to clusters.
+
+        Re-assignments are kept aside in moved_rows and folded into the
+        lists when the matrix overlay is merged. Centroids are kept as
+        trained; a periodic full rebuild re-fits them.
+        """
+        index = copy.copy(self)
+        rows = np.asarray(rows, dtype=np.int64)
+        index.matrix = _update_rows(self.matrix, matrix, rows)
+        kept = ~np.isin(self.moved_rows, rows)
+        moved_rows = np.concatenate([self.moved_rows[kept], rows])
+        moved_lists = np.concatenate([self.moved_lists[kept], index._assign(index._project(index.matrix[rows]))])
+        order = np.argsort(moved_rows, kind='stable')
+        index.moved_rows, index.moved_lists = moved_rows[order], moved_lists[order]
+        if not len(index.matrix.rows):
+            # The matrix overlay was merged; fold the moves into the lists too
+            index.list_members, index.list_offsets = index._lists()
+            index.moved_rows = index.moved_rows[:0]
+            index.moved_lists = index.moved_lists[:0]
+        return index
+
+    def _project(self, rows):
+        """Random-project sparse rows to dense, L2-normalised float32 vectors"""
+        return normalize(np.asarray(rows @ self.projection, dtype=np.float32))
+
+    def _assign(self, projected, chunk_size=65536):
+        """Nearest centroid (by cosine) for each projected row"""
+        assignments = np.empty(len(projected), dtype=np.int64)
+        for start in range(0, len(projected), chunk_size):
+            block = projected[start:start + chunk_size]
+            assignments[start:start + chunk_size] = np.argmax(block @ self.centroids.T, axis=1)
+        return assignments
+
+    def _train_centroids(self, projected, n_iter, rng, sample_per_list=64):
+        """Spherical k-means on a sample of the projected rows"""
+        n_sample = min(len(projected), self.n_lists * sample_per_list)
+        sample = projected[rng.choice(len(projected), n_sample, replace=False)]
+        self.centroids = sample[rng.choice(n_sample, self.n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            assignments = self._assign(sample)
+            members = sp.csr_matrix(
+                (np.ones(n_sample, dtype=np.float32), (assignments, np.arange(n_sample))),
+                shape=(self.n_lists, n_sample)
+            )
+            sums = np.asarray(members @ sample)
+            empty = np.flatnonzero(np.bincount(assignments, minlength=self.n_lists) == 0)
+            sums[empty] = sample[rng.choice(n_sample, len(empty))]
+            self.centroids = normalize(sums)
+        return self.centroids
+
+    def query(self, rows, k, exclude=None, n_probe=None):
+        """Top-k approximate neighbours for each query row"""
+        rows = normalize(sp.csr_matrix(rows, dtype=np.float32))
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        centroid_scores = self._project(rows) @ self.centroids.T
+        probes = np.argpartition(-centroid_scores, n_probe - 1, axis=1)[:, :n_probe]
+
+        results = []
+        for row, lists in enumerate(probes):
+            candidates = np.sort(np.concatenate([
+                self.list_members[self.list_offsets[l]:self.list_offsets[l + 1]] for l in lists
+            ]))
+            if len(self.moved_rows):
+                candidates = np.union1d(
+                    candidates[~np.isin(candidates, self.moved_rows)], self.moved_rows[np.isin(self.moved_lists, lists)]
+                )
+            if exclude is not None:
+                candidates = candidates[candidates != exclude[row]]
+            query_vector = rows[row].toarray().ravel()
+            block = np.asarray(self.matrix[candidates] @ query_vector, dtype=np.float32)[None, :]
+            top, scores = topk_from_block(block, k)
+            results.append((candidates[top[0]], scores[0]))
+        return _pad_table(results, k)
+
+
+NEIGHBOR_INDEXES = {
+    ExactNeighborIndex.kind: ExactNeighborIndex,
+    ClusteredNeighborIndex.kind: ClusteredNeighborIndex,
+}
+
+
+def build_neighbor_index(kind, matrix, **options):
+    """Build a neighbour index of the given kind ('exact' or 'ivf') over matrix rows"""
+    try:
+        index_class = NEIGHBOR_INDEXES[kind]
+    except KeyError:
+        raise ValueError(f"Unknown neighbour index '{kind}', expected one of {sorted(NEIGHBOR_INDEXES)}")
+    return index_class(matrix, **options)
@@ -0,0 +1,82 @@
+"""
+Bounded thread pool for running engine calls from async views.
+
+Scoring is CPU-bound NumPy/SciPy work, which would block the event loop, so
+async views hand it to a small thread pool (NumPy releases the GIL in its
+inner loops). The pool applies backpressure: once ``max_pending`` calls are
+running or queued, new calls are rejected immediately with Overloaded rather
+than queueing without bound, and callers wait at most ``timeout`` seconds.
+Calls run in a copy of the caller's context, so engine stage timings and the
+request profiler (see metrics.py) follow them into the pool.
+"""
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import traced
+
+
+class Overloaded(Exception):
+    """Raised when the pool already has max_pending calls in flight"""
+
+
+class OffloadPool:
+    """Thread pool with a bound on in-flight calls and a per-call timeout"""
+
+    def __init__(self, max_workers=4, max_pending=64, timeout=10.0):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _release(self, future):
+        with self._lock:
+            self.pending -= 1
+
+    def saturated(self):
+        """Whether a new call would be rejected right now"""
+        return self.pending >= self.max_pending
+
+    async def run(self, func, *args):
+        """Run func(*args) in the pool and await its result.
+
+        Raises Overloaded when the pool is full and asyncio.TimeoutError when
+        the call takes longer than the timeout. A timed-out call that already
+        started keeps its slot until it finishes, so slow calls cannot pile
+        up behind the bound.
+        """
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise Overloaded(f'{self.pending} engine calls already in flight')
+            self.pending += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='recommender-offload')
+        try:
+            future = self._executor.submit(contextvars.copy_context().run, traced, func, *args)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Process-wide pool configured from Django settings"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from django.conf import settings
+                _pool = OffloadPool(
+                    max_workers=getattr(settings, 'RECOMMENDER_OFFLOAD_THREADS', 4),
+                    max_pending=getattr(settings, 'RECOMMENDER_OFFLOAD_MAX_PENDING', 64),
+                    timeout=getattr(settings, 'RECOMMENDER_OFFLOAD_TIMEOUT', 10.0),
+                )
+    return _pool
@@ -0,0 +1,323 @@
+"""
+Precomputed popularity rankings of the catalog.
+
+The popular-products fallback used to sort the whole catalog on every call.
+The rankings are now computed once per build and once per ingest batch, and
+a fallback only slices a precomputed array. The rankings are:
+
+- global: catalog rating, then purchased quantity, then number of ratings,
+  with ties in catalog row order (the engine's fallback order)
+- per category: the global order, grouped by category
+- per location: the products bought by users of a location (users.csv),
+  by quantity, continued with the global order
+- trending: purchased quantity with exponential time decay. Transactions
+  carry no timestamp, so recency is transaction_id order and the half-life
+  is counted in transactions.
+
+Ingest batches update the counters incrementally and only move the products
+whose counters changed: each is taken out of the rankings and re-inserted by
+binary search, so a batch costs a few passes over the order arrays instead of
+a full sort. Like the engine snapshot that holds it, the object is
+copy-on-write.
+"""
+import copy
+
+import numpy as np
+import scipy.sparse as sp
+
+# Transactions after which a purchase counts half as much in the trending ranking
+DEFAULT_HALF_LIFE = 100000
+
+
+def extend_ranking(ranked, order, n):
+    """The first n rows of ranked, continued with the rows of order not already in it"""
+    ranked = ranked[:n]
+    if len(ranked) == n:
+        return ranked
+    rest = order[:n + len(ranked)]
+    return np.concatenate((ranked, rest[~np.isin(rest, ranked)][:n - len(ranked)]))
+
+
+def _lex_less(keys, a, b):
+    """Whether rows a sort before rows b under keys (primary first), elementwise"""
+    less = np.zeros(len(a), dtype=bool)
+    equal = np.ones(len(a), dtype=bool)
+    for key in keys:
+        less |= equal & (key[a] < key[b])
+        equal &= key[a] == key[b]
+    return less
+
+
+def reinsert(order, moved, keys):
+    """order with the rows in moved re-placed under keys (primary first, then row).
+
+    The other rows keep their relative order and the moved rows are placed
+    by a vectorised binary search. If the other rows are no longer sorted
+    (e.g. rescaled scores rounded into a tie) the whole order is re-sorted.
+    """
+    moved = np.unique(np.asarray(moved, dtype=np.int64))
+    keys = list(keys) + [np.arange(len(keys[0]))]
+    is_moved = np.zeros(len(keys[0]), dtype=bool)
+    is_moved[moved] = True
+    kept = order[~is_moved[order]]
+    if _lex_less(keys, kept[1:], kept[:-1]).any():
+        return np.lexsort(list(reversed(keys))).astype(order.dtype)
+    if not len(moved):
+        return order
+    moved = moved[np.lexsort([key[moved] for key in reversed(keys)])]
+    low = np.zeros(len(moved), dtype=np.int64)
+    high = np.full(len(moved), len(kept), dtype=np.int64)
+    while (low < high).any():
+        middle = (low + high) // 2
+        active = low < high
+        before = _lex_less(keys, kept[np.minimum(middle, len(kept) - 1)], moved) & active
+        low = np.where(before, middle + 1, low)
+        high = np.where(active & ~before, middle, high)
+    return np.insert(kept, low, moved).astype(order.dtype)
+
+
+class PopularityRankings:
+    """Popularity counters per catalog row and the rankings derived from them"""
+
+    kind = 'popularity'
+
+    def __init__(self, half_life=DEFAULT_HALF_LIFE, latest_transaction=0, category_names=(), location_names=()):
+        self.half_life = half_life
+        # Largest transaction_id seen; trending scores are decayed relative to it
+        self.latest_transaction = latest_transaction
+        self.category_names = list(category_names)
+        self.location_names = list(location_names)
+        self.category_index = {name: code for code, name in enumerate(self.category_names)}
+        self.location_index = {name: code for code, name in enumerate(self.location_names)}
+        # Per catalog row: rating (-inf when missing), category code (-1 when
+        # missing) and the counters
+        self.rating = None
+        self.category_codes = None
+        self.rating_counts = None
+        self.purchase_counts = None
+        self.decayed_purchases = None
+        # Location code of every known user (sorted ids), to attribute purchases
+        self.location_user_ids = None
+        self.location_user_codes = None
+        # Purchased quantity per (location, catalog row)
+        self.location_counts = None
+        # Rankings: catalog rows in popularity order, and each row's place in it
+        self.order = None
+        self.rank = None
+        self.category_order = None
+        self.category_offsets = None
+        self.trending_order = None
+        self.location_indptr = None
+        self.location_indices = None
+
+    def fit(self, rating, category_codes, rating_counts, purchase_counts, purchases=None, user_locations=None):
+        """Count and rank.
+
+        ``purchases`` holds the in-catalog transactions as arrays ('column',
+        'quantity', 'transaction_id', 'user_id'); without it the trending
+        ranking falls back to the global one. ``user_locations`` is (user_ids,
+        location codes), with codes into self.location_names.
+        """
+        n_products = len(rating)
+        rating = np.asarray(rating, dtype=np.float64)
+        self.rating = np.where(np.isnan(rating), -np.inf, rating)
+        self.category_codes = np.asarray(category_codes, dtype=np.int32)
+        self.rating_counts = np.asarray(rating_counts, dtype=np.int64)
+        self.purchase_counts = np.asarray(purchase_counts, dtype=np.int64)
+        self.decayed_purchases = np.zeros(n_products)
+        self.location_counts = sp.csr_matrix((len(self.location_names), n_products), dtype=np.int64)
+        if user_locations is not None:
+            user_ids, codes = (np.asarray(values) for values in user_locations)
+            order = np.argsort(user_ids, kind='stable')
+            self.location_user_ids = user_ids[order]
+            self.location_user_codes = codes[order].astype(np.int32)
+        else:
+            self.location_user_ids = np.empty(0, dtype=np.int64)
+            self.location_user_codes = np.empty(0, dtype=np.int32)
+        if purchases is not None and len(purchases['column']):
+            self._count_purchases(
+                purchases['column'], purchases['quantity'], purchases['transaction_id'], purchases['user_id']
+            )
+        self._rank()
+        return self
+
+    def _user_location_codes(self, user_ids):
+        """Location code per user id, -1 for users without a known location"""
+        user_ids = np.asarray(user_ids)
+        if not len(self.location_user_ids):
+            return np.full(len(user_ids), -1, dtype=np.int32)
+        found = np.minimum(np.searchsorted(self.location_user_ids, user_ids), len(self.location_user_ids) - 1)
+        return np.where(self.location_user_ids[found] == user_ids, self.location_user_codes[found], -1)
+
+    def _count_purchases(self, columns, quantities, transaction_ids, user_ids):
+        """Add purchases to the decayed and per-location counters (not to purchase_counts)"""
+        columns = np.asarray(columns, dtype=np.int64)
+        quantities = np.asarray(quantities, dtype=np.float64)
+        transaction_ids = np.asarray(transaction_ids, dtype=np.int64)
+        latest = max(self.latest_transaction, int(transaction_ids.max()))
+        # Rescale the old scores to the new latest transaction, then add the new ones
+        decayed = self.decayed_purchases * 0.5 ** ((latest - self.latest_transaction) / self.half_life)
+        weights = quantities * 0.5 ** ((latest - transaction_ids) / self.half_life)
+        self.decayed_purchases = decayed + np.bincount(columns, weights=weights, minlength=len(decayed))
+        self.latest_transaction = latest
+
+        locations = self._user_location_codes(user_ids)
+        located = locations >= 0
+        if located.any():
+            self.location_counts = self.location_counts + sp.csr_matrix(
+                (quantities[located].astype(np.int64), (locations[located], columns[located])),
+                shape=self.location_counts.shape
+            )
+
+    def _rank(self):
+        """Recompute every ranking from the counters"""
+        n_products = len(self.rating)
+        self.order = np.lexsort((-self.rating_counts, -self.purchase_counts, -self.rating)).astype(np.int32)
+        rank = np.empty(n_products, dtype=np.int64)
+        rank[self.order] = np.arange(n_products)
+        self.rank = rank
+
+        # Missing categories (code -1) form group 0
+        groups = self.category_codes[self.order] + 1
+        self.category_order = self.order[np.argsort(groups, kind='stable')]
+        sizes = np.bincount(groups, minlength=len(self.category_names) + 1)
+        self.category_offsets = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+
+        self.trending_order = np.lexsort((rank, -self.decayed_purchases)).astype(np.int32)
+
+        counts = self.location_counts.tocoo()
+        by_location = np.lexsort((rank[counts.col], -counts.data, counts.row))
+        self.location_indices = counts.col[by_location].astype(np.int32)
+        self.location_indptr = np.concatenate((
+            [0], np.cumsum(np.bincount(counts.row, minlength=len(self.location_names)))
+        )).astype(np.int64)
+
+    def _rerank(self, changed, locations=()):
+        """Update the rankings after the counters of the catalog rows in changed grew.
+
+        ``locations`` are the location codes whose purchase counts changed.
+        """
+        changed = np.unique(np.asarray(changed, dtype=np.int64))
+        self.order = reinsert(self.order, changed, [-self.rating, -self.purchase_counts, -self.rating_counts])
+        rank = np.empty(len(self.order), dtype=np.int64)
+        rank[self.order] = np.arange(len(self.order))
+        self.rank = rank
+
+        # Re-sort only the categories of the moved products
+        self.category_order = self.category_order.copy()
+        for group in np.unique(self.category_codes[changed] + 1).tolist():
+            start, stop = self.category_offsets[group], self.category_offsets[group + 1]
+            members = self.category_order[start:stop]
+            self.category_order[start:stop] = members[np.argsort(rank[members], kind='stable')]
+
+        self.trending_order = reinsert(self.trending_order, changed, [-self.decayed_purchases, rank])
+
+        # Location lists that gained purchases or hold a moved product (ties follow rank)
+        holds = np.isin(self.location_indices, changed)
+        affected = set(np.searchsorted(self.location_indptr, np.flatnonzero(holds), side='right') - 1)
+        affected.update(int(code) for code in locations)
+        if affected:
+            counts = self.location_counts.tocsr()
+            lists = []
+            for code in range(len(self.location_names)):
+                if code in affected:
+                    row = slice(counts.indptr[code], counts.indptr[code + 1])
+                    columns, quantities = counts.indices[row], counts.data[row]
+                    lists.append(columns[np.lexsort((rank[columns], -quantities))].astype(np.int32))
+                else:
+                    lists.append(self.location_indices[self.location_indptr[code]:self.location_indptr[code + 1]])
+            self.location_indices = np.concatenate(lists) if lists else self.location_indices[:0]
+            self.location_indptr = np.concatenate(([0], np.cumsum([len(l) for l in lists]))).astype(np.int64)
+
+    def add_ratings(self, columns):
+        """Copy with one more rating counted for each catalog row in columns"""
+        columns = np.asarray(columns, dtype=np.int64)
+        updated = copy.copy(self)
+        updated.rating_counts = self.rating_counts + np.bincount(columns, minlength=len(self.rating_counts))
+        updated._rerank(columns)
+        return updated
+
+    def add_purchases(self, columns, quantities, transaction_ids=None, user_ids=None):
+        """Copy with a batch of in-catalog purchases counted.
+
+        Purchases without transaction ids are taken to be the newest, in
+        order; purchases without user ids are not attributed to a location.
+        """
+        columns = np.asarray(columns, dtype=np.int64)
+        quantities = np.asarray(quantities, dtype=np.int64)
+        if transaction_ids is None:
+            transaction_ids = self.latest_transaction + 1 + np.arange(len(columns))
+        if user_ids is None:
+            user_ids = np.full(len(columns), -1)
+        updated = copy.copy(self)
+        updated.purchase_counts = self.purchase_counts + np.bincount(
+            columns, weights=quantities, minlength=len(self.purchase_counts)
+        ).astype(np.int64)
+        updated._count_purchases(columns, quantities, transaction_ids, user_ids)
+        locations = updated._user_location_codes(user_ids)
+        updated._rerank(columns, np.unique(locations[locations >= 0]))
+        return updated
+
+    def top(self, n, category=None, location=None, trending=False):
+        """Catalog rows of the n most popular products, overall or for one variant.
+
+        An unknown category yields nothing; an unknown location yields the
+        global ranking.
+        """
+        if sum((category is not None, location is not None, bool(trending))) > 1:
+            raise ValueError('Choose at most one of category, location and trending')
+        n = max(0, n)
+        if trending:
+            return self.trending_order[:n]
+        if category is not None:
+            code = self.category_index.get(category)
+            if code is None:
+                return self.order[:0]
+            start, stop = self.category_offsets[code + 1], self.category_offsets[code + 2]
+            return self.category_order[start:min(stop, start + n)]
+        if location is not None and location in self.location_index:
+            code = self.location_index[location]
+            bought = self.location_indices[self.location_indptr[code]:self.location_indptr[code + 1]]
+            return extend_ranking(bought, self.order, n)
+        return self.order[:n]
+
+    def top_within(self, rows, mask, n):
+        """Catalog rows of the n most popular products a filter allows (its sorted rows and bitmap)"""
+        n = max(0, n)
+        if len(rows) * 8 <= len(self.order):
+            # Selective filter: rank just the allowed rows
+            return rows[np.argsort(self.rank[rows], kind='stable')[:n]]
+        # Broad filter: an eighth or more of the catalog passes, so a short prefix of the order suffices
+        scanned = 8 * n
+        while True:
+            prefix = self.order[:scanned]
+            allowed = prefix[mask[prefix]]
+            if len(allowed) >= n or scanned >= len(self.order):
+                return allowed[:n]
+            scanned *= 2
+
+    def state(self):
+        """(params, arrays) needed to serve the rankings without recounting"""
+        params = {
+            'half_life': self.half_life, 'latest_transaction': self.latest_transaction,
+            'category_names': self.category_names, 'location_names': self.location_names,
+        }
+        arrays = {
+            name: getattr(self, name)
+            for name in ('rating', 'category_codes', 'rating_counts', 'purchase_counts', 'decayed_purchases',
+                         'location_user_ids', 'location_user_codes', 'location_counts', 'order', 'rank',
+                         'category_order', 'category_offsets', 'trending_order', 'location_indptr',
+                         'location_indices')
+        }
+        return params, arrays
+
+    @classmethod
+    def from_state(cls, params, arrays):
+        """Rebuild the rankings from ``state()`` output, e.g. memory-mapped arrays"""
+        rankings = cls(**params)
+        for name, value in arrays.items():
+            setattr(rankings, name, value)
+        if rankings.rank is None:
+            rankings.rank = np.empty(len(rankings.order), dtype=np.int64)
+            rankings.rank[rankings.order] = np.arange(len(rankings.order))
+        return rankings
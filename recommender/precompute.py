@@ -0,0 +1,77 @@
+"""
+Offline bulk scoring of hybrid recommendations for every known user.
+
+The users of a snapshot are split into chunks and scored with the batched
+hybrid recommender in a pool of worker processes. Every worker opens the same
+snapshot, whose arrays are memory-mapped, so the model is paged in once and
+shared instead of being copied per process. The result is a compact
+(users x n) int32 table of product row positions, -1 padded, aligned with the
+snapshot's user_ids.
+"""
+import multiprocessing
+import os
+
+import numpy as np
+
+from .artifacts import derive_snapshot, new_version, read_snapshot
+
+PRECOMPUTED_ARRAY = 'precomputed_recommendations'
+
+_worker_engine = None
+
+
+def _init_worker(path, alpha):
+    """Pool initializer: load the snapshot once per worker process"""
+    global _worker_engine
+    from threadpoolctl import threadpool_limits
+    from .engine import RecommendationEngine
+
+    # Processes already provide the parallelism; avoid oversubscribing BLAS threads
+    threadpool_limits(1)
+    _worker_engine = RecommendationEngine(artifact_dir=path, hybrid_alpha=alpha)
+
+
+def _score_chunk(task):
+    """Score users[start:stop] and return (start, table block)"""
+    start, stop, n_recommendations = task
+    engine = _worker_engine
+    user_ids = engine.user_ids[start:stop].tolist()
+    ranked = engine.rank_hybrid_recommendations(user_ids, n_recommendations)
+
+    block = np.full((len(user_ids), n_recommendations), -1, dtype=np.int32)
+    for i, user_id in enumerate(user_ids):
+        block[i, :len(ranked[user_id])] = ranked[user_id]
+    return start, block
+
+
+def precompute_hybrid(path, n_recommendations=20, workers=None, chunk_size=1000, alpha=0.6):
+    """Score every user of the snapshot at path and return the recommendation table"""
+    _, arrays, _ = read_snapshot(path)
+    user_ids = arrays.get('user_ids')
+    n_users = len(user_ids) if user_ids is not None else 0
+    table = np.full((n_users, n_recommendations), -1, dtype=np.int32)
+    tasks = [
+        (start, min(start + chunk_size, n_users), n_recommendations)
+        for start in range(0, n_users, chunk_size)
+    ]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        _init_worker(path, alpha)
+        for start, block in map(_score_chunk, tasks):
+            table[start:start + len(block)] = block
+        return table
+
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(path, alpha)) as pool:
+        for start, block in pool.imap_unordered(_score_chunk, tasks):
+            table[start:start + len(block)] = block
+    return table
+
+
+def publish_precomputed(root, base_version, table, alpha=0.6, keep=None):
+    """Publish a new snapshot version of base_version that carries the table"""
+    meta = {'precomputed': {
+        'n_recommendations': int(table.shape[1]), 'alpha': alpha, 'base_version': base_version
+    }}
+    return derive_snapshot(root, base_version, new_version(), {PRECOMPUTED_ARRAY: table}, meta, keep=keep)
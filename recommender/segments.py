@@ -0,0 +1,175 @@
+"""
+Cold-start recommendations from user demographics.
+
+Users a strategy cannot score (no ratings yet, or nothing to recommend) used
+to get the global popular list. The segment index precomputes the top
+products of every (age bucket, gender, location) segment of users.csv from
+its members' purchases and ratings, and of the coarser (age bucket, gender)
+and (age bucket) segments. A user is served from the most specific of their
+segments with at least ``min_users`` active members, then from the global
+popularity ranking: a few dict lookups and an array slice.
+"""
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from .popularity import extend_ranking
+
+# Lower bounds of the age buckets after the first (under 18); missing ages get bucket -1
+AGE_EDGES = (18, 25, 35, 45, 55, 65)
+# Segment levels, most specific first: which of (age bucket, gender, location) each keeps
+LEVELS = ((True, True, True), (True, True, False), (True, False, False))
+LEVEL_NAMES = ('age_gender_location', 'age_gender', 'age')
+# Code of a demographic column a segment level does not use
+ANY = -2
+
+
+def user_demographics(users):
+    """(user_ids, codes, gender names, location names) of a users DataFrame.
+
+    codes has one (age bucket, gender, location) row per user, -1 where missing.
+    """
+    age = pd.to_numeric(users['age'], errors='coerce').to_numpy(dtype=np.float64)
+    buckets = np.searchsorted(np.array(AGE_EDGES, dtype=np.float64), age, side='right')
+    buckets = np.where(np.isnan(age), -1, buckets)
+    genders, gender_names = pd.factorize(users['gender'].astype(object))
+    locations, location_names = pd.factorize(users['location'].astype(object))
+    codes = np.column_stack((buckets, genders, locations)).astype(np.int32)
+    return (
+        users['user_id'].to_numpy(), codes,
+        [str(name) for name in gender_names], [str(name) for name in location_names]
+    )
+
+
+class SegmentIndex:
+    """Top products per demographic segment, and the segment codes of every known user"""
+
+    kind = 'segments'
+
+    def __init__(self, top_k=100, min_users=20, gender_names=(), location_names=()):
+        self.top_k = top_k
+        self.min_users = min_users
+        self.gender_names = list(gender_names)
+        self.location_names = list(location_names)
+        # Sorted user ids and their (age bucket, gender, location) codes
+        self.user_ids = None
+        self.user_codes = None
+        # Per segment: its codes (ANY where its level does not use a column)
+        # and its ranked catalog rows, as indices[indptr[s]:indptr[s + 1]]
+        self.segment_codes = None
+        self.indptr = None
+        self.indices = None
+        self.segments = {}
+
+    def fit(self, user_ids, user_codes, interactions, interaction_user_ids, rank):
+        """Rank each segment's products by how many of its members bought or rated them.
+
+        ``interactions`` is users x products with rows for interaction_user_ids;
+        ``rank`` is every product's position in the global popularity order,
+        which breaks ties.
+        """
+        order = np.argsort(user_ids, kind='stable')
+        self.user_ids = np.asarray(user_ids)[order]
+        self.user_codes = np.asarray(user_codes, dtype=np.int32)[order]
+
+        rows = self._user_rows(interaction_user_ids)
+        active = rows >= 0
+        members = sp.csr_matrix(interactions[np.flatnonzero(active)], dtype=np.float32)
+        members.data[:] = 1
+        member_codes = self.user_codes[rows[active]]
+
+        segment_codes, indptr, indices = [], [0], []
+        for level in LEVELS:
+            codes = np.where(np.array(level), member_codes, ANY)
+            keys, inverse, sizes = np.unique(codes, axis=0, return_inverse=True, return_counts=True)
+            inverse = inverse.ravel()
+            kept = np.flatnonzero(sizes >= self.min_users)
+            if not len(kept):
+                continue
+            segment_of = np.full(len(keys), -1)
+            segment_of[kept] = np.arange(len(kept))
+            in_kept = segment_of[inverse] >= 0
+            indicator = sp.csr_matrix(
+                (np.ones(in_kept.sum(), dtype=np.float32), (segment_of[inverse][in_kept], np.flatnonzero(in_kept))),
+                shape=(len(kept), len(member_codes))
+            )
+            counts = (indicator @ members).tocoo()
+            ranked = np.lexsort((rank[counts.col], -counts.data, counts.row))
+            segment, columns = counts.row[ranked], counts.col[ranked]
+            starts = np.searchsorted(segment, np.arange(len(kept)))
+            top = np.arange(len(segment)) - starts[segment] < self.top_k
+            lengths = np.bincount(segment[top], minlength=len(kept))
+
+            segment_codes.append(keys[kept])
+            indices.append(columns[top])
+            indptr.extend((indptr[-1] + np.cumsum(lengths)).tolist())
+
+        self.segment_codes = (
+            np.concatenate(segment_codes).astype(np.int32) if segment_codes else np.empty((0, 3), dtype=np.int32)
+        )
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.concatenate(indices).astype(np.int32) if indices else np.empty(0, dtype=np.int32)
+        self._index()
+        return self
+
+    def _index(self):
+        self.segments = {tuple(codes): row for row, codes in enumerate(self.segment_codes.tolist())}
+
+    def _user_rows(self, user_ids):
+        """Row of each user id in self.user_ids, -1 for users without demographics"""
+        user_ids = np.asarray(user_ids)
+        if not len(self.user_ids):
+            return np.full(len(user_ids), -1)
+        found = np.minimum(np.searchsorted(self.user_ids, user_ids), len(self.user_ids) - 1)
+        return np.where(self.user_ids[found] == user_ids, found, -1)
+
+    def lookup(self, user_ids):
+        """(segment row, level) of the most specific qualifying segment per user; (-1, None) if none"""
+        rows = self._user_rows(user_ids)
+        matches = []
+        for row in rows.tolist():
+            match = (-1, None)
+            if row >= 0:
+                codes = self.user_codes[row].tolist()
+                for level, name in zip(LEVELS, LEVEL_NAMES):
+                    segment = self.segments.get(tuple(c if keep else ANY for c, keep in zip(codes, level)))
+                    if segment is not None:
+                        match = (segment, name)
+                        break
+            matches.append(match)
+        return matches
+
+    def top(self, segment, n, order, mask=None):
+        """Catalog rows of a segment's n top products, continued with the global order.
+
+        With a filter bitmap, only allowed products are kept; ``order`` must
+        then be the filtered global order.
+        """
+        ranked = self.indices[self.indptr[segment]:self.indptr[segment + 1]]
+        if mask is not None:
+            ranked = ranked[mask[ranked]]
+        return extend_ranking(ranked, order, n)
+
+    def state(self):
+        """(params, arrays) needed to serve the index without refitting"""
+        params = {
+            'top_k': self.top_k, 'min_users': self.min_users,
+            'gender_names': self.gender_names, 'location_names': self.location_names,
+        }
+        arrays = {
+            'user_ids': self.user_ids,
+            'user_codes': self.user_codes,
+            'segment_codes': self.segment_codes,
+            'indptr': self.indptr,
+            'indices': self.indices,
+        }
+        return params, arrays
+
+    @classmethod
+    def from_state(cls, params, arrays):
+        """Rebuild the index from ``state()`` output, e.g. memory-mapped arrays"""
+        index = cls(**params)
+        for name, value in arrays.items():
+            setattr(index, name, value)
+        index._index()
+        return index
@@ -0,0 +1,227 @@
+"""
+Columnar product catalog used to materialize API records.
+
+Numeric columns are plain NumPy arrays. Low-cardinality strings (category,
+brand and the precomputed image URL) are stored as integer codes into a small
+table of interned values, and free text is one UTF-8 buffer plus offsets.
+Every array can be memory-mapped from a snapshot, so worker processes share
+the catalog pages instead of each holding a DataFrame of Python objects, and
+records are built straight from row indices without any DataFrame.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from .images import get_product_image
+
+# Column names as exposed by the API
+RENAMED_COLUMNS = {'product_id': 'id', 'product_name': 'name'}
+# Always interned; other string columns are when few of their values are distinct
+CATEGORICAL_COLUMNS = ('category', 'brand', 'image')
+CATEGORICAL_RATIO = 0.5
+# Resolved filters kept per snapshot (least recently used are dropped)
+SELECTION_CACHE_SIZE = 256
+
+# Rows a filter allows: a bitmap over catalog rows and the same rows, sorted
+Selection = namedtuple('Selection', ['mask', 'rows'])
+
+
+def _encode_strings(values):
+    """One UTF-8 buffer plus int64 offsets for a sequence of strings"""
+    encoded = [value.encode() for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _decode_strings(data, offsets, rows):
+    """Decode the strings at ``rows`` from a buffer written by _encode_strings"""
+    starts = offsets[rows].tolist()
+    ends = offsets[rows + 1].tolist()
+    return [data[start:end].tobytes().decode() for start, end in zip(starts, ends)]
+
+
+class ProductStore:
+    """Product columns in catalog row order, encoded as arrays"""
+
+    def __init__(self, columns, arrays, n_rows):
+        # [(name, encoding)] in output order; arrays are keyed '<name>.<part>'
+        self.columns = columns
+        # Plain ndarray views of memory-mapped arrays: slicing np.memmap is far slower
+        self.arrays = {name: np.asarray(value) for name, value in arrays.items()}
+        self.n_rows = n_rows
+        # Interned values per categorical column; code -1 (missing) hits the trailing NaN
+        self.categories = {
+            name: _decode_strings(
+                self.arrays[f'{name}.data'], self.arrays[f'{name}.offsets'],
+                np.arange(len(self.arrays[f'{name}.offsets']) - 1)
+            ) + [float('nan')]
+            for name, encoding in columns if encoding == 'categorical'
+        }
+
+    @classmethod
+    def from_frame(cls, frame):
+        """Encode a products DataFrame and add its image URL column"""
+        columns = []
+        arrays = {}
+        series = [(name, frame[name]) for name in frame.columns]
+        series.append(('image', pd.Series(
+            [get_product_image(product_name=name) for name in frame['product_name']], index=frame.index
+        )))
+        for name, values in series:
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype(object)
+            if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+                columns.append((name, 'numeric'))
+                arrays[f'{name}.values'] = values.to_numpy()
+                continue
+
+            missing = values.isna().to_numpy()
+            strings = values.where(~missing, '').astype(str)
+            if name in CATEGORICAL_COLUMNS or strings.nunique() <= CATEGORICAL_RATIO * len(strings):
+                codes, uniques = pd.factorize(values.where(~missing).astype(object))
+                columns.append((name, 'categorical'))
+                arrays[f'{name}.codes'] = codes.astype(np.int16 if len(uniques) < 2 ** 15 else np.int32)
+                arrays[f'{name}.data'], arrays[f'{name}.offsets'] = _encode_strings(uniques.astype(str))
+            else:
+                columns.append((name, 'text'))
+                arrays[f'{name}.data'], arrays[f'{name}.offsets'] = _encode_strings(strings)
+                if missing.any():
+                    arrays[f'{name}.missing'] = missing
+        return cls(columns, arrays, len(frame))
+
+    def state(self):
+        """(params, arrays) needed to rebuild the store, like the neighbour indexes"""
+        return {'columns': [list(column) for column in self.columns], 'n_rows': self.n_rows}, dict(self.arrays)
+
+    @classmethod
+    def from_state(cls, params, arrays):
+        """Rebuild a store from ``state()`` output, e.g. memory-mapped arrays"""
+        return cls([tuple(column) for column in params['columns']], arrays, params['n_rows'])
+
+    def _values(self, name, encoding, rows):
+        """Python values of one column at the given rows"""
+        if encoding == 'numeric':
+            return self.arrays[f'{name}.values'][rows].tolist()
+        if encoding == 'categorical':
+            categories = self.categories[name]
+            return [categories[code] for code in self.arrays[f'{name}.codes'][rows].tolist()]
+        values = _decode_strings(self.arrays[f'{name}.data'], self.arrays[f'{name}.offsets'], rows)
+        missing = self.arrays.get(f'{name}.missing')
+        if missing is not None:
+            for i in np.flatnonzero(missing[rows]).tolist():
+                values[i] = float('nan')
+        return values
+
+    def column(self, name):
+        """Whole column: an ndarray for numeric columns, otherwise a list"""
+        encoding = dict(self.columns)[name]
+        if encoding == 'numeric':
+            return self.arrays[f'{name}.values']
+        return self._values(name, encoding, np.arange(self.n_rows))
+
+    def records(self, rows):
+        """API records (renamed ids, image URL included) for row positions, in order"""
+        rows = np.asarray(rows, dtype=np.int64)
+        keys = [RENAMED_COLUMNS.get(name, name) for name, _ in self.columns]
+        values = [self._values(name, encoding, rows) for name, encoding in self.columns]
+        return [dict(zip(keys, row)) for row in zip(*values)]
+
+
+class FilterIndex:
+    """Inverted indexes over a store's category, brand, price and stock columns.
+
+    Category and brand values map to posting lists of catalog rows, prices
+    are kept sorted for range lookups and stock is a bitmap. Each distinct
+    filters.ProductFilter is resolved once into a Selection. The indexes are
+    built on first use, like the rendered catalog, so processes that never
+    filter do not pay for them. A filter on a column the catalog lacks
+    matches nothing.
+    """
+
+    def __init__(self, product_store):
+        self.product_store = product_store
+        # name -> (value -> code, offsets, rows): rows[offsets[code + 1]:offsets[code + 2]]
+        # hold the value's rows; missing values (code -1) come first
+        self.postings = None
+        self.price_order = None
+        self.sorted_prices = None
+        self.in_stock = None
+        self._selections = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _build(self):
+        """Build the indexes; called lazily under the lock"""
+        store = self.product_store
+        encodings = dict(store.columns)
+        postings = {}
+        for name in ('category', 'brand'):
+            if encodings.get(name) == 'categorical':
+                codes = store.arrays[f'{name}.codes'].astype(np.int64) + 1
+                rows = np.argsort(codes, kind='stable').astype(np.int32)
+                sizes = np.bincount(codes, minlength=len(store.categories[name]))
+                index = {value: code for code, value in enumerate(store.categories[name][:-1])}
+                postings[name] = (index, np.concatenate(([0], np.cumsum(sizes))), rows)
+        if encodings.get('price') == 'numeric':
+            prices = store.arrays['price.values'].astype(np.float64)
+            # NaN prices sort last, past any range
+            self.price_order = np.argsort(prices, kind='stable').astype(np.int32)
+            self.sorted_prices = prices[self.price_order]
+        if encodings.get('stock') == 'numeric':
+            self.in_stock = store.arrays['stock.values'] > 0
+        self.postings = postings
+
+    def prepare(self):
+        """Build the indexes now rather than on the first filtered request"""
+        if self.postings is None:
+            with self._lock:
+                if self.postings is None:
+                    self._build()
+
+    def _mask(self, product_filter):
+        n_rows = self.product_store.n_rows
+        mask = np.ones(n_rows, dtype=bool)
+        for name, values in (('category', product_filter.categories), ('brand', product_filter.brands)):
+            if values is not None:
+                allowed = np.zeros(n_rows, dtype=bool)
+                if name in self.postings:
+                    index, offsets, rows = self.postings[name]
+                    for value in values:
+                        code = index.get(value)
+                        if code is not None:
+                            allowed[rows[offsets[code + 1]:offsets[code + 2]]] = True
+                mask &= allowed
+        if product_filter.min_price is not None or product_filter.max_price is not None:
+            allowed = np.zeros(n_rows, dtype=bool)
+            if self.price_order is not None:
+                low = -np.inf if product_filter.min_price is None else product_filter.min_price
+                high = np.inf if product_filter.max_price is None else product_filter.max_price
+                start = np.searchsorted(self.sorted_prices, low, side='left')
+                stop = np.searchsorted(self.sorted_prices, high, side='right')
+                allowed[self.price_order[start:stop]] = True
+            mask &= allowed
+        if product_filter.in_stock:
+            if self.in_stock is None:
+                mask[:] = False
+            else:
+                mask &= self.in_stock
+        return mask
+
+    def select(self, product_filter):
+        """Selection of the catalog rows a filter allows"""
+        self.prepare()
+        with self._lock:
+            selection = self._selections.get(product_filter)
+            if selection is not None:
+                self._selections.move_to_end(product_filter)
+                return selection
+
+        mask = self._mask(product_filter)
+        selection = Selection(mask, np.flatnonzero(mask).astype(np.int32))
+        with self._lock:
+            self._selections[product_filter] = selection
+            while len(self._selections) > SELECTION_CACHE_SIZE:
+                self._selections.popitem(last=False)
+        return selection
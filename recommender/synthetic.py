@@ -0,0 +1,150 @@
+"""
+Synthetic catalog data for benchmarking the recommendation engine at scale
+"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+CATEGORIES = ['Electronics', 'Fashion', 'Home', 'Kitchen', 'Furniture', 'Sports', 'Books', 'Beauty']
+BRANDS = ['Boat', 'JBL', 'Noise', 'Mi', 'Nike', 'Puma', 'Levis', 'Canon', 'Philips', 'Prestige',
+          'Bajaj', 'Godrej', 'Nilkamal', 'Sleepwell', 'Wipro', 'Samsung', 'Sony', 'Adidas']
+ADJECTIVES = ['Wireless', 'Smart', 'Portable', 'Classic', 'Premium', 'Compact', 'Cotton', 'Steel',
+              'Ergonomic', 'Digital', 'Casual', 'Running', 'Foldable', 'Electric', 'Mini', 'Pro']
+NOUNS = ['Earbuds', 'Speaker', 'Watch', 'Band', 'Backpack', 'Shoes', 'T-Shirt', 'Jeans', 'Camera',
+         'Cable', 'Hard Disk', 'Toaster', 'Grinder', 'Stove', 'Cooker', 'Chair', 'Table', 'Mattress',
+         'Lamp', 'Kettle', 'Bottle', 'Jacket', 'Charger', 'Keyboard', 'Mouse', 'Pillow']
+GENDERS = ['Male', 'Female']
+LOCATIONS = ['Bangalore', 'Chennai', 'Coimbatore', 'Delhi', 'Hyderabad', 'Jaipur', 'Kochi', 'Kolkata',
+             'Mumbai', 'Pune']
+# Rows written per to_csv call by write_dataset
+WRITE_CHUNK_ROWS = 1000000
+
+
+def make_products(n_products, seed=0):
+    """Generate a products table with the same columns as data/products.csv"""
+    rng = np.random.default_rng(seed)
+    adjectives = np.array(ADJECTIVES)[rng.integers(len(ADJECTIVES), size=n_products)]
+    nouns = np.array(NOUNS)[rng.integers(len(NOUNS), size=n_products)]
+    models = rng.integers(1, 1000, size=n_products).astype(str)
+    names = np.char.add(np.char.add(np.char.add(adjectives, ' '), nouns), np.char.add(' ', models))
+    return pd.DataFrame({
+        'product_id': np.arange(1, n_products + 1),
+        'product_name': names,
+        'category': np.array(CATEGORIES)[rng.integers(len(CATEGORIES), size=n_products)],
+        'price': rng.integers(99, 50000, size=n_products),
+        'brand': np.array(BRANDS)[rng.integers(len(BRANDS), size=n_products)],
+        'rating': np.round(rng.uniform(3.0, 5.0, size=n_products), 1),
+        'stock': rng.integers(0, 500, size=n_products),
+    })
+
+
+def make_users(n_users, seed=0):
+    """Generate a users table with the same columns as data/users.csv"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'user_id': np.arange(1, n_users + 1),
+        'age': rng.integers(18, 70, size=n_users),
+        'gender': np.array(GENDERS)[rng.integers(len(GENDERS), size=n_users)],
+        'location': np.array(LOCATIONS)[rng.integers(len(LOCATIONS), size=n_users)],
+    })
+
+
+def _taste_groups(rng, n_users, n_items, n_tastes):
+    """Each user's taste group and the items of every group, in popularity order"""
+    tastes = rng.integers(n_tastes, size=n_users)
+    per_group = max(1, n_items // n_tastes)
+    group_items = rng.permutation(np.resize(np.arange(n_items), n_tastes * per_group)).reshape(n_tastes, per_group)
+    return tastes, group_items
+
+
+def _taste_items(rng, tastes, group_items, n_items, per_user, zipf_a):
+    """(user rows, item columns) of per_user interactions per user, Zipfian within each taste group"""
+    rows = np.repeat(np.arange(len(tastes)), per_user)
+    ranks = np.minimum(rng.zipf(zipf_a, size=len(rows)) - 1, group_items.shape[1] - 1)
+    columns = group_items[np.repeat(tastes, per_user), ranks]
+    # A fifth of each user's interactions land anywhere in the catalog
+    noise = rng.random(len(rows)) < 0.2
+    columns[noise] = rng.integers(n_items, size=noise.sum())
+    return rows, columns
+
+
+def make_rating_matrix(n_users, n_items, ratings_per_user=20, n_tastes=200, zipf_a=1.2, seed=0):
+    """Generate a sparse users x items rating matrix with clustered tastes.
+
+    Each user belongs to one of ``n_tastes`` taste groups and mostly rates
+    that group's items; item popularity within a group is Zipfian. Without
+    this structure nearest-neighbour search on random data is meaningless.
+    """
+    rng = np.random.default_rng(seed)
+    tastes, group_items = _taste_groups(rng, n_users, n_items, n_tastes)
+    rows, columns = _taste_items(rng, tastes, group_items, n_items, ratings_per_user, zipf_a)
+    ratings = rng.integers(1, 6, size=len(rows)).astype(np.float32)
+
+    matrix = sp.csr_matrix((ratings, (rows, columns)), shape=(n_users, n_items))
+    matrix.data = np.minimum(matrix.data, 5)
+    return matrix
+
+
+def make_transactions(n_users, n_items, transactions_per_user=5, n_tastes=200, zipf_a=1.2, seed=0):
+    """Generate a transactions table with the same columns as data/transactions.csv.
+
+    Users keep the taste groups of ``make_rating_matrix`` with the same seed,
+    so they mostly buy from the groups they rate. Repeat purchases are kept.
+    """
+    tastes, group_items = _taste_groups(np.random.default_rng(seed), n_users, n_items, n_tastes)
+    rng = np.random.default_rng([seed, 1])
+    rows, columns = _taste_items(rng, tastes, group_items, n_items, transactions_per_user, zipf_a)
+    order = rng.permutation(len(rows))
+    return pd.DataFrame({
+        'transaction_id': np.arange(1, len(rows) + 1),
+        'user_id': rows[order] + 1,
+        'product_id': columns[order] + 1,
+        'quantity': np.minimum(rng.geometric(0.7, size=len(rows)), 10),
+    })
+
+
+def _rating_frame(matrix):
+    """ratings.csv rows of a users x items rating matrix"""
+    matrix = matrix.tocoo()
+    return pd.DataFrame({
+        'user_id': matrix.row + 1,
+        'product_id': matrix.col + 1,
+        'rating': matrix.data.astype(np.int8),
+    })
+
+
+def _write_csv(frame, path, chunk_rows=WRITE_CHUNK_ROWS):
+    """Write a DataFrame to CSV chunk by chunk, returning its row count"""
+    for start in range(0, len(frame), chunk_rows):
+        frame.iloc[start:start + chunk_rows].to_csv(path, mode='a' if start else 'w', header=not start, index=False)
+    if not len(frame):
+        frame.to_csv(path, index=False)
+    return len(frame)
+
+
+def write_dataset(directory, n_products, n_users, ratings_per_user=20, transactions_per_user=5,
+                  n_tastes=200, zipf_a=1.2, seed=0):
+    """Write products, users, ratings and transactions CSV files for an engine build.
+
+    Ids start at 1 like data/. Returns {name: (rows, seconds)} per file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    generators = {
+        'products': lambda: make_products(n_products, seed=seed),
+        'users': lambda: make_users(n_users, seed=seed),
+        'ratings': lambda: _rating_frame(make_rating_matrix(
+            n_users, n_products, ratings_per_user, n_tastes=n_tastes, zipf_a=zipf_a, seed=seed
+        )),
+        'transactions': lambda: make_transactions(
+            n_users, n_products, transactions_per_user, n_tastes=n_tastes, zipf_a=zipf_a, seed=seed
+        ),
+    }
+    written = {}
+    for name, generate in generators.items():
+        start = time.perf_counter()
+        rows = _write_csv(generate(), os.path.join(directory, f'{name}.csv'))
+        written[name] = (rows, time.perf_counter() - start)
+    return written
@@ -1,3 +1,477 @@
-from django.test import TestCase
+"""
+Tests of the recommendation engine, its API views and the benchmark command.
 
-# Create your tests here.
+Engines are built from the data/ fixtures or from a small synthetic dataset
+(see synthetic.py) and checked against dense brute-force computations.
+"""
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
+
+import numpy as np
+import scipy.sparse as sp
+from django.core.management import CommandError, call_command
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from sklearn.preprocessing import normalize
+
+from . import async_views, loader, matrices, views
+from .artifacts import MANIFEST, latest_version
+from .cache import invalidate
+from .engine import RecommendationEngine
+from .filters import ProductFilter
+from .neighbors import ClusteredNeighborIndex, ExactNeighborIndex, topk_cosine_neighbors
+from .offload import OffloadPool
+from .precompute import precompute_hybrid, publish_precomputed
+from .synthetic import write_dataset
+
+SYNTHETIC_OPTIONS = {'similarity_top_k': 30, 'n_factors': 8, 'item_neighbors': 20, 'segment_min_users': 5}
+
+
+def _ids(records):
+    return [record['id'] for record in records]
+
+
+def _dense_cosine(matrix):
+    """Dense cosine similarity between the rows of a matrix"""
+    unit = normalize(np.asarray(matrix.todense() if sp.issparse(matrix) else matrix, dtype=np.float64))
+    return unit @ unit.T
+
+
+def _random_matrix(n_rows, n_cols, density=0.1, seed=0):
+    matrix = sp.random(n_rows, n_cols, density=density, format='csr', random_state=seed, dtype=np.float32)
+    matrix.data = np.ceil(matrix.data * 5)
+    return matrix
+
+
+class SyntheticEngineTestCase(TestCase):
+    """Builds one engine per test class from a small synthetic dataset"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.data_dir = tempfile.mkdtemp()
+        write_dataset(cls.data_dir, 300, 400, ratings_per_user=8, transactions_per_user=3, n_tastes=20, seed=1)
+        cls.engine = RecommendationEngine(data_dir=cls.data_dir, **SYNTHETIC_OPTIONS)
+        cls.user_ids = cls.engine.user_ids[::9].tolist() + [10 ** 9]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.data_dir, ignore_errors=True)
+        super().tearDownClass()
+
+
+class NeighborTests(SyntheticEngineTestCase):
+    def assertTopK(self, table, similarity, k):
+        """table holds the k best scores of each row of similarity, at the right indices"""
+        expected = -np.sort(-similarity, axis=1)[:, :k]
+        np.testing.assert_allclose(table.scores, expected, atol=1e-5)
+        found = np.take_along_axis(similarity, np.maximum(table.indices, 0), axis=1)
+        np.testing.assert_allclose(found[table.indices >= 0], table.scores[table.indices >= 0], atol=1e-5)
+
+    def test_topk_matches_dense(self):
+        matrix = normalize(_random_matrix(120, 40))
+        similarity = _dense_cosine(matrix)
+        np.fill_diagonal(similarity, -np.inf)
+        self.assertTopK(topk_cosine_neighbors(matrix, 7, chunk_size=13), similarity, 7)
+
+    def test_content_neighbors_match_dense(self):
+        similarity = _dense_cosine(self.engine.tfidf_matrix)
+        np.fill_diagonal(similarity, -np.inf)
+        self.assertTopK(self.engine.product_neighbors, similarity, 30)
+
+    def test_indexes_match_dense(self):
+        matrix = _random_matrix(150, 40, seed=1)
+        queries = np.arange(0, matrix.shape[0], 7)
+        similarity = _dense_cosine(matrix)[queries]
+        similarity[np.arange(len(queries)), queries] = -np.inf
+        # Probing every list makes the clustered index exact
+        for index in (ExactNeighborIndex(matrix), ClusteredNeighborIndex(matrix, n_lists=4, n_probe=4)):
+            self.assertTopK(index.query(matrix[queries], 5, exclude=queries), similarity, 5)
+
+    def test_indexes_match_dense_after_updates(self):
+        matrix = _random_matrix(150, 40, seed=1)
+        exact, clustered = ExactNeighborIndex(matrix), ClusteredNeighborIndex(matrix, n_lists=4, n_probe=4)
+        rng = np.random.default_rng(0)
+        # A low merge threshold exercises both the overlay and merged bases
+        with mock.patch.object(matrices, 'MERGE_MIN_NNZ', 200):
+            for _ in range(10):
+                rows = rng.integers(0, matrix.shape[0] + 2, 15)
+                keys = np.unique(rows * 40 + rng.integers(0, 40, 15))
+                rows, columns = np.divmod(keys, 40)
+                matrix = matrices.set_cells(matrix, rows, columns, rng.integers(1, 6, len(rows)))
+                exact = exact.update(matrix, np.unique(rows))
+                clustered = clustered.update(matrix, np.unique(rows))
+
+                similarity = _dense_cosine(matrix.tocsr())
+                queries = np.arange(0, matrix.shape[0], 7)
+                similarity = similarity[queries]
+                similarity[np.arange(len(queries)), queries] = -np.inf
+                for index in (exact, clustered):
+                    self.assertTopK(index.query(matrix[queries], 5, exclude=queries), similarity, 5)
+
+
+class FilterTests(SyntheticEngineTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        store = cls.engine.product_store
+        categories = sorted(set(store.categories['category'][:-1]))
+        brands = sorted(set(store.categories['brand'][:-1]))
+        cls.filters = [
+            ProductFilter(in_stock=True),
+            ProductFilter(categories=(categories[0],)),
+            ProductFilter(categories=tuple(categories[:2]), max_price=20000.0),
+            ProductFilter(brands=(brands[1],), min_price=1000.0, in_stock=True),
+        ]
+        cls.records = store.records(np.arange(len(cls.engine.product_ids)))
+
+    def _mask(self, product_filter):
+        return np.array([product_filter.matches(record) for record in self.records])
+
+    def test_index_matches_records(self):
+        for product_filter in self.filters + [ProductFilter(categories=('Unknown',))]:
+            selection = self.engine.filter_index.select(product_filter)
+            np.testing.assert_array_equal(selection.mask, self._mask(product_filter))
+
+    def test_content_matches_masked_brute_force(self):
+        engine = self.engine
+        similarity = _dense_cosine(engine.tfidf_matrix)
+        np.fill_diagonal(similarity, -np.inf)
+        product_ids = engine.product_ids[::15].tolist()
+        for product_filter in self.filters:
+            mask = self._mask(product_filter)
+            results = engine.get_content_based_recommendations_batch(product_ids, 10, filters=product_filter)
+            for product_id in product_ids:
+                row = engine.product_positions[product_id]
+                scores = np.where(mask, similarity[row], -np.inf)
+                expected = -np.sort(-scores[np.isfinite(scores)])[:10]
+                got = similarity[row, [engine.product_positions[i] for i in _ids(results[product_id])]]
+                np.testing.assert_allclose(got, expected, atol=1e-5)
+
+    def test_user_strategies_match_post_filtered_ranking(self):
+        engine = self.engine
+        n_products = len(engine.product_ids)
+        for method in ('get_collaborative_recommendations_batch', 'get_factor_recommendations_batch',
+                       'get_item_based_recommendations_batch'):
+            full = getattr(engine, method)(self.user_ids, n_products)
+            for product_filter in self.filters:
+                filtered = getattr(engine, method)(self.user_ids, 5, filters=product_filter)
+                for user_id in self.user_ids:
+                    self.assertTrue(all(product_filter.matches(record) for record in filtered[user_id]))
+                    expected = [record['id'] for record in full[user_id] if product_filter.matches(record)][:5]
+                    if len(expected) == 5:
+                        self.assertEqual(_ids(filtered[user_id]), expected, (method, product_filter, user_id))
+
+    def test_popular_matches_masked_order(self):
+        popularity = self.engine.popularity
+        for product_filter in self.filters:
+            mask = self._mask(product_filter)
+            expected = [row for row in popularity.order.tolist() if mask[row]][:10]
+            self.assertEqual(popularity.top_within(np.flatnonzero(mask), mask, 10).tolist(), expected)
+
+
+class IngestTests(SyntheticEngineTestCase):
+    def _snapshot(self, engine):
+        return {
+            'hybrid': engine.get_hybrid_recommendations_batch(self.user_ids, 10),
+            'item': engine.get_item_based_recommendations_batch(self.user_ids, 10),
+            'popular': engine.get_popular_recommendations(10),
+            'ratings': engine.user_item_matrix.toarray(),
+            'interactions': engine.interactions.toarray(),
+        }
+
+    def test_ingest_leaves_old_engine_unchanged(self):
+        engine = self.engine
+        before = self._snapshot(engine)
+        user_id, new_user = int(engine.user_ids[0]), 10 ** 9
+        products = engine.product_ids[:3].tolist()
+        updated = engine.ingest_ratings([
+            {'user_id': user_id, 'product_id': products[0], 'rating': 1},
+            {'user_id': new_user, 'product_id': products[1], 'rating': 5},
+        ]).ingest_transactions([{'user_id': new_user, 'product_id': products[2], 'quantity': 4}])
+
+        after = self._snapshot(engine)
+        for name in ('hybrid', 'item', 'popular'):
+            self.assertEqual(after[name], before[name], name)
+        for name in ('ratings', 'interactions'):
+            np.testing.assert_array_equal(after[name], before[name])
+        self.assertEqual(updated.revision, engine.revision + 2)
+        self.assertEqual(updated.user_item_matrix[[updated.user_positions[user_id]]].toarray()[0, 0], 1)
+        new_row = updated.interactions[[updated.interaction_positions[new_user]]].toarray()[0]
+        np.testing.assert_allclose(new_row[1:3], [1.0, 4.0])
+        self.assertNotIn(products[1], _ids(updated.get_item_based_recommendations(new_user, 10)))
+
+
+class SnapshotTests(SyntheticEngineTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def test_round_trip(self):
+        engine = self.engine
+        path = engine.save_artifacts(self.root)
+        loaded = RecommendationEngine(artifact_dir=path, **SYNTHETIC_OPTIONS)
+        self.assertEqual(loaded.model_version, engine.model_version)
+        for method in ('get_hybrid_recommendations_batch', 'get_collaborative_recommendations_batch',
+                       'get_factor_recommendations_batch', 'get_item_based_recommendations_batch'):
+            self.assertEqual(getattr(loaded, method)(self.user_ids, 10), getattr(engine, method)(self.user_ids, 10))
+        product_ids = engine.product_ids[::20].tolist()
+        self.assertEqual(loaded.get_content_based_recommendations_batch(product_ids, 10),
+                         engine.get_content_based_recommendations_batch(product_ids, 10))
+        self.assertEqual(loaded.get_popular_recommendations(10, trending=True),
+                         engine.get_popular_recommendations(10, trending=True))
+
+    def test_other_format_is_rejected(self):
+        path = self.engine.save_artifacts(self.root)
+        with open(os.path.join(path, MANIFEST)) as f:
+            manifest = json.load(f)
+        manifest['format'] -= 1
+        with open(os.path.join(path, MANIFEST), 'w') as f:
+            json.dump(manifest, f)
+        self.assertIsNone(latest_version(self.root))
+        with self.assertRaises(ValueError):
+            RecommendationEngine(artifact_dir=path, **SYNTHETIC_OPTIONS)
+
+    def test_precomputed_matches_live_hybrid(self):
+        path = self.engine.save_artifacts(self.root)
+        table = precompute_hybrid(path, n_recommendations=10, workers=1, chunk_size=64)
+        derived = publish_precomputed(self.root, self.engine.model_version, table)
+        engine = RecommendationEngine(artifact_dir=derived, **SYNTHETIC_OPTIONS)
+        live = engine.get_hybrid_recommendations_batch(engine.user_ids.tolist(), 10)
+        for user_id in engine.user_ids.tolist():
+            self.assertEqual(_ids(engine.get_precomputed_recommendations(user_id, 10)), _ids(live[user_id]))
+
+
+class ReloadTests(SyntheticEngineTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.enterContext(override_settings(RECOMMENDER_ARTIFACT_DIR=self.root, RECOMMENDER_INGEST_LOG_MAX_BATCHES=3))
+        self.enterContext(mock.patch.object(loader, '_engine', self.engine))
+        self.enterContext(mock.patch.object(loader, '_ingest_log', []))
+        # Batches are only logged while the snapshot watcher runs
+        self.enterContext(mock.patch.object(loader, '_watcher_thread', mock.Mock(is_alive=lambda: True)))
+
+    def test_batches_ingested_during_a_build_are_replayed(self):
+        before, during = 10 ** 9 + 1, 10 ** 9 + 2
+        product_id = int(self.engine.product_ids[0])
+        loader.ingest_ratings([{'user_id': before, 'product_id': product_id, 'rating': 4}])
+        build_models = RecommendationEngine.build_models
+
+        def build_during_ingest(engine):
+            # Arrives after the data was read, before the model is versioned
+            loader.ingest_ratings([{'user_id': during, 'product_id': product_id, 'rating': 2}])
+            build_models(engine)
+
+        with mock.patch.object(RecommendationEngine, 'build_models', build_during_ingest):
+            built = RecommendationEngine(data_dir=self.data_dir, **SYNTHETIC_OPTIONS)
+        self.assertGreater(built.model_version, loader._ingest_log[-1][0])
+        built.save_artifacts(self.root)
+
+        reloaded = loader.reload_latest_snapshot()
+        self.assertEqual(reloaded.model_version, built.model_version)
+        row = reloaded.user_item_matrix[[reloaded.user_positions[during]]].toarray()[0]
+        self.assertEqual(row[reloaded.product_positions[product_id]], 2)
+        # Batches from before the data was read are taken to be in it
+        self.assertNotIn(before, reloaded.user_positions)
+        self.assertEqual([batch[0]['user_id'] for _, _, batch in loader._ingest_log], [during])
+
+    def test_log_is_bounded(self):
+        user_id = int(self.engine.user_ids[0])
+        for product_id in self.engine.product_ids[:5].tolist():
+            loader.ingest_ratings([{'user_id': user_id, 'product_id': product_id, 'rating': 3}])
+        self.assertEqual([batch[0]['product_id'] for _, _, batch in loader._ingest_log],
+                         self.engine.product_ids[2:5].tolist())
+        with mock.patch.object(loader, '_watcher_thread', None):
+            loader.ingest_ratings([{'user_id': user_id, 'product_id': int(self.engine.product_ids[5]), 'rating': 3}])
+        self.assertEqual(len(loader._ingest_log), 3)
+
+
+class BenchCommandTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def _bench(self, *args):
+        """Run bench_recommender and return its JSON report"""
+        path = os.path.join(self.root, 'report.json')
+        call_command('bench_recommender', *args, '--json-output', path, stdout=StringIO())
+        with open(path) as f:
+            return json.load(f)
+
+    def test_imports_suite(self):
+        report = self._bench('--suite', 'imports')
+        self.assertEqual(report['suite'], 'imports')
+        self.assertGreater(report['results'][0]['metrics']['import_ms'], 0)
+
+    def test_engine_suite_on_synthetic_data(self):
+        report = self._bench('--suite', 'engine', '--items', '200', '--users', '300', '--queries', '5',
+                             '--top-k', '10')
+        calls = {row['params']['call']: row['metrics'] for row in report['results']}
+        self.assertGreater(calls.pop('build')['build_s'], 0)
+        self.assertLessEqual({'content', 'collaborative', 'hybrid', 'popular', 'catalog_page'}, set(calls))
+        for latency in calls.values():
+            self.assertLessEqual(latency['p50_ms'], latency['p99_ms'])
+
+    def test_compare_flags_regressions(self):
+        baseline = self._bench('--suite', 'imports')
+        baseline['results'][0]['metrics']['import_ms'] /= 10
+        path = os.path.join(self.root, 'baseline.json')
+        with open(path, 'w') as f:
+            json.dump(baseline, f)
+        stdout = StringIO()
+        call_command('bench_recommender', '--suite', 'imports', '--compare', path, stdout=stdout)
+        self.assertIn('1 regression(s)', stdout.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('bench_recommender', '--suite', 'build', '--sizes', '50', '--jobs', '1',
+                         '--compare', path, stdout=StringIO())
+
+
+class ApiTestCase(TestCase):
+    """Serves the data/ fixtures through the loader's engine"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.engine = RecommendationEngine(data_dir='data')
+        cls.engine.prime()
+        cls.previous_engine, loader._engine = loader._engine, cls.engine
+        cls.user_id = int(cls.engine.user_ids[0])
+        cls.product_id = int(cls.engine.product_ids[0])
+
+    @classmethod
+    def tearDownClass(cls):
+        loader._engine = cls.previous_engine
+        super().tearDownClass()
+
+    def setUp(self):
+        invalidate()
+
+
+class ApiViewTests(ApiTestCase):
+    def test_recommendation_endpoints(self):
+        user, product = f'/api/recommend/user/{self.user_id}/', f'/api/recommend/similar/{self.product_id}/'
+        for path in (f'{user}?n=3', f'{product}?n=3', f'/api/product/{self.product_id}/', '/api/ready/',
+                     '/api/metrics/'):
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200, path)
+            self.assertIn('Server-Timing', response)
+        self.assertEqual(self.client.post(product).status_code, 405)
+
+    def test_user_strategies(self):
+        for strategy in views.USER_STRATEGIES:
+            response = self.client.get(f'/api/recommend/user/{self.user_id}/?n=3&strategy={strategy}')
+            self.assertEqual(response.status_code, 200, strategy)
+            body = response.json()
+            self.assertFalse(body['fallback'])
+            self.assertEqual(len(body['recommendations']), 3)
+        self.assertEqual(self.client.get(f'/api/recommend/user/{self.user_id}/?strategy=nope').status_code, 400)
+
+    def test_popular(self):
+        for path in ('/api/recommend/popular/?n=3', '/api/recommend/popular/?n=3&trending=true'):
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200, path)
+            self.assertEqual(len(response.json()['recommendations']), 3)
+
+    def test_filter_parameters(self):
+        product = f'/api/recommend/similar/{self.product_id}/'
+        response = self.client.get(f'{product}?in_stock=true&n=3')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(all(record['stock'] > 0 for record in response.json()['recommendations']))
+        self.assertEqual(self.client.get(f'{product}?min_price=abc').status_code, 400)
+
+    def test_catalog_etag_and_gzip(self):
+        response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        compressed = self.client.get('/api/products/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed.content), response.content)
+        self.assertEqual(self.client.get('/api/product/999999/').status_code, 404)
+
+    def test_batch_ndjson(self):
+        user_ids = self.engine.user_ids[:3].tolist() + [10 ** 9]
+        response = self.client.post(
+            '/api/recommend/batch/', json.dumps({'ids': user_ids, 'n': 2, 'filters': {'in_stock': True}}),
+            content_type='application/json'
+        )
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([line['id'] for line in lines], user_ids)
+        self.assertTrue(all(len(line['recommendations']) == 2 for line in lines))
+
+    def test_batch_bad_requests(self):
+        for body in ('not json', '[1, 2]', '"x"', json.dumps({'ids': [1], 'type': 'shop'}), json.dumps({'n': 2})):
+            response = self.client.post('/api/recommend/batch/', body, content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+        with mock.patch.object(views, 'current_engine', return_value=None):
+            response = self.client.post('/api/recommend/batch/', json.dumps({'ids': [1]}),
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, 503)
+
+    def test_warming_up(self):
+        with mock.patch.object(views, 'current_engine', return_value=None):
+            response = self.client.get('/api/products/')
+            self.assertEqual(response.status_code, 503)
+            self.assertIn('Retry-After', response)
+            self.assertEqual(self.client.get('/api/ready/').status_code, 503)
+            body = self.client.get(f'/api/recommend/user/{self.user_id}/?n=3').json()
+            self.assertTrue(body['fallback'])
+            self.assertEqual(len(body['recommendations']), 3)
+
+
+class AsyncApiViewTests(ApiTestCase):
+    factory = AsyncRequestFactory()
+
+    async def test_recommendation_endpoints(self):
+        request = self.factory.get(f'/api/recommend/user/{self.user_id}/', {'n': 3})
+        response = await async_views.recommend_for_user(request, self.user_id)
+        self.assertEqual(response.status_code, 200)
+        expected = self.engine.get_hybrid_recommendations(self.user_id, 3)
+        self.assertEqual(_ids(json.loads(response.content)['recommendations']), _ids(expected))
+        response = await async_views.recommend_similar(self.factory.get('/'), self.product_id)
+        self.assertEqual(response.status_code, 200)
+        response = await async_views.recommend_for_user(self.factory.get('/', {'strategy': 'nope'}), self.user_id)
+        self.assertEqual(response.status_code, 400)
+
+    async def test_catalog_etag(self):
+        response = await async_views.products_list(self.factory.get('/api/products/'))
+        request = self.factory.get('/api/products/', headers={'If-None-Match': response['ETag']})
+        self.assertEqual((await async_views.products_list(request)).status_code, 304)
+
+    async def test_batch_ndjson(self):
+        user_ids = self.engine.user_ids[:3].tolist()
+        request = self.factory.post('/api/recommend/batch/', json.dumps({'ids': user_ids, 'n': 2}),
+                                    content_type='application/json')
+        response = await async_views.recommend_batch(request)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual([json.loads(line)['id'] for line in body.splitlines()], user_ids)
+
+    async def test_batch_rejects_non_object_body(self):
+        for body in ('[1, 2]', '"x"'):
+            request = self.factory.post('/api/recommend/batch/', body, content_type='application/json')
+            self.assertEqual((await async_views.recommend_batch(request)).status_code, 400, body)
+
+    async def test_overloaded(self):
+        with mock.patch.object(async_views, 'get_pool', return_value=OffloadPool(max_pending=0)):
+            response = await async_views.recommend_for_user(self.factory.get('/'), self.user_id)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '1')
+            request = self.factory.post('/api/recommend/batch/', json.dumps({'ids': [self.user_id]}),
+                                        content_type='application/json')
+            self.assertEqual((await async_views.recommend_batch(request)).status_code, 503)
+
+    async def test_timeout(self):
+        def slow(*args):
+            time.sleep(0.2)
+
+        with mock.patch.object(async_views, 'get_pool', return_value=OffloadPool(timeout=0.01)), \
+                mock.patch.object(views, '_user_recommendations', slow):
+            response = await async_views.recommend_for_user(self.factory.get('/'), self.user_id)
+        self.assertEqual(response.status_code, 504)
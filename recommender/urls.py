@@ -1,5 +1,9 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Async API views for ASGI servers, sync ones for WSGI
+api = async_views if settings.RECOMMENDER_ASYNC_VIEWS else views
 
 app_name = 'recommender'
 
@@ -9,8 +13,12 @@ urlpatterns = [
     path('product/<int:product_id>/', views.product_page, name='product_detail'),
     
     # API endpoints
-    path('api/recommend/similar/<int:product_id>/', views.recommend_similar, name='recommend_similar'),
-    path('api/recommend/user/<int:user_id>/', views.recommend_for_user, name='recommend_for_user'),
-    path('api/products/', views.products_list, name='products_list'),
-    path('api/product/<int:product_id>/', views.product_detail, name='product_api_detail'),
+    path('api/recommend/similar/<int:product_id>/', api.recommend_similar, name='recommend_similar'),
+    path('api/recommend/user/<int:user_id>/', api.recommend_for_user, name='recommend_for_user'),
+    path('api/recommend/popular/', api.recommend_popular, name='recommend_popular'),
+    path('api/recommend/batch/', api.recommend_batch, name='recommend_batch'),
+    path('api/products/', api.products_list, name='products_list'),
+    path('api/product/<int:product_id>/', api.product_detail, name='product_api_detail'),
+    path('api/ready/', api.readiness, name='readiness'),
+    path('api/metrics/', api.metrics_view, name='metrics'),
 ]
@@ -1,145 +1,305 @@
+from django.conf import settings
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from .engine import get_engine
+from . import metrics
+from .cache import cache_stats, get_or_compute
+from .filters import parse_filter
+from .images import get_product_image  # noqa: F401  (kept importable from views)
+from .loader import current_engine, engine_status, popular_fallback
 import json
+import re
 
-engine = get_engine()
-
-def get_product_image(product_id=None, product_name=None):
-    """Get product image URL based on product name mapping"""
-    # Mapping of product names to image files
-    product_image_map = {
-        'Wireless Earbuds': '/static/images/product_1.png',
-        'Bluetooth Speaker': '/static/images/product_2.png',
-        'Smart Watch': '/static/images/product_3.png',
-        'Fitness Band': '/static/images/product_4.png',
-        'Laptop Backpack': '/static/images/product_5.png',
-        "Men's Running Shoes": '/static/images/product_6.png',
-        "Women's Casual Shoes": '/static/images/product_7.png',
-        'Cotton T-Shirt': '/static/images/product_8.png',
-        'Jeans': '/static/images/product_9.png',
-        'DSLR Camera': '/static/images/product_10.png',
-        'USB-C Cable': '/static/images/product_11.png',
-        'Portable Hard Disk': '/static/images/product_12.png',
-        'Oven Toaster Grill': '/static/images/product_13.png',
-        'Mixer Grinder': '/static/images/product_14.png',
-        'Induction Stove': '/static/images/product_15.png',
-        'Pressure Cooker': '/static/images/product_16.png',
-        'Office Chair': '/static/images/product_17.png',
-        'Study Table': '/static/images/product_18.png',
-        'Bed Mattress': '/static/images/product_19.png',
-        'Table Lamp': '/static/images/product_20.png',
-    }
-    
-    # Try to get image by product name
-    if product_name and product_name in product_image_map:
-        return product_image_map[product_name]
+# Ids scored per engine call by the batch endpoint; bounds memory while streaming
+BATCH_CHUNK_SIZE = 1000
+# Products per page when ?page= is given without ?page_size=
+DEFAULT_PAGE_SIZE = 50
+# Engine batch method behind each ?strategy= of the user recommendation endpoints
+USER_STRATEGIES = {
+    'hybrid': 'get_hybrid_recommendations_batch',
+    'collaborative': 'get_collaborative_recommendations_batch',
+    'factors': 'get_factor_recommendations_batch',
+    'item_based': 'get_item_based_recommendations_batch',
+}
+_accepts_gzip = re.compile(r'\bgzip\b').search
+
+def _rendered_response(request, rendered):
+    """Serve a pre-rendered catalog body with ETag/304 and pre-compressed gzip"""
+    etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    if '*' in etags or rendered.etag in etags:
+        response = HttpResponseNotModified()
+    elif _accepts_gzip(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        response = HttpResponse(rendered.gzipped, content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(rendered.body, content_type='application/json')
+    response['ETag'] = rendered.etag
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+def _warming_up_response():
+    """503 answer for catalog endpoints while the engine is still being built"""
+    response = JsonResponse({
+        'status': 'error',
+        'message': 'Recommendation engine is warming up'
+    }, status=503)
+    response['Retry-After'] = '5'
+    return response
+
+def _cache_endpoint(endpoint, filters):
+    """Cache key endpoint, qualified by the filter when there is one"""
+    return endpoint if filters is None else f'{endpoint}:{filters.key()}'
+
+def _filters_echo(filters):
+    return filters.as_dict() if filters is not None else None
+
+def _similar_recommendations(engine, product_id, n, filters=None):
+    """Content-based results, or the popular fallback while warming up"""
+    if engine is None:
+        metrics.increment('fallbacks_total', strategy='warming_up')
+        return popular_fallback(n, filters)
+    # Content results only depend on the model, not on ingested batches
+    return get_or_compute(
+        _cache_endpoint('similar', filters), product_id, n, engine.model_version,
+        lambda: engine.get_content_based_recommendations(product_id, n, filters=filters)
+    )
+
+def _user_strategy(strategy):
+    """Validate a user recommendation strategy name"""
+    if strategy not in USER_STRATEGIES:
+        raise ValueError(f"strategy must be one of {', '.join(USER_STRATEGIES)}")
+    return strategy
+
+def _user_recommendations(engine, user_id, n, strategy='hybrid', filters=None):
+    """Results of one user strategy, or the popular fallback while warming up"""
+    if engine is None:
+        metrics.increment('fallbacks_total', strategy='warming_up')
+        return popular_fallback(n, filters)
     
-    # Fallback to generated images by product_id
-    if product_id:
-        return f'/static/images/product_{product_id}.jpg'
+    def compute():
+        recommendations = None
+        if strategy == 'hybrid' and filters is None:
+            # Served from the offline table when possible, scored live otherwise
+            recommendations = engine.get_precomputed_recommendations(user_id, n)
+        if recommendations is None:
+            recommendations = getattr(engine, USER_STRATEGIES[strategy])([user_id], n, filters=filters)[user_id]
+        return recommendations
     
-    # Default fallback
-    return '/static/images/product_1.jpg'
+    return get_or_compute(
+        _cache_endpoint(f'user:{strategy}', filters), user_id, n, f'{engine.model_version}.{engine.revision}', compute
+    )
+
+def _error_response(e, status=400):
+    return JsonResponse({
+        'status': 'error',
+        'message': str(e)
+    }, status=status)
 
 @require_http_methods(["GET"])
 def recommend_similar(request, product_id):
-    """API endpoint for content-based recommendations"""
+    """API endpoint for content-based recommendations (filters: see filters.py)"""
     try:
         n = int(request.GET.get('n', 5))
-        recommendations = engine.get_content_based_recommendations(product_id, n)
-        
-        # Add image URLs to recommendations
-        for rec in recommendations:
-            product_name = rec.get('name') or rec.get('product_name')
-            rec['image'] = get_product_image(product_name=product_name)
+        filters = parse_filter(request.GET)
+        engine = current_engine()
+        recommendations = _similar_recommendations(engine, product_id, n, filters)
         
         return JsonResponse({
             'status': 'success',
             'product_id': product_id,
-            'recommendations': recommendations
+            'filters': _filters_echo(filters),
+            'recommendations': recommendations,
+            'fallback': engine is None
         })
     except Exception as e:
-        return JsonResponse({
-            'status': 'error',
-            'message': str(e)
-        }, status=400)
+        return _error_response(e)
 
 @require_http_methods(["GET"])
 def recommend_for_user(request, user_id):
-    """API endpoint for hybrid recommendations"""
+    """API endpoint for user recommendations (?strategy=hybrid|collaborative|factors|item_based, filters)"""
     try:
         n = int(request.GET.get('n', 5))
-        recommendations = engine.get_hybrid_recommendations(user_id, n)
-        
-        # Add image URLs to recommendations
-        for rec in recommendations:
-            product_name = rec.get('name') or rec.get('product_name')
-            rec['image'] = get_product_image(product_name=product_name)
+        strategy = _user_strategy(request.GET.get('strategy', 'hybrid'))
+        filters = parse_filter(request.GET)
+        engine = current_engine()
+        recommendations = _user_recommendations(engine, user_id, n, strategy, filters)
         
         return JsonResponse({
             'status': 'success',
             'user_id': user_id,
-            'recommendations': recommendations
+            'strategy': strategy,
+            'filters': _filters_echo(filters),
+            'recommendations': recommendations,
+            'fallback': engine is None
         })
     except Exception as e:
-        return JsonResponse({
-            'status': 'error',
-            'message': str(e)
-        }, status=400)
+        return _error_response(e)
+
+def _popular_recommendations(engine, n, category=None, location=None, trending=False):
+    """Precomputed popularity ranking slice, or the popular fallback while warming up"""
+    if engine is None:
+        metrics.increment('fallbacks_total', strategy='warming_up')
+        return popular_fallback(n)
+    return engine.get_popular_recommendations(n, category, location, trending)
+
+def _popular_params(request):
+    """(n, category, location, trending) query parameters of the popular endpoint"""
+    return (
+        int(request.GET.get('n', 5)),
+        request.GET.get('category'),
+        request.GET.get('location'),
+        request.GET.get('trending', '').lower() in ('1', 'true'),
+    )
 
 @require_http_methods(["GET"])
-def products_list(request):
-    """Get all products"""
+def recommend_popular(request):
+    """API endpoint for popular products (?category=, ?location= or ?trending=true)"""
     try:
-        products_df = engine.products.copy()
-        # Add image URL based on product name (local images)
-        products_df['image'] = products_df['product_name'].apply(lambda name: get_product_image(product_name=name))
-        # Rename columns for API consistency
-        products_df = products_df.rename(columns={
-            'product_id': 'id',
-            'product_name': 'name'
-        })
-        products = products_df.to_dict('records')
+        n, category, location, trending = _popular_params(request)
+        engine = current_engine()
+        recommendations = _popular_recommendations(engine, n, category, location, trending)
+        
         return JsonResponse({
             'status': 'success',
-            'products': products
+            'category': category,
+            'location': location,
+            'trending': trending,
+            'recommendations': recommendations,
+            'fallback': engine is None
         })
     except Exception as e:
-        return JsonResponse({
-            'status': 'error',
-            'message': str(e)
-        }, status=400)
+        return _error_response(e)
+
+def _parse_batch(request):
+    """(kind, ids, n, strategy, filters) from a batch request body; raises ValueError, TypeError or KeyError"""
+    payload = json.loads(request.body)
+    if not isinstance(payload, dict):
+        raise ValueError('body must be a JSON object')
+    kind = payload.get('type', 'user')
+    if kind not in ('user', 'product'):
+        raise ValueError("type must be 'user' or 'product'")
+    ids = [int(item_id) for item_id in payload['ids']]
+    n = int(payload.get('n', 5))
+    strategy = _user_strategy(payload.get('strategy', 'hybrid'))
+    filters = payload.get('filters') or {}
+    if not isinstance(filters, dict):
+        raise TypeError('filters must be an object')
+    return kind, ids, n, strategy, parse_filter(filters)
+
+
+def _batch_chunk(engine, kind, chunk, n, strategy='hybrid', filters=None):
+    """Score one chunk of a batch request and render it as NDJSON lines"""
+    if kind == 'user':
+        results = getattr(engine, USER_STRATEGIES[strategy])(chunk, n, filters=filters)
+    else:
+        results = engine.get_content_based_recommendations_batch(chunk, n, filters=filters)
+    
+    # Engine records already carry their image URL
+    lines = [
+        json.dumps({'id': item_id, 'recommendations': results.get(item_id, [])}, cls=DjangoJSONEncoder)
+        for item_id in chunk
+    ]
+    return '\n'.join(lines) + '\n'
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def recommend_batch(request):
+    """API endpoint for batch recommendations, streamed back as NDJSON.
+
+    Body: {"type": "user" | "product", "ids": [...], "n": 5, "strategy": "hybrid",
+    "filters": {"category": [...], "brand": [...], "min_price": 0, "max_price": 999, "in_stock": true}}.
+    Each output line is {"id": ..., "recommendations": [...]} in request
+    order; users get recommendations of the given strategy (see the user
+    endpoint) and products get content-based ones.
+    """
+    try:
+        kind, ids, n, strategy, filters = _parse_batch(request)
+    except (ValueError, TypeError, KeyError) as e:
+        return _error_response(f'Invalid batch request: {e}')
+    
+    engine = current_engine()
+    if engine is None:
+        return _warming_up_response()
+    
+    def stream():
+        for start in range(0, len(ids), BATCH_CHUNK_SIZE):
+            yield _batch_chunk(engine, kind, ids[start:start + BATCH_CHUNK_SIZE], n, strategy, filters)
+    
+    return StreamingHttpResponse(stream(), content_type='application/x-ndjson')
+
+def _products_list_response(request, engine):
+    if engine is None:
+        return _warming_up_response()
+    page = request.GET.get('page')
+    if page is None:
+        rendered = engine.catalog.page()
+    else:
+        rendered = engine.catalog.page(int(page), int(request.GET.get('page_size', DEFAULT_PAGE_SIZE)))
+    return _rendered_response(request, rendered)
+
+@require_http_methods(["GET"])
+def products_list(request):
+    """Get all products, or one page of them with ?page=&page_size="""
+    try:
+        return _products_list_response(request, current_engine())
+    except Exception as e:
+        return _error_response(e)
+
+def _product_detail_response(engine, product_id):
+    if engine is None:
+        return _warming_up_response()
+    product = engine.catalog.product(product_id)
+    if product is None:
+        return _error_response('Product not found', status=404)
+    return HttpResponse(b'{"status": "success", "product": ' + product + b'}', content_type='application/json')
 
 @require_http_methods(["GET"])
 def product_detail(request, product_id):
     """Get product details"""
     try:
-        product_row = engine.products[engine.products['product_id'] == product_id]
-        if product_row.empty:
-            return JsonResponse({
-                'status': 'error',
-                'message': 'Product not found'
-            }, status=404)
-        
-        product = product_row.iloc[0].to_dict()
-        product_name = product.get('product_name', 'Product')
-        # Rename for API consistency
-        product['id'] = product.pop('product_id', product_id)
-        product['name'] = product.pop('product_name', 'Product')
-        # Add image URL based on product name
-        product['image'] = get_product_image(product_name=product_name)
-        
-        return JsonResponse({
-            'status': 'success',
-            'product': product
-        })
+        return _product_detail_response(current_engine(), product_id)
     except Exception as e:
-        return JsonResponse({
-            'status': 'error',
-            'message': str(e)
-        }, status=400)
+        return _error_response(e)
+
+def _readiness_response(engine):
+    return JsonResponse({
+        'status': engine_status(),
+        'model_version': engine.model_version if engine is not None else None,
+        'cache': cache_stats()
+    }, status=200 if engine is not None else 503)
+
+@require_http_methods(["GET"])
+def readiness(request):
+    """Readiness probe: 200 once the engine is built, 503 while warming up"""
+    return _readiness_response(current_engine())
+
+def _metrics_response(engine):
+    """Prometheus text exposition of this process's metrics"""
+    cache = cache_stats()
+    collected = [
+        ('cache_hits_total', 'counter', 'Result cache hits', {}, cache['hits']),
+        ('cache_misses_total', 'counter', 'Result cache misses', {}, cache['misses']),
+        ('cache_invalidations_total', 'counter', 'Result cache clears', {}, cache['invalidations']),
+        ('cache_hit_ratio', 'gauge', 'Result cache hits per lookup', {}, cache['hit_ratio']),
+        ('engine_ready', 'gauge', 'Whether the engine is built (1) or warming up (0)', {}, int(engine is not None)),
+    ]
+    if settings.RECOMMENDER_ASYNC_VIEWS:
+        from .offload import get_pool
+        collected.append(('offload_pending', 'gauge', 'Engine calls running or queued in the offload pool', {},
+                          get_pool().pending))
+    if engine is not None:
+        collected.append(('model_info', 'gauge', 'Model version being served', {'version': engine.model_version}, 1))
+        collected.append(('model_revision', 'gauge', 'Ingest batches applied to the model', {}, engine.revision))
+    return HttpResponse(metrics.render(collected), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@require_http_methods(["GET"])
+def metrics_view(request):
+    """Metrics endpoint for Prometheus scrapes"""
+    return _metrics_response(current_engine())
 
 def index(request):
     """Frontend index page"""